@@ -228,8 +228,8 @@ export const commentApi = {
   getCommentsStats: () => {
     return api.get('/api/v1/content/comments/stats');
   },
-  getUserComments: (userId) => {
-    return api.get(`/api/v1/content/comments/user/${userId}`);
+  getUserComments: (userId, params) => {
+    return api.get(`/api/v1/content/comments/user/${userId}`, { params });
   },
   deleteComment: (commentId) => {
     return api.delete(`/api/v1/content/comments/${commentId}`);
@@ -0,0 +1,82 @@
+/**
+ * 滚动加载工具函数
+ *
+ * 列表接口返回 next_cursor（游标分页），滚动到列表底部时用游标加载下一页并追加到列表，
+ * 深度翻页不会像 page/page_size 那样越来越慢
+ */
+import { ref, watch, nextTick, onBeforeUnmount } from 'vue';
+
+/**
+ * 创建滚动加载状态
+ * @param {Function} loadMore 加载下一页（使用 nextCursor）并追加数据的函数
+ * @returns {{ enabled: Ref<boolean>, nextCursor: Ref<string|null>, sentinel: Ref<Element|null> }}
+ *   enabled 为是否使用滚动加载；sentinel 绑定到列表底部的元素，进入视口时加载下一页
+ */
+// 底部元素距视口多远时开始加载下一页（像素）
+const PRELOAD_MARGIN = 200;
+
+export const useInfiniteScroll = (loadMore) => {
+  const enabled = ref(false);
+  const nextCursor = ref(null);
+  const sentinel = ref(null);
+  let observer = null;
+  let busy = false;
+
+  // 按当前布局判断底部元素是否在视口（含预加载距离）内。
+  // 观察器只在可见性变化时回调，数据不足一屏时底部元素一直可见，不会再次回调
+  const sentinelVisible = () => {
+    if (!sentinel.value) {
+      return false;
+    }
+    const rect = sentinel.value.getBoundingClientRect();
+    return rect.top <= window.innerHeight + PRELOAD_MARGIN && rect.bottom >= -PRELOAD_MARGIN;
+  };
+
+  const trigger = async () => {
+    // 加载后底部元素仍在视口内（数据不足一屏）时继续加载
+    while (enabled.value && nextCursor.value && !busy && sentinelVisible()) {
+      const cursor = nextCursor.value;
+      busy = true;
+      try {
+        await loadMore();
+      } finally {
+        busy = false;
+      }
+      if (nextCursor.value === cursor) {
+        // 加载失败，等待下次滚动再重试
+        break;
+      }
+      await nextTick();
+    }
+  };
+
+  watch(sentinel, (element) => {
+    if (observer) {
+      observer.disconnect();
+      observer = null;
+    }
+    if (!element) {
+      return;
+    }
+    observer = new IntersectionObserver((entries) => {
+      if (entries.some(entry => entry.isIntersecting)) {
+        trigger();
+      }
+    }, { rootMargin: `${PRELOAD_MARGIN}px` });
+    observer.observe(element);
+  });
+
+  // 首页（或其他方式加载的一页）渲染后，底部元素已在视口内时不会触发观察器，需要主动检查
+  watch([nextCursor, enabled], async () => {
+    await nextTick();
+    trigger();
+  });
+
+  onBeforeUnmount(() => {
+    if (observer) {
+      observer.disconnect();
+    }
+  });
+
+  return { enabled, nextCursor, sentinel };
+};
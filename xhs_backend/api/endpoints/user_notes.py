@@ -11,6 +11,8 @@ from database import (
 )
 from api.deps import get_current_user, get_current_user_combined
 from api.services.notification import save_user_note, get_user_notes
+from api.services.pagination import find_page
+from api.services.totals import total_counter, TOTALS_DEFAULT_MODE, TOTAL_MODE_PATTERN
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -242,6 +244,9 @@ async def get_user_notes_with_comments(
     user_id: Optional[str] = Query(None, description="用户ID，为空则查询所有"),
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 nextCursor），提供时忽略 page"),
+    total_mode: str = Query(TOTALS_DEFAULT_MODE, alias="total", pattern=TOTAL_MODE_PATTERN,
+                            description="总数计算方式: exact（精确，短时缓存）、estimate（估算）、none（不计算）"),
     request: Request = None,
     current_user: str = Depends(get_current_user_combined)
 ):
@@ -252,6 +257,8 @@ async def get_user_notes_with_comments(
         user_id: 可选的用户ID过滤
         page: 页码
         page_size: 每页数量
+        cursor: 分页游标，按游标翻页时任意深度的页面耗时相同（不计算总数）
+        total_mode: 总数计算方式，pagination.totalExact 表示总数是否精确
         current_user: 当前用户
         
     Returns:
@@ -270,16 +277,15 @@ async def get_user_notes_with_comments(
         if user_id:
             query["userId"] = user_id
         
-        # 计算总数
-        total_count = await user_notes_collection.count_documents(query)
+        # 计算总数（游标翻页时不计算）
+        total_count, total_exact = await total_counter.count(
+            user_notes_collection, query, "none" if cursor else total_mode
+        )
         
-        # 分页查询用户备注
-        skip = (page - 1) * page_size
-        user_notes = await user_notes_collection.find(query)\
-            .sort("updatedAt", -1)\
-            .skip(skip)\
-            .limit(page_size)\
-            .to_list(length=None)
+        # 分页查询用户备注（按 updatedAt 倒序，_id 保证顺序稳定）
+        user_notes, next_cursor = await find_page(
+            user_notes_collection, query, "updatedAt", page_size, cursor=cursor, page=page
+        )
         
         # 处理结果（转换_id为字符串）
         for note in user_notes:
@@ -316,7 +322,7 @@ async def get_user_notes_with_comments(
             result_data.append(note_with_comment)
         
         # 计算分页信息
-        total_pages = (total_count + page_size - 1) // page_size
+        total_pages = (total_count + page_size - 1) // page_size if total_count is not None else None
         
         return {
             "success": True,
@@ -327,13 +333,17 @@ async def get_user_notes_with_comments(
                     "page": page,
                     "pageSize": page_size,
                     "totalCount": total_count,
+                    "totalExact": total_exact,
                     "totalPages": total_pages,
-                    "hasNext": page < total_pages,
-                    "hasPrev": page > 1
+                    "hasNext": next_cursor is not None,
+                    "hasPrev": page > 1 and not cursor,
+                    "nextCursor": next_cursor
                 }
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"查询关联评论的用户备注时发生错误")
         raise HTTPException(
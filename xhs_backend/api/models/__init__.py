@@ -19,7 +19,8 @@ from .notification import InteractionInfo
 # 网络数据相关模型
 from .network import (
     RawNetworkData,
-    DataProcessingResult
+    DataProcessingResult,
+    IngestTicket
 )
 
 # 内容相关模型
@@ -51,6 +52,7 @@ __all__ = [
     # 网络数据模型
     'RawNetworkData',
     'DataProcessingResult',
+    'IngestTicket',
 
     # 内容模型
     'CommentItem',
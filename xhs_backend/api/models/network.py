@@ -34,4 +34,22 @@ class DataProcessingResult(BaseModel):
     items_extracted: int = 0
     items_saved: int = 0
     error_message: Optional[str] = None
-    processing_time_ms: int = 0 
\ No newline at end of file
+    processing_time_ms: int = 0
+    deduplicated: bool = False  # 是否为最近已处理过的重复上传（跳过了解析和保存）
+    dedup_stats: Optional[Dict[str, Any]] = None  # 去重命中率计数
+    stage_timings_ms: Optional[Dict[str, float]] = None  # 各处理阶段耗时（毫秒）
+    idempotent_replay: bool = False  # 是否为已处理过的幂等键，直接返回了保存的结果
+
+# === 异步摄取票据模型 ===
+class IngestTicket(BaseModel):
+    """异步摄取票据，记录一次排队上传的处理状态"""
+    ticket_id: str = Field(..., description="票据ID")
+    status: str = Field(..., description="处理状态：queued、processing、succeeded、failed")
+    rule_name: Optional[str] = Field(None, description="匹配的抓取规则名称")
+    url: Optional[str] = Field(None, description="请求URL")
+    submitted_by: Optional[str] = Field(None, description="上传用户")
+    attempts: int = Field(default=0, description="已尝试处理的次数")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    result: Optional[DataProcessingResult] = Field(None, description="处理完成后的结果")
+    error_message: Optional[str] = Field(None, description="处理失败时的错误信息")
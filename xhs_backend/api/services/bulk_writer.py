@@ -0,0 +1,316 @@
+"""
+批量写入服务
+
+提供两种实体写入方式：
+1. write_entities: 立即写入，每个集合一次无序批量写入
+2. BufferedBulkWriter: 进程内写后缓冲，在时间窗口或数量上限内按ID合并重复的更新插入，
+   热门笔记、用户在持续上传下被反复写入时只落库一次
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .comment import save_comments_with_upsert, save_structured_comments
+from .entity_merge import (
+    ENTITY_USERS, ENTITY_NOTES, ENTITY_STRUCTURED_COMMENTS, ENTITY_COMMENTS,
+    entity_id, merge_entity
+)
+from .metrics import detached_mongo_ops, observe_collection_save
+from .note import save_notes
+from .user import save_user_infos
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_ENABLED = os.environ.get("WRITE_BUFFER_ENABLED", "false").lower() == "true"
+WRITE_BUFFER_WINDOW_MS = int(os.environ.get("WRITE_BUFFER_WINDOW_MS", 500))  # 最长缓冲时间
+WRITE_BUFFER_MAX_ENTRIES = int(os.environ.get("WRITE_BUFFER_MAX_ENTRIES", 1000))  # 缓冲实体数达到该值时立即写入
+WRITE_BUFFER_MAX_RETRIES = int(os.environ.get("WRITE_BUFFER_MAX_RETRIES", 3))  # 写入失败的实体放回缓冲重试的次数
+
+# 各实体类型对应的批量保存函数
+ENTITY_SAVERS = {
+    ENTITY_USERS: save_user_infos,
+    ENTITY_NOTES: save_notes,
+    ENTITY_STRUCTURED_COMMENTS: save_structured_comments,
+    ENTITY_COMMENTS: save_comments_with_upsert,
+}
+
+# 支持写后缓冲的实体类型（旧版评论集合需要读取合并，始终直接写入）
+BUFFERED_ENTITY_TYPES = (ENTITY_USERS, ENTITY_NOTES, ENTITY_STRUCTURED_COMMENTS)
+
+async def write_entities(entities: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    立即保存实体，每个集合一次批量写入，各集合并发执行
+
+    Returns:
+        每个实体类型的写入结果: {'failed_ids': 写入失败的ID集合, 'error': 整体失败时的错误信息,
+        'elapsed_ms': 该集合批量写入的耗时}
+    """
+    async def timed_save(entity_type: str):
+        started = time.perf_counter()
+        try:
+            return await ENTITY_SAVERS[entity_type](entities[entity_type])
+        finally:
+            elapsed_ms[entity_type] = (time.perf_counter() - started) * 1000
+            observe_collection_save(entity_type, elapsed_ms[entity_type])
+
+    elapsed_ms: Dict[str, float] = {}
+    entity_types = [entity_type for entity_type in ENTITY_SAVERS if entities.get(entity_type)]
+    results = await asyncio.gather(
+        *(timed_save(entity_type) for entity_type in entity_types),
+        return_exceptions=True
+    )
+
+    outcomes = {}
+    for entity_type, result in zip(entity_types, results):
+        if isinstance(result, Exception):
+            logger.error(f"保存 {entity_type} 时发生错误: {result}")
+            outcomes[entity_type] = {
+                'failed_ids': {entity_id(entity_type, entity) for entity in entities[entity_type]},
+                'error': str(result)
+            }
+        else:
+            outcomes[entity_type] = {
+                'failed_ids': set(result.get('failed_ids') or []),
+                'error': result.get('error')
+            }
+        outcomes[entity_type]['elapsed_ms'] = round(elapsed_ms.get(entity_type, 0.0), 3)
+    return outcomes
+
+class BufferedBulkWriter:
+    """
+    进程内写后缓冲
+
+    提交的实体按类型和ID合并（后到的非空值覆盖先前的值），由后台协程在时间窗口到期
+    或缓冲数量达到上限时交给 write_entities 写入。需要读到自己写入结果的调用方
+    可以使用 durable=True 等待包含其数据的那次写入完成；非 durable 模式下写入结果
+    通过返回值中的 pending（Future）在写入后取得。写入失败的实体放回缓冲，
+    在之后的写入中重试（最多 WRITE_BUFFER_MAX_RETRIES 次）。
+    """
+
+    def __init__(
+        self,
+        window_ms: int = WRITE_BUFFER_WINDOW_MS,
+        max_entries: int = WRITE_BUFFER_MAX_ENTRIES,
+        max_retries: int = WRITE_BUFFER_MAX_RETRIES
+    ):
+        self.window_ms = window_ms
+        self.max_entries = max_entries
+        self.max_retries = max_retries
+        self._buffers: Dict[str, Dict[Any, Dict[str, Any]]] = {t: {} for t in BUFFERED_ENTITY_TYPES}
+        self._waiters: List[asyncio.Future] = []
+        self._durable_waiters = 0
+        # 写入失败后放回缓冲的实体已重试的次数: {(实体类型, ID): 次数}
+        self._retries: Dict[Tuple[str, Any], int] = {}
+        # 事件循环相关对象在首次使用时创建（Python 3.9 下会在构造时绑定事件循环）
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closing = False
+
+        self.submitted = 0
+        self.flush_count = 0
+        self.flushed_entities = 0
+        self.failed_entities = 0
+        self.requeued_entities = 0
+        self.dropped_entities = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def depth(self) -> int:
+        """当前缓冲中等待写入的实体数"""
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    async def submit(self, entities: Dict[str, List[Dict[str, Any]]], durable: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        提交待保存的实体
+
+        不支持缓冲的实体类型会立即写入。
+
+        Args:
+            entities: 按实体类型分类的实体列表
+            durable: 是否等待数据真正写入数据库（立即触发一次写入，不等待时间窗口）
+
+        Returns:
+            写入结果（格式同 write_entities）。非 durable 模式下缓冲的实体视为已接受，不含失败信息，
+            其 'pending' 为该次写入完成后得到写入结果的 Future
+        """
+        self._ensure_started()
+
+        direct = {
+            entity_type: items for entity_type, items in entities.items()
+            if items and entity_type not in self._buffers
+        }
+        direct_task = asyncio.ensure_future(write_entities(direct)) if direct else None
+
+        buffered_types = []
+        for entity_type, buffer in self._buffers.items():
+            items = entities.get(entity_type) or []
+            for entity in items:
+                key = entity_id(entity_type, entity)
+                if not key:
+                    continue
+                buffer[key] = merge_entity(buffer[key], entity) if key in buffer else entity
+                self.submitted += 1
+            if items:
+                buffered_types.append(entity_type)
+
+        waiter = None
+        if buffered_types:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            if durable:
+                self._durable_waiters += 1
+        # 有调用方等待写入时立即唤醒写入循环，不等时间窗口到期
+        if (waiter is not None and durable) or self.depth() >= self.max_entries:
+            self._wakeup.set()
+
+        outcomes = {entity_type: {'failed_ids': set(), 'error': None} for entity_type in buffered_types}
+        if waiter is not None:
+            if durable:
+                flushed = await waiter
+                outcomes.update({entity_type: flushed[entity_type] for entity_type in buffered_types if entity_type in flushed})
+            else:
+                for entity_type in buffered_types:
+                    outcomes[entity_type]['pending'] = waiter
+        if direct_task is not None:
+            outcomes.update(await direct_task)
+        return outcomes
+
+    async def flush(self) -> Dict[str, Dict[str, Any]]:
+        """立即写入当前缓冲的全部实体，并唤醒等待这些数据的调用方"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            buffers = self._buffers
+            waiters = self._waiters
+            self._buffers = {t: {} for t in BUFFERED_ENTITY_TYPES}
+            self._waiters = []
+            self._durable_waiters = 0
+
+            entities = {entity_type: list(buffer.values()) for entity_type, buffer in buffers.items() if buffer}
+            outcomes: Dict[str, Dict[str, Any]] = {}
+            if entities:
+                started = time.monotonic()
+                try:
+                    outcomes = await write_entities(entities)
+                except Exception as e:
+                    logger.exception(f"写后缓冲批量写入失败: {e}")
+                    outcomes = {
+                        entity_type: {'failed_ids': set(buffer.keys()), 'error': str(e)}
+                        for entity_type, buffer in buffers.items() if buffer
+                    }
+                elapsed_ms = (time.monotonic() - started) * 1000
+
+                self.flush_count += 1
+                self.flushed_entities += sum(len(items) for items in entities.values())
+                self.failed_entities += sum(len(outcome['failed_ids']) for outcome in outcomes.values())
+                self._requeue_failed(buffers, outcomes)
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                self._total_flush_ms += elapsed_ms
+                logger.debug(
+                    "写后缓冲已写入: "
+                    + ", ".join(f"{entity_type}={len(items)}" for entity_type, items in entities.items())
+                    + f", 耗时 {elapsed_ms:.1f}ms"
+                )
+
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(outcomes)
+            return outcomes
+
+    def _requeue_failed(self, buffers: Dict[str, Dict[Any, Dict[str, Any]]], outcomes: Dict[str, Dict[str, Any]]):
+        """写入失败的实体放回缓冲（与期间新提交的同一实体合并），超过重试次数的丢弃并记录错误"""
+        for entity_type, buffer in buffers.items():
+            outcome = outcomes.get(entity_type)
+            if not buffer or outcome is None:
+                continue
+            # 整体失败但未列出失败ID时视为全部失败
+            failed_ids = outcome['failed_ids'] or (set(buffer) if outcome.get('error') else set())
+            for key, entity in buffer.items():
+                retry_key = (entity_type, key)
+                if key not in failed_ids:
+                    self._retries.pop(retry_key, None)
+                    continue
+                retries = self._retries.get(retry_key, 0) + 1
+                if retries > self.max_retries:
+                    self._retries.pop(retry_key, None)
+                    self.dropped_entities += 1
+                    logger.error(f"写后缓冲中的 {entity_type} {key} 重试 {self.max_retries} 次后仍写入失败，已丢弃")
+                    continue
+                self._retries[retry_key] = retries
+                current = self._buffers[entity_type]
+                current[key] = merge_entity(entity, current[key]) if key in current else entity
+                self.requeued_entities += 1
+
+    async def close(self):
+        """停止后台写入协程并写入剩余数据（应用关闭时调用）"""
+        if self._flush_task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await self._flush_task
+        except Exception as e:
+            logger.error(f"写后缓冲后台协程异常退出: {e}")
+        self._flush_task = None
+        # 后台协程退出后可能仍有新提交的数据
+        await self.flush()
+        self._closing = False
+        if self.depth():
+            logger.error(f"写后缓冲关闭时仍有 {self.depth()} 条实体写入失败，已丢弃")
+        logger.info("写后缓冲已关闭")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓冲队列深度与写入耗时统计"""
+        return {
+            "enabled": WRITE_BUFFER_ENABLED,
+            "window_ms": self.window_ms,
+            "max_entries": self.max_entries,
+            "depth": self.depth(),
+            "depth_by_type": {entity_type: len(buffer) for entity_type, buffer in self._buffers.items()},
+            "durable_waiters": self._durable_waiters,
+            "submitted": self.submitted,
+            "flushed_entities": self.flushed_entities,
+            "coalesced": max(self.submitted - self.flushed_entities - self.depth(), 0),
+            "failed_entities": self.failed_entities,
+            "requeued_entities": self.requeued_entities,
+            "dropped_entities": self.dropped_entities,
+            "flush_count": self.flush_count,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flush_count, 2) if self.flush_count else 0.0
+        }
+
+    def _ensure_started(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """后台写入循环：时间窗口到期或被唤醒时写入"""
+        # 后台协程从首次提交的上传复制了上下文，合并写入的命令不应计入那次上传
+        with detached_mongo_ops():
+            await self._run_loop()
+
+    async def _run_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"写后缓冲写入循环出错: {e}")
+            if self._closing:
+                return
+
+# 全局写后缓冲实例（WRITE_BUFFER_ENABLED 时由网络数据处理器使用，应用关闭时写入剩余数据）
+bulk_writer = BufferedBulkWriter()
@@ -4,13 +4,17 @@
 提供评论数据处理、结构化和查询的业务逻辑
 """
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional
 from datetime import datetime
 import pymongo
 import re
 from typing import Tuple
 from api.models.user import UserNote
 from api.models.content import StructuredComment
+from .query_cache import query_cache, write_tags
+from .rollups import bulk_error_upserted_ids, record_documents, upserted_documents
+from .search_index import search_tokens_update
+from .totals import total_counter
 # 配置日志
 logger = logging.getLogger(__name__)
 
@@ -61,7 +65,7 @@ def match_usernote_and_comments(usernotes: List[UserNote], comments: List[Struct
 
 # --- 递归合并评论数据的辅助函数 ---
 def merge_comment_data(existing_comment: Dict[str, Any], new_comment_data: Dict[str, Any]) -> Dict[str, Any]:
-    """递归合并新的评论数据到现有文档中，特别处理replies"""
+    """递归合并新的评论数据到现有文档中，特别处理replies（按ID建立索引，一次遍历完成）"""
     merged_comment = existing_comment.copy() # Start with existing data
 
     # 更新顶层字段 (除了 _id 和 replies)
@@ -69,116 +73,453 @@ def merge_comment_data(existing_comment: Dict[str, Any], new_comment_data: Dict[
         if key not in ["_id", "replies"]:
             merged_comment[key] = value
 
-    # 合并 replies
-    existing_replies = merged_comment.get("replies", [])
     new_replies = new_comment_data.get("replies", [])
-
     if not new_replies: # 如果新数据没有回复，保留现有的
         return merged_comment
 
+    merged_comment["replies"] = merge_reply_lists(merged_comment.get("replies", []), new_replies)
+    return merged_comment
+
+def merge_reply_lists(existing_replies: List[Dict[str, Any]], new_replies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """合并回复列表：已有回复按原顺序保留（匹配到的递归合并），新回复追加在末尾"""
+    new_replies_map = {reply["id"]: reply for reply in new_replies if reply.get("id")}
     merged_replies_list = []
-    existing_replies_map = {reply["id"]: reply for reply in existing_replies if reply.get("id")}
     processed_new_reply_ids = set()
 
-    # 遍历现有回复，更新或保留
     for existing_reply in existing_replies:
         reply_id = existing_reply.get("id")
-        if reply_id and reply_id in existing_replies_map:
-            corresponding_new_reply = next((nr for nr in new_replies if nr.get("id") == reply_id), None)
-            if corresponding_new_reply:
-                # 找到匹配的新回复，递归合并
-                merged_reply = merge_comment_data(existing_reply, corresponding_new_reply)
-                merged_replies_list.append(merged_reply)
-                processed_new_reply_ids.add(reply_id)
-            else:
-                # 新数据中没有此回复，保留旧的
-                merged_replies_list.append(existing_reply)
+        corresponding_new_reply = new_replies_map.get(reply_id) if reply_id else None
+        if corresponding_new_reply is not None:
+            merged_replies_list.append(merge_comment_data(existing_reply, corresponding_new_reply))
+            processed_new_reply_ids.add(reply_id)
         else:
-             # 现有回复无ID或映射中找不到(理论上不应发生)，保留
-             merged_replies_list.append(existing_reply)
+            # 新数据中没有此回复（或回复无ID），保留旧的
+            merged_replies_list.append(existing_reply)
 
     # 添加新回复中未处理（即不存在于旧数据中）的回复
     for new_reply in new_replies:
         reply_id = new_reply.get("id")
         if not reply_id or reply_id not in processed_new_reply_ids:
             merged_replies_list.append(new_reply)
+            if reply_id:
+                processed_new_reply_ids.add(reply_id)
 
-    merged_comment["replies"] = merged_replies_list
-    return merged_comment
+    return merged_replies_list
+
+# 比较回复是否变化时忽略的字段（每次抓取都会变化）
+_VOLATILE_COMMENT_FIELDS = ("fetchTimestamp",)
+
+def _comment_changed(before: Dict[str, Any], after: Dict[str, Any]) -> bool:
+    keys = (set(before) | set(after)) - set(_VOLATILE_COMMENT_FIELDS)
+    return any(before.get(key) != after.get(key) for key in keys)
+
+def build_comment_merge_operations(existing_comment: Dict[str, Any], new_comment_data: Dict[str, Any]) -> List[Any]:
+    """
+    生成把新评论数据合并到已有文档的更新操作（不替换整个文档）
+
+    - 顶层变化字段使用 $set
+    - 已有且内容变化的回复通过 arrayFilters 按回复ID原位更新
+    - 新回复逐条 $push，过滤条件要求该ID尚不存在，重试或并发时不会重复追加
+
+    Returns:
+        pymongo 更新操作列表，无变化时为空
+    """
+    doc_id = existing_comment["_id"]
+    operations = []
+
+    set_fields = {
+        key: value for key, value in new_comment_data.items()
+        if key not in ("_id", "replies", "id", "noteId", *_VOLATILE_COMMENT_FIELDS)
+        and existing_comment.get(key) != value
+    }
+
+    existing_replies_map = {
+        reply["id"]: reply for reply in existing_comment.get("replies", []) or [] if reply.get("id")
+    }
+    array_filters = []
+    pushed_ids = set()
+    for new_reply in new_comment_data.get("replies", []) or []:
+        reply_id = new_reply.get("id")
+        existing_reply = existing_replies_map.get(reply_id) if reply_id else None
+        if existing_reply is not None:
+            merged_reply = merge_comment_data(existing_reply, new_reply)
+            if _comment_changed(existing_reply, merged_reply):
+                identifier = f"r{len(array_filters)}"
+                set_fields[f"replies.$[{identifier}]"] = merged_reply
+                array_filters.append({f"{identifier}.id": reply_id})
+        elif reply_id:
+            if reply_id in pushed_ids:
+                continue
+            pushed_ids.add(reply_id)
+            operations.append(pymongo.UpdateOne(
+                {"_id": doc_id, "replies.id": {"$ne": reply_id}},
+                {"$push": {"replies": new_reply}}
+            ))
+        else:
+            operations.append(pymongo.UpdateOne({"_id": doc_id}, {"$push": {"replies": new_reply}}))
+
+    if set_fields or operations:
+        # 有实际变化时才顺带更新抓取时间，只有抓取时间变化的评论不写入
+        set_fields.update({
+            key: new_comment_data[key] for key in _VOLATILE_COMMENT_FIELDS if key in new_comment_data
+        })
+    if set_fields:
+        # 字段更新放在追加回复之前，两者不能在同一个更新中修改 replies
+        operations.insert(0, pymongo.UpdateOne(
+            {"_id": doc_id},
+            {"$set": set_fields},
+            array_filters=array_filters or None
+        ))
+    return operations
 
 async def save_comments_with_upsert(data: List[Dict[str, Any]]):
-    """保存评论列表，如果评论已存在则合并更新，特别是replies"""
+    """
+    保存评论列表，如果评论已存在则合并更新，特别是replies
+
+    一次 $in 查询读取已有评论，变化部分转换为更新操作，整批一次无序批量写入
+    """
     # 在函数内部导入模块
     from database import get_database, COMMENTS_COLLECTION
     
     if not data:
         logger.info("没有评论数据需要保存")
-        return {"inserted": 0, "updated": 0}
-
-    database = await get_database()
-    collection = database[COMMENTS_COLLECTION]
-    inserted_count = 0
-    updated_count = 0
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "failed_ids": []}
 
+    # 同一批次中的同一评论先在内存中合并
+    incoming: Dict[Tuple[str, str], Dict[str, Any]] = {}
     for comment_data in data:
         comment_id = comment_data.get("id")
         note_id = comment_data.get("noteId")
-
         if not comment_id or not note_id:
-            logger.warning(f"跳过评论，缺少 ID 或 NoteID: {comment_data.get('content', '')[:50]}...")
+            logger.warning(f"跳过评论，缺少 ID 或 NoteID: {(comment_data.get('content') or '')[:50]}...")
             continue
+        key = (comment_id, note_id)
+        incoming[key] = merge_comment_data(incoming[key], comment_data) if key in incoming else comment_data
+
+    if not incoming:
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "failed_ids": []}
 
-        try:
-            existing_comment = await collection.find_one({"id": comment_id, "noteId": note_id})
-
-            if existing_comment:
-                # 更新现有评论
-                merged_data = merge_comment_data(existing_comment, comment_data)
-                # 使用 replace_one 替换整个文档
-                result = await collection.replace_one({"_id": existing_comment["_id"]}, merged_data)
-                if result.modified_count > 0:
-                    updated_count += 1
-                    logger.debug(f"更新评论: id={comment_id}, noteId={note_id}")
-                else:
-                     logger.warning(f"尝试更新评论但 modified_count 为 0: id={comment_id}")
+    comment_ids = list({comment_id for comment_id, _ in incoming})
+    try:
+        database = await get_database()
+        collection = database[COMMENTS_COLLECTION]
+        existing_docs = {
+            (doc.get("id"), doc.get("noteId")): doc
+            async for doc in collection.find({"id": {"$in": comment_ids}})
+        }
+    except Exception as e:
+        logger.error(f"批量读取已有评论时出错: {e}")
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "failed_ids": comment_ids, "error": str(e)}
+
+    bulk_operations = []
+    operation_comment_ids = []
+    inserted_comments: Dict[int, Dict[str, Any]] = {}  # 插入操作的序号 -> 评论
+    updated_doc_ids: List[str] = []  # 有变化的已有评论的 _id（单条评论接口的缓存标签）
+    updated_count = 0
+    unchanged_count = 0
+    for (comment_id, note_id), comment_data in incoming.items():
+        existing_comment = existing_docs.get((comment_id, note_id))
+        if existing_comment is None:
+            inserted_comments[len(bulk_operations)] = comment_data
+            # 插入新评论（以更新插入实现，并发插入同一评论时不会产生重复文档）
+            operations = [pymongo.UpdateOne(
+                {"id": comment_id, "noteId": note_id},
+                {
+                    "$setOnInsert": {k: v for k, v in comment_data.items() if k not in ("_id", "id", "noteId")},
+                    **search_tokens_update(COMMENTS_COLLECTION, comment_data)
+                },
+                upsert=True
+            )]
+        else:
+            operations = build_comment_merge_operations(existing_comment, comment_data)
+            if operations:
+                updated_count += 1
+                updated_doc_ids.append(str(existing_comment["_id"]))
+                # 追加变化后文本的关键字搜索二元组
+                tokens_update = search_tokens_update(COMMENTS_COLLECTION, comment_data)
+                if tokens_update:
+                    operations.append(pymongo.UpdateOne({"_id": existing_comment["_id"]}, tokens_update))
             else:
-                # 插入新评论
-                result = await collection.insert_one(comment_data)
-                if result.inserted_id:
-                    inserted_count += 1
-                    logger.debug(f"插入新评论: id={comment_id}, noteId={note_id}")
-                else:
-                    logger.warning(f"尝试插入新评论但未获取 inserted_id: id={comment_id}")
-
-        except Exception as e:
-            logger.error(f"处理评论 id={comment_id}, noteId={note_id} 时出错: {e}")
-            #可以选择继续处理下一个或抛出异常
-            # continue
-
-    logger.info(f"评论保存/更新完成。插入: {inserted_count}, 更新: {updated_count}")
-    return {"inserted": inserted_count, "updated": updated_count}
+                unchanged_count += 1
+        bulk_operations.extend(operations)
+        operation_comment_ids.extend([comment_id] * len(operations))
+
+    if not bulk_operations:
+        logger.info("评论保存/更新完成。%d 条评论无变化", unchanged_count)
+        return {"inserted": 0, "updated": 0, "unchanged": unchanged_count, "failed_ids": []}
+
+    failed_ids: List[str] = []
+    upserted_ids: Dict[int, Any] = {}
+    try:
+        result = await collection.bulk_write(bulk_operations, ordered=False)
+        upserted_ids = result.upserted_ids
+        inserted_count = result.upserted_count
+    except pymongo.errors.BulkWriteError as bwe:
+        logger.error(f"批量保存评论时部分写入失败: {bwe.details.get('writeErrors')}")
+        upserted_ids = bulk_error_upserted_ids(bwe.details)
+        inserted_count = bwe.details.get('nUpserted', 0)
+        failed_ids = list({operation_comment_ids[error['index']] for error in bwe.details.get('writeErrors', [])})
+        updated_count = max(updated_count - len(failed_ids), 0)
+    except Exception as e:
+        logger.error(f"批量保存评论时出错: {e}")
+        return {"inserted": 0, "updated": 0, "unchanged": unchanged_count, "failed_ids": list(set(operation_comment_ids)), "error": str(e)}
+    finally:
+        total_counter.invalidate(COMMENTS_COLLECTION)
+        # 新插入的评论计入按日汇总
+        await record_documents(COMMENTS_COLLECTION, upserted_documents(upserted_ids, inserted_comments))
+        await query_cache.invalidate(*write_tags(COMMENTS_COLLECTION, comment=updated_doc_ids))
+
+    logger.info("评论保存/更新完成。插入: %d, 更新: %d, 无变化: %d, 失败: %d", inserted_count, updated_count, unchanged_count, len(failed_ids))
+    return {"inserted": inserted_count, "updated": updated_count, "unchanged": unchanged_count, "failed_ids": failed_ids}
+
+# === 评论线程 ===
+# 结构化评论保存时维护所在线程：rootCommentId（顶级评论ID）、depth（回复层级，顶级评论为0）、
+# ancestorIds（从顶级评论到父评论的ID路径）。父评论尚未保存时以父评论ID作为临时的顶级评论，
+# 父评论到达后由 repair_comment_threads 把其路径补到这些子评论之前。
+# 旧数据用 migrations/build_comment_threads.py 回填。
+
+def thread_fields(comment_id: str, ancestor_ids: List[str]) -> Dict[str, Any]:
+    """评论的线程字段"""
+    return {
+        "rootCommentId": ancestor_ids[0] if ancestor_ids else comment_id,
+        "depth": len(ancestor_ids),
+        "ancestorIds": ancestor_ids
+    }
+
+def resolve_ancestors(parents: Dict[str, str], known: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    计算一批评论的祖先路径
+
+    Args:
+        parents: 批次中有父评论的评论: {commentId: repliedId}
+        known: 批次外父评论的祖先路径（数据库中不存在的父评论视为临时的顶级评论）
+
+    Returns:
+        {commentId: 祖先路径}，循环引用的评论从环上断开
+    """
+    resolved: Dict[str, List[str]] = {}
+    for comment_id in parents:
+        # 沿父评论向上走到已计算的评论、批次外的评论或环
+        chain: List[str] = []
+        current: Optional[str] = comment_id
+        while current in parents and current not in resolved and current not in chain:
+            chain.append(current)
+            current = parents[current]
+        if not chain:
+            continue
+        if current in chain:
+            ancestors: List[str] = []
+        elif current in resolved:
+            ancestors = resolved[current] + [current]
+        else:
+            ancestors = known.get(current, []) + [current]
+        for chained_id in reversed(chain):
+            resolved[chained_id] = ancestors
+            ancestors = ancestors + [chained_id]
+    return resolved
+
+async def resolve_comment_threads(collection, comments: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """
+    计算有父评论的评论的祖先路径（一次 $in 查询读取批次外的父评论）
+
+    Returns:
+        {commentId: 祖先路径}，不含没有 repliedId 的评论
+    """
+    parents = {
+        comment["commentId"]: comment["repliedId"]
+        for comment in comments if comment.get("commentId") and comment.get("repliedId")
+    }
+    external = list({parent for parent in parents.values() if parent not in parents})
+    known: Dict[str, List[str]] = {}
+    if external:
+        async for doc in collection.find(
+            {"commentId": {"$in": external}}, {"_id": 0, "commentId": 1, "ancestorIds": 1, "repliedId": 1}
+        ):
+            ancestors = doc.get("ancestorIds")
+            if ancestors is None:
+                # 父评论还没有回填线程字段，只能确定一层
+                ancestors = [doc["repliedId"]] if doc.get("repliedId") else []
+            known[doc["commentId"]] = ancestors
+    return resolve_ancestors(parents, known)
+
+async def repair_comment_threads(collection, resolved: Dict[str, List[str]]) -> int:
+    """
+    父评论晚于子评论保存时修复子评论的线程字段
+
+    子评论保存时以父评论ID为临时的顶级评论（rootCommentId），父评论保存后如果它还有祖先，
+    把它的祖先路径补到这些评论的 ancestorIds 之前
+
+    Returns:
+        修复的评论数
+    """
+    candidates = [comment_id for comment_id, ancestors in resolved.items() if ancestors]
+    if not candidates:
+        return 0
+    repaired = 0
+    try:
+        for root_id in await collection.distinct("rootCommentId", {"rootCommentId": {"$in": candidates}}):
+            prefix = resolved[root_id]
+            result = await collection.update_many(
+                {"rootCommentId": root_id},
+                [{"$set": {
+                    "ancestorIds": {"$concatArrays": [{"$literal": prefix}, {"$ifNull": ["$ancestorIds", []]}]},
+                    "rootCommentId": prefix[0],
+                    "depth": {"$add": [{"$ifNull": ["$depth", 0]}, len(prefix)]}
+                }}]
+            )
+            repaired += result.modified_count
+    except Exception as e:
+        logger.warning(f"修复评论线程失败，可重新运行 migrations/build_comment_threads.py: {e}")
+    if repaired:
+        logger.info("父评论晚到，修复了 %d 条子评论的线程字段", repaired)
+    return repaired
+
+async def thread_participants(collection, comment_ids: List[str], resolved: Dict[str, List[str]]) -> List[str]:
+    """
+    一批评论所在对话中的作者：被回复评论（任意上层）的作者和已有回复（任意层级）的作者
+
+    这些用户的历史评论因这批评论而变化，写入后需要使其缓存失效（查询失败时返回空列表）
+    """
+    if not comment_ids:
+        return []
+    conditions: List[Dict[str, Any]] = [
+        {"repliedId": {"$in": comment_ids}},
+        {"ancestorIds": {"$in": comment_ids}}
+    ]
+    ancestor_ids = {ancestor_id for ancestors in resolved.values() for ancestor_id in ancestors}
+    if ancestor_ids:
+        conditions.append({"commentId": {"$in": list(ancestor_ids)}})
+    try:
+        return await collection.distinct("authorId", {"$or": conditions})
+    except Exception as e:
+        logger.warning(f"查询对话参与者失败，相关用户的历史评论缓存只能等待过期: {e}")
+        return []
+
+def build_comment_tree(comments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    把评论列表按 repliedId 组装成树（O(n)），每个节点的回复放在 replies 中
+
+    同级评论保持输入顺序；父评论不在列表中的评论作为顶层节点返回。
+    repliedId 成环时与 resolve_ancestors 一样断开：rootCommentId 是自身的评论作为顶层节点，
+    尚未回填线程字段时把环上最后到达的评论作为顶层节点
+    """
+    nodes: Dict[str, Dict[str, Any]] = {}
+    for comment in comments:
+        nodes[comment["commentId"]] = dict(comment, replies=[])
+    parent_of = {
+        comment_id: node["repliedId"]
+        for comment_id, node in nodes.items()
+        if node.get("repliedId") in nodes and node["repliedId"] != comment_id
+        and node.get("rootCommentId") != comment_id
+    }
+
+    # 沿父评论向上检查是否成环，环上最后到达的评论（其父评论已在本次路径上）断开为顶层节点
+    visited: Dict[str, bool] = {}  # False: 在当前路径上，True: 已检查
+    for start in nodes:
+        path = []
+        current = start
+        while current in parent_of and current not in visited:
+            visited[current] = False
+            path.append(current)
+            current = parent_of[current]
+        if current in visited and not visited[current]:
+            logger.warning("评论回复关系成环，评论 %s 作为顶层评论", path[-1])
+            del parent_of[path[-1]]
+        for comment_id in path:
+            visited[comment_id] = True
+
+    roots = []
+    for comment_id, node in nodes.items():
+        parent_id = parent_of.get(comment_id)
+        if parent_id is not None:
+            nodes[parent_id]["replies"].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+async def backfill_comment_threads(
+    batch_size: int = 1000,
+    dry_run: bool = False,
+    on_progress: Optional[Callable[[int], None]] = None
+) -> int:
+    """
+    按笔记重新计算所有结构化评论的线程字段
+
+    Returns:
+        处理的评论数
+    """
+    from database import get_database, STRUCTURED_COMMENTS_COLLECTION
+
+    database = await get_database()
+    collection = database[STRUCTURED_COMMENTS_COLLECTION]
+
+    processed = 0
+    operations: List[Any] = []
+
+    async def flush_note(comments: List[Dict[str, Any]]):
+        nonlocal operations
+        resolved = resolve_ancestors(
+            {c["commentId"]: c["repliedId"] for c in comments if c.get("repliedId")}, {}
+        )
+        for comment in comments:
+            fields = thread_fields(comment["commentId"], resolved.get(comment["commentId"], []))
+            operations.append(pymongo.UpdateOne({"_id": comment["_id"]}, {"$set": fields}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                await collection.bulk_write(operations, ordered=False)
+            operations = []
+            if on_progress is not None:
+                on_progress(processed)
+
+    # 回复关系只在同一笔记内，逐个笔记计算
+    note_comments: List[Dict[str, Any]] = []
+    current_note = None
+    cursor = collection.find(
+        {"commentId": {"$ne": None}}, {"commentId": 1, "repliedId": 1, "noteId": 1}
+    ).sort("noteId", 1).batch_size(batch_size)
+    async for doc in cursor:
+        if note_comments and doc.get("noteId") != current_note:
+            await flush_note(note_comments)
+            note_comments = []
+        current_note = doc.get("noteId")
+        note_comments.append(doc)
+        processed += 1
+    if note_comments:
+        await flush_note(note_comments)
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+    return processed
 
 async def save_structured_comments(data: List[Dict[str, Any]]):
     """将结构化的评论数据批量更新插入（Upsert）到数据库 (异步版本)。
        如果文档已存在，则不更新 timestamp 字段。
+       同时维护线程字段（rootCommentId、depth、ancestorIds），见 resolve_comment_threads。
     """
     # 在函数内部导入模块
     from database import get_database, STRUCTURED_COMMENTS_COLLECTION
     
     if not data:
         logger.info("没有结构化评论数据需要保存")
-        return {'upserted': 0, 'matched': 0, 'failed': 0}
+        return {'upserted': 0, 'matched': 0, 'failed': 0, 'failed_ids': []}
 
     try:
         database = await get_database() # 获取异步数据库实例
     except Exception as e:
         logger.error(f"获取数据库连接失败，无法保存结构化评论: {e}")
-        return {'upserted': 0, 'matched': 0, 'failed': len(data)}
+        return {'upserted': 0, 'matched': 0, 'failed': len(data), 'failed_ids': [c.get('commentId') for c in data], 'error': str(e)}
 
     collection = database[STRUCTURED_COMMENTS_COLLECTION]
     bulk_operations = []
+    operation_comment_ids = []
+    operation_comments = []
     skipped_count = 0
 
+    try:
+        threads = await resolve_comment_threads(collection, data)
+    except Exception as e:
+        logger.warning(f"读取父评论失败，本批评论的线程字段只在新建时按顶级评论写入: {e}")
+        threads = {}
+
     for comment in data:
         comment_id = comment.get("commentId")
         if not comment_id:
@@ -202,6 +543,12 @@ async def save_structured_comments(data: List[Dict[str, Any]]):
         elif timestamp_value is not None: # 如果不是 datetime 但也不是 None，记录警告
              logger.warning(f"结构化评论 commentId={comment_id} 的 timestamp 格式无效 ({type(timestamp_value)})，将不会在插入时设置。")
 
+        # 有父评论时更新线程字段；没有父评论（如评论通知中的评论）时不覆盖已有的线程字段
+        if comment_id in threads:
+            set_operation.update(thread_fields(comment_id, threads[comment_id]))
+        else:
+            set_on_insert_operation.update(thread_fields(comment_id, []))
+
         # 创建UpdateOne操作
         # $set: 更新除 timestamp 外的其他字段
         # $setOnInsert: 仅在插入新文档时设置 timestamp
@@ -215,18 +562,24 @@ async def save_structured_comments(data: List[Dict[str, Any]]):
                 upsert=True
             )
         )
+        operation_comment_ids.append(comment_id)
+        operation_comments.append(comment)
 
     upserted_count = 0
     matched_count = 0
     failed_count = skipped_count # 初始化失败计数为跳过的数量
+    upserted_ids: Dict[int, Any] = {}
+    written_ids = set()  # 写入成功的评论ID
 
     if not bulk_operations:
         logger.warning("没有有效的结构化评论可供写入。")
-        return {'upserted': 0, 'matched': 0, 'failed': failed_count}
+        return {'upserted': 0, 'matched': 0, 'failed': failed_count, 'failed_ids': []}
 
     try:
         # 执行异步批量写入
         result = await collection.bulk_write(bulk_operations, ordered=False)
+        upserted_ids = result.upserted_ids
+        written_ids = set(operation_comment_ids)
         upserted_count = result.upserted_count
         matched_count = result.matched_count
         # BulkWriteError 会在 result.bulk_api_result 中包含错误信息
@@ -240,10 +593,12 @@ async def save_structured_comments(data: List[Dict[str, Any]]):
         operation_failures = len(bulk_operations) - (upserted_count + matched_count) # 近似失败数
         failed_count += operation_failures
 
-        logger.info(f"结构化评论异步批量写入完成 - 新增(Upserted): {upserted_count}, 匹配(Matched): {matched_count} (其中修改 Modified: {result.modified_count}), 失败: {failed_count}")
-        return {'upserted': upserted_count, 'matched': matched_count, 'modified': result.modified_count, 'failed': failed_count}
+        logger.info("结构化评论异步批量写入完成 - 新增(Upserted): %d, 匹配(Matched): %d (其中修改 Modified: %d), 失败: %d",
+                    upserted_count, matched_count, result.modified_count, failed_count)
+        return {'upserted': upserted_count, 'matched': matched_count, 'modified': result.modified_count, 'failed': failed_count, 'failed_ids': []}
     except pymongo.errors.BulkWriteError as bwe:
         logger.error(f"保存结构化评论时发生异步批量写入错误: {bwe.details}")
+        upserted_ids = bulk_error_upserted_ids(bwe.details)
         # 尝试从错误详情中获取更精确的计数
         upserted_count = bwe.details.get('nUpserted', 0)
         matched_count = bwe.details.get('nMatched', 0) # 使用 nMatched
@@ -252,170 +607,133 @@ async def save_structured_comments(data: List[Dict[str, Any]]):
         operation_failures = len(bulk_operations) - successful_ops
         failed_count += operation_failures # 加上写入操作本身的失败数
         logger.warning(f"批量写入错误详情: {bwe.details}")
-        return {'upserted': upserted_count, 'matched': matched_count, 'modified': modified_count, 'failed': failed_count}
+        failed_ids = [operation_comment_ids[error['index']] for error in bwe.details.get('writeErrors', [])]
+        written_ids = set(operation_comment_ids).difference(failed_ids)
+        return {'upserted': upserted_count, 'matched': matched_count, 'modified': modified_count, 'failed': failed_count, 'failed_ids': failed_ids}
     except Exception as e:
         logger.error(f"保存结构化评论数据时发生未知异步错误: {e}", exc_info=True)
         # 假设所有尝试的操作都失败了
         failed_count = len(data) # 所有原始数据都算失败
-        return {'upserted': 0, 'matched': 0, 'modified': 0, 'failed': failed_count}
+        return {'upserted': 0, 'matched': 0, 'modified': 0, 'failed': failed_count, 'failed_ids': operation_comment_ids, 'error': str(e)}
+    finally:
+        total_counter.invalidate(STRUCTURED_COMMENTS_COLLECTION)
+        # 父评论写入失败时不能把其路径补到子评论上
+        if threads:
+            await repair_comment_threads(collection, {
+                comment_id: ancestors for comment_id, ancestors in threads.items() if comment_id in written_ids
+            })
+        # 新插入的评论计入按日汇总
+        await record_documents(STRUCTURED_COMMENTS_COLLECTION, upserted_documents(upserted_ids, dict(enumerate(operation_comments))))
+        # 评论作者以及被回复、回复这些评论的用户的历史评论都会变化
+        # 对话参与者只用于缓存失效，未启用查询缓存时不查询
+        participants = await thread_participants(collection, operation_comment_ids, threads) if query_cache.enabled else []
+        await query_cache.invalidate(*write_tags(
+            STRUCTURED_COMMENTS_COLLECTION,
+            user=[comment.get("authorId") for comment in operation_comments] + participants,
+            note=[comment.get("noteId") for comment in operation_comments]
+        ))
+
+# 历史评论中每条评论使用的字段
+_HISTORY_COMMENT_PROJECTION = {
+    "commentId": 1, "noteId": 1, "authorId": 1, "authorName": 1, "authorAvatar": 1,
+    "content": 1, "timestamp": 1, "repliedId": 1
+}
+# 向上查找被回复评论的最大层数，避免异常长的回复链使 $graphLookup 超出内存限制
+_HISTORY_ANCESTOR_MAX_DEPTH = 50
+
+async def get_user_historical_comments(user_id: str, page: int = 1, page_size: int = 20) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    获取特定用户的历史评论及相关笔记信息（按笔记分页）
 
-async def get_user_historical_comments(user_id: str):
-    """获取特定用户的所有历史评论及相关笔记信息"""
+    一次聚合完成：用户的评论 → $graphLookup 沿 repliedId 向上找被回复的评论（最多 50 层），
+    $lookup 按 ancestorIds 索引找任意层级的回复（未回填线程字段的评论需先运行 migrations/build_comment_threads.py）
+    → 去重 → 按笔记分组 → $lookup 笔记信息（没有笔记信息的分组不返回）→ 按笔记发布时间倒序分页
+
+    Returns:
+        (当前页的笔记分组, 笔记分组总数)
+    """
     # 在函数内部导入模块
     from database import get_database, STRUCTURED_COMMENTS_COLLECTION, NOTES_COLLECTION
     
     if not user_id:
         logger.error("获取历史评论时缺少用户ID")
-        return []
+        return [], 0
     
     database = await get_database()
-    
-    # 1. 查询包含该用户评论的结构化评论数据
-    structured_comments_collection = database[STRUCTURED_COMMENTS_COLLECTION]
-    
-    # 查询条件：用户ID匹配 或 回复给该用户的评论 或 用户回复给别人的评论
-    # 先获取该用户发表的所有评论ID
-    user_comments_query = {"authorId": user_id}
-    user_comments = await structured_comments_collection.find(user_comments_query, {"commentId": 1, "repliedId": 1}).to_list(length=None)
-    user_comment_ids = [comment.get("commentId") for comment in user_comments if comment.get("commentId")]
-    user_replied_to_ids = [comment.get("repliedId") for comment in user_comments if comment.get("repliedId")]
-    
-    logger.info(f"用户 {user_id} 发表的评论数量: {len(user_comments)}")
-    logger.info(f"用户评论ID列表: {user_comment_ids}")
-    logger.info(f"用户回复的评论ID列表: {user_replied_to_ids}")
-    
-    # 构建组合查询条件 - 包含互动关系的评论
-    query_conditions = [
-            {"authorId": user_id},  # 用户发表的评论
+    pipeline = [
+        {"$match": {"authorId": user_id}},
+        {"$project": _HISTORY_COMMENT_PROJECTION},
+        {"$set": {"self": "$$ROOT"}},
+        # 用户回复的原评论及其上层
+        {"$graphLookup": {
+            "from": STRUCTURED_COMMENTS_COLLECTION,
+            "startWith": {"$ifNull": ["$repliedId", []]},
+            "connectFromField": "repliedId",
+            "connectToField": "commentId",
+            "as": "ancestors",
+            "maxDepth": _HISTORY_ANCESTOR_MAX_DEPTH - 1,
+            "restrictSearchWithMatch": {"commentId": {"$type": "string"}}
+        }},
+        # 回复用户评论的任意层级的评论：祖先路径中包含该评论
+        {"$lookup": {
+            "from": STRUCTURED_COMMENTS_COLLECTION,
+            "localField": "commentId",
+            "foreignField": "ancestorIds",
+            # 缺少 commentId 的评论不能匹配到所有没有线程字段的评论
+            "pipeline": [{"$match": {"ancestorIds": {"$type": "string"}}}, {"$project": _HISTORY_COMMENT_PROJECTION}],
+            "as": "replies"
+        }},
+        {"$project": {"related": {"$concatArrays": [["$self"], "$ancestors", "$replies"]}}},
+        {"$unwind": "$related"},
+        {"$replaceRoot": {"newRoot": "$related"}},
+        # 多条用户评论在同一对话中时相关评论会重复
+        {"$group": {"_id": {"$ifNull": ["$commentId", "$_id"]}, "comment": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$comment"}},
+        {"$match": {"noteId": {"$nin": [None, ""]}}},
+        # 每条笔记下的评论按时间倒序
+        {"$sort": {"timestamp": -1, "_id": 1}},
+        {"$group": {"_id": "$noteId", "comments": {"$push": {
+            "commentId": "$commentId",
+            "userId": "$authorId",
+            "userName": {"$ifNull": ["$authorName", ""]},
+            "content": {"$ifNull": ["$content", ""]},
+            "time": "$timestamp",
+            "replyToCommentId": "$repliedId",
+            "isTargetUser": {"$eq": ["$authorId", user_id]},
+            "userAvatar": "$authorAvatar"
+        }}}},
+        {"$lookup": {"from": NOTES_COLLECTION, "localField": "_id", "foreignField": "noteId", "as": "note"}},
+        {"$set": {"note": {"$arrayElemAt": ["$note", 0]}}},
+        {"$match": {"note": {"$exists": True}}},
+        {"$sort": {"note.publishTime": -1, "_id": 1}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "items": [
+                {"$skip": (page - 1) * page_size},
+                {"$limit": page_size},
+                {"$project": {
+                    "_id": 0,
+                    "noteId": "$_id",
+                    "publishTime": "$note.publishTime",
+                    "title": {"$ifNull": ["$note.title", ""]},
+                    "comments": 1
+                }}
+            ]
+        }}
     ]
     
-    # 回复给该用户的评论
-    if user_comment_ids:
-        query_conditions.append({"repliedId": {"$in": user_comment_ids}})
-        logger.info(f"添加查询条件：回复给用户的评论，用户评论ID数量: {len(user_comment_ids)}")
-    
-    # 用户回复的原评论（显示完整对话上下文）
-    if user_replied_to_ids:
-        query_conditions.append({"commentId": {"$in": user_replied_to_ids}})
-        logger.info(f"添加查询条件：用户回复的原评论，原评论ID数量: {len(user_replied_to_ids)}")
-    
-    # 与用户有互动关系的评论线程中的其他评论
-    if user_comment_ids:
-        # 查找所有回复用户评论的评论
-        reply_comments = await structured_comments_collection.find(
-            {"repliedId": {"$in": user_comment_ids}}, 
-            {"commentId": 1, "repliedId": 1}
-        ).to_list(length=None)
-        
-        logger.info(f"找到回复用户评论的评论数量: {len(reply_comments)}")
-        
-        # 获取这些回复评论的ID，用于查找它们的子回复
-        reply_comment_ids = [comment.get("commentId") for comment in reply_comments if comment.get("commentId")]
-        if reply_comment_ids:
-            query_conditions.append({"repliedId": {"$in": reply_comment_ids}})
-            logger.info(f"添加查询条件：回复评论的子回复，回复评论ID数量: {len(reply_comment_ids)}")
-    
-    query = {"$or": query_conditions}
-    logger.info(f"最终查询条件数量: {len(query_conditions)}")
-    logger.info(f"查询条件详情: {query}")
-    
-    # 执行查询
-    structured_comments = await structured_comments_collection.find(query).to_list(length=None)
-    logger.info(f"找到用户 {user_id} 相关的结构化评论数据 {len(structured_comments)} 条")
-    
-    if not structured_comments:
-        logger.info(f"未找到用户 {user_id} 的任何结构化评论")
-        return []
-    
-    # 2. 提取关联的笔记ID并查询笔记信息
-    note_ids = set(comment.get("noteId") for comment in structured_comments if comment.get("noteId"))
-    
-    # 查询笔记数据
-    notes_collection = database[NOTES_COLLECTION]
-    notes_data = {}
-    
-    if note_ids:
-        notes_query = {"noteId": {"$in": list(note_ids)}}
-        notes_cursor = notes_collection.find(notes_query)
-        
-        async for note in notes_cursor:
-            note_id = note.get("noteId")
-            if note_id:
-                notes_data[note_id] = {
-                    "noteId": note_id,
-                    "publishTime": note.get("publishTime"),
-                    "title": note.get("title", ""),
-                    "noteContent": note.get("noteContent", ""),
-                    "noteLike": note.get("noteLike", 0),
-                    "noteCommitCount": note.get("noteCommitCount", 0),
-                    "authorId": note.get("authorId", "")
-                }
-    
-    # 3. 组织结果数据
-    result = []
-    
-    # 按笔记分组整理评论数据
-    comments_by_note = {}
-    
-    # 收集所有评论，按ID索引，用于处理回复关系
-    comments_map = {}
-    for comment in structured_comments:
-        comment_id = comment.get("commentId")
-        if comment_id:
-            comments_map[comment_id] = comment
-    
-    # 按笔记ID分组评论
-    for comment in structured_comments:
-        note_id = comment.get("noteId")
-        if not note_id:
-            continue
-            
-        if note_id not in comments_by_note:
-            comments_by_note[note_id] = []
-        
-        # 评论数据中添加isTarget标记，表示是否为目标用户的评论
-        is_target_user = comment.get("authorId") == user_id
-        
-        # 准备评论数据
-        comment_data = {
-            "commentId": comment.get("commentId"),
-            "userId": comment.get("authorId"),
-            "userName": comment.get("authorName", ""),
-            "content": comment.get("content", ""),
-            "time": comment.get("timestamp").isoformat() if comment.get("timestamp") else "",
-            "replyToCommentId": comment.get("repliedId"),
-            "isTargetUser": is_target_user
-        }
-        
-        # 添加额外字段：头像
-        if comment.get("authorAvatar"):
-            comment_data["userAvatar"] = comment.get("authorAvatar")
-        
-        comments_by_note[note_id].append(comment_data)
-    
-    # 构建最终结果
-    for note_id, comments in comments_by_note.items():
-        note_info = notes_data.get(note_id, {})
-        
-        # 只有在有笔记信息的情况下才添加到结果中
-        if note_info:
-            # 对评论按时间排序
-            sorted_comments = sorted(
-                comments, 
-                key=lambda x: x.get("time", ""), 
-                reverse=True
-            )
-            
-            result_item = {
-                "noteId": note_id,
-                "publishTime": note_info.get("publishTime"),
-                "title": note_info.get("title", ""),
-                "comments": sorted_comments
-            }
-            result.append(result_item)
+    results = await database[STRUCTURED_COMMENTS_COLLECTION].aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+    facet = results[0] if results else {}
+    total = facet["total"][0]["count"] if facet.get("total") else 0
+    items = facet.get("items", [])
     
-    # 按照笔记发布时间排序（降序）
-    result.sort(key=lambda x: x.get("publishTime") if x.get("publishTime") else datetime.min, reverse=True)
+    for item in items:
+        for comment in item["comments"]:
+            timestamp = comment.get("time")
+            comment["time"] = timestamp.isoformat() if isinstance(timestamp, datetime) else ""
+            comment.setdefault("replyToCommentId", None)
+            if not comment.get("userAvatar"):
+                comment.pop("userAvatar", None)
     
-    logger.info(f"成功生成用户 {user_id} 的历史评论数据，涉及 {len(result)} 条笔记")
-    return result 
\ No newline at end of file
+    logger.info("成功生成用户 %s 的历史评论数据，第 %d 页 %d 条笔记，共 %d 条笔记", user_id, page, len(items), total)
+    return items, total
@@ -0,0 +1,121 @@
+"""
+数据类型处理流水线注册表
+
+每种数据类型声明自己的各个阶段：
+- matcher: 抓取规则名称与URL正则，用于识别上传属于哪种数据类型
+- parser: 把解码后的响应JSON解析为模型对象
+- normalizer: 把解析结果转换为按集合分类的待保存实体
+- persister: 保存实体
+
+注册表在导入时把所有类型的规则名称编译为一个字典、把所有URL正则编译为一个带命名分组的
+组合正则，识别数据类型只需一次字典查找和一次正则匹配
+"""
+import logging
+import re
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class DataTypePipeline:
+    """一种数据类型的处理流水线"""
+
+    def __init__(
+        self,
+        data_type: str,
+        rule_names: Iterable[str] = (),
+        url_patterns: Iterable[str] = (),
+        parser: Optional[Callable] = None,
+        normalizer: Optional[Callable] = None,
+        persister: Optional[Callable] = None,
+        description: str = ""
+    ):
+        self.data_type = data_type
+        self.rule_names = tuple(rule_names)
+        self.url_patterns = tuple(url_patterns)
+        self.parser = parser
+        self.normalizer = normalizer
+        self.persister = persister
+        self.description = description
+
+    @property
+    def accepts_uploads(self) -> bool:
+        """是否会保存数据（没有解析器或保存器的类型在解码响应体之前就被拒绝）"""
+        return self.parser is not None and self.normalizer is not None and self.persister is not None
+
+class PipelineRegistry:
+    """流水线注册表，URL 按注册顺序匹配，规则名称优先于URL"""
+
+    def __init__(self):
+        self._pipelines: Dict[str, DataTypePipeline] = {}
+        self._rule_map: Dict[str, str] = {}
+        self._url_matcher: Optional["re.Pattern"] = None
+        self._group_types: Dict[str, str] = {}
+
+    def register(self, pipeline: DataTypePipeline) -> DataTypePipeline:
+        """注册（或替换）一种数据类型的流水线"""
+        self._pipelines[pipeline.data_type] = pipeline
+        self._url_matcher = None
+        return pipeline
+
+    def compile(self):
+        """编译规则名称映射和组合URL正则"""
+        rule_map: Dict[str, str] = {}
+        alternatives: List[str] = []
+        group_types: Dict[str, str] = {}
+        for pipeline in self._pipelines.values():
+            for rule_name in pipeline.rule_names:
+                rule_map.setdefault(rule_name, pipeline.data_type)
+            for pattern in pipeline.url_patterns:
+                group = f"p{len(alternatives)}"
+                alternatives.append(f".*?(?P<{group}>{pattern})")
+                group_types[group] = pipeline.data_type
+
+        self._rule_map = rule_map
+        self._group_types = group_types
+        # 每个分支都从URL开头匹配（前缀 .*? 允许模式出现在任意位置），正则按分支顺序尝试，
+        # 因此结果是按注册顺序第一个能匹配的模式，而不是在URL中最靠左的匹配。没有URL模式时使用永不匹配的正则
+        self._url_matcher = re.compile("|".join(alternatives) if alternatives else r"(?!x)x", re.DOTALL)
+
+    def match(self, rule_name: Optional[str], url: Optional[str]) -> Optional[DataTypePipeline]:
+        """根据规则名称和URL找到对应的流水线"""
+        if self._url_matcher is None:
+            self.compile()
+
+        data_type = self._rule_map.get(rule_name or "")
+        if data_type is None and url:
+            found = self._url_matcher.match(url)
+            if found:
+                data_type = next(
+                    self._group_types[group] for group, value in found.groupdict().items()
+                    if value is not None and group in self._group_types
+                )
+        return self._pipelines.get(data_type) if data_type else None
+
+    def get(self, data_type: str) -> Optional[DataTypePipeline]:
+        return self._pipelines.get(data_type)
+
+    def __iter__(self):
+        return iter(self._pipelines.values())
+
+class StageTimer:
+    """记录各处理阶段的耗时（毫秒）"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(self.timings.get(name, 0.0) + (time.perf_counter() - started) * 1000, 3)
+
+    def record(self, name: str, elapsed_ms: float):
+        self.timings[name] = round(elapsed_ms, 3)
+
+# 全局流水线注册表（内置数据类型在 network_data_processor 中注册）
+pipeline_registry = PipelineRegistry()
@@ -0,0 +1,74 @@
+"""
+实体合并服务
+
+把多次上传中解析出的用户、笔记、评论按ID合并去重，
+使一批上传对每个集合只需要一次批量写入
+"""
+import re
+from typing import Any, Dict, Iterable, List
+
+# 各类实体的类型名及其唯一键
+ENTITY_USERS = "users"
+ENTITY_NOTES = "notes"
+ENTITY_STRUCTURED_COMMENTS = "structured_comments"
+ENTITY_COMMENTS = "comments"  # 旧版评论集合
+
+ENTITY_KEYS = {
+    ENTITY_USERS: "id",
+    ENTITY_NOTES: "noteId",
+    ENTITY_STRUCTURED_COMMENTS: "commentId",
+    ENTITY_COMMENTS: "id",
+}
+
+# 解析器在不知道真实标题时使用的占位标题，例如 "笔记-<noteId>"
+PLACEHOLDER_TITLE_PATTERN = re.compile(r"^笔记-[0-9a-zA-Z]+$")
+
+def is_placeholder_title(field: str, value: Any) -> bool:
+    """判断字段值是否为占位标题"""
+    return field == "title" and isinstance(value, str) and bool(PLACEHOLDER_TITLE_PATTERN.match(value))
+
+def empty_entities() -> Dict[str, List[Dict[str, Any]]]:
+    """创建空的实体容器"""
+    return {entity_type: [] for entity_type in ENTITY_KEYS}
+
+def entity_id(entity_type: str, entity: Dict[str, Any]) -> Any:
+    """获取实体的唯一ID"""
+    return entity.get(ENTITY_KEYS[entity_type])
+
+def merge_entity(existing: Dict[str, Any], incoming: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    合并同一实体的两个版本
+
+    后到的非空值覆盖先前的值，后到版本缺失、为 None 或为占位标题的字段保留先前的值，
+    避免信息较少的响应（如只带昵称的提及消息）把较完整的数据冲掉
+    """
+    merged = dict(existing)
+    for key, value in incoming.items():
+        if key not in merged or merged[key] is None or (value is not None and not is_placeholder_title(key, value)):
+            merged[key] = value
+    return merged
+
+def merge_entity_list(entity_type: str, entities: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按唯一ID合并实体列表，保持首次出现的顺序，缺少ID的实体原样保留"""
+    merged: Dict[Any, Dict[str, Any]] = {}
+    without_id: List[Dict[str, Any]] = []
+    for entity in entities:
+        key = entity_id(entity_type, entity)
+        if not key:
+            without_id.append(entity)
+        elif key in merged:
+            merged[key] = merge_entity(merged[key], entity)
+        else:
+            merged[key] = entity
+    return list(merged.values()) + without_id
+
+def merge_entity_batches(batches: Iterable[Dict[str, List[Dict[str, Any]]]]) -> Dict[str, List[Dict[str, Any]]]:
+    """合并多次上传的实体容器"""
+    combined = empty_entities()
+    for batch in batches:
+        for entity_type, entities in batch.items():
+            combined[entity_type].extend(entities)
+    return {
+        entity_type: merge_entity_list(entity_type, entities)
+        for entity_type, entities in combined.items()
+    }
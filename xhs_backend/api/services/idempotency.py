@@ -0,0 +1,309 @@
+"""
+上传幂等服务
+
+插件上传超时后会重试，服务器可能已经处理过第一次请求。以上传用户 + Idempotency-Key 请求头
+（或 RawNetworkData.request_id + 规范化URL + 抓取时间 + 响应体摘要）为幂等键：
+1. 处理成功的结果按幂等键保存一段时间，重复请求直接返回保存的结果（idempotent_replay=True），
+   不再解析和写库
+2. 同一幂等键同时只处理一次：进程内的重复请求等待正在进行的处理，多个 worker 之间
+   通过 Redis 锁互斥，未拿到锁的请求等待结果出现
+
+结果和锁保存在 Redis 中，Redis 不可用时退回进程内存储（只在单个 worker 内幂等）。
+处理失败的结果不保存，重试时重新处理。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from ..models.network import DataProcessingResult, RawNetworkData
+from .ingest_dedup import normalize_url
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+# 结果存储后端: redis（多进程共享）或 memory（进程内）
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "redis").lower()
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))  # 结果保存时间
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 60))  # 处理锁的超时时间（处理者崩溃后自动释放）
+# 等待同一幂等键的进程内处理结果的最长时间，超时后重新尝试占用
+IDEMPOTENCY_WAIT_SECONDS = int(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", IDEMPOTENCY_LOCK_SECONDS))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 20000))  # 进程内存储的最大条数
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REDIS_RESULT_PREFIX = "xhs:ingest:idem:"
+REDIS_LOCK_PREFIX = "xhs:ingest:idem-lock:"
+_POLL_INTERVAL_SECONDS = 0.1
+_MAX_ATTEMPTS = 3
+
+# 只释放自己持有的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def idempotency_key(
+    user: Optional[str],
+    raw_data: RawNetworkData,
+    header_key: Optional[str] = None,
+    body: Optional[bytes] = None
+) -> Optional[str]:
+    """
+    计算上传的幂等键
+
+    优先使用客户端提供的 Idempotency-Key；否则使用 request_id，并加上规范化URL、
+    客户端提供的抓取时间和响应体摘要（浏览器重启后 request_id 会从头编号，
+    同一URL的新抓取不能被当作重试）。两者都没有时返回 None，不做幂等处理
+
+    Args:
+        body: 响应体原始字节，缺省时使用 raw_data.response_body
+    """
+    if header_key:
+        material = f"key\0{user or ''}\0{header_key.strip()}"
+    elif raw_data.request_id:
+        if body is None:
+            body = raw_data.response_body.encode("utf-8") if raw_data.response_body else b""
+        # 未提供抓取时间时 timestamp 为接收时间，每次请求都不同，不参与幂等键
+        captured_at = raw_data.timestamp.isoformat() if "timestamp" in raw_data.model_fields_set else ""
+        material = (
+            f"req\0{user or ''}\0{raw_data.request_id}\0{normalize_url(raw_data.url)}"
+            f"\0{captured_at}\0{hashlib.sha256(body).hexdigest()}"
+        )
+    else:
+        return None
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class IdempotencyClaim:
+    """
+    一次对幂等键的占用尝试
+
+    result 不为空时为可直接返回的已保存结果；owner 为 True 时由调用方处理并调用 finish；
+    两者都不是时其他请求正在处理，调用 wait 等待其结果
+    """
+
+    __slots__ = ("key", "result", "owner", "future", "lock_token")
+
+    def __init__(self, key: str, result: Optional[DataProcessingResult] = None, owner: bool = False,
+                 future: Optional[asyncio.Future] = None, lock_token: Optional[str] = None):
+        self.key = key
+        self.result = result
+        self.owner = owner
+        self.future = future
+        self.lock_token = lock_token
+
+class IdempotencyStore:
+    """按幂等键保存上传处理结果，并合并同时进行的重复处理"""
+
+    def __init__(
+        self,
+        backend: str = IDEMPOTENCY_BACKEND,
+        ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+        lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS,
+        wait_seconds: int = IDEMPOTENCY_WAIT_SECONDS,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        enabled: bool = IDEMPOTENCY_ENABLED
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._release_script = None
+        self._last_redis_warning = 0.0
+        self.replays = 0
+        self.collapsed = 0
+        self.misses = 0
+        self.wait_timeouts = 0
+
+    async def run(
+        self,
+        key: Optional[str],
+        process: Callable[[], Awaitable[DataProcessingResult]]
+    ) -> DataProcessingResult:
+        """按幂等键执行 process：已有结果时直接返回，其他请求正在处理时等待其结果"""
+        if not self.enabled or not key:
+            return await process()
+
+        for _ in range(_MAX_ATTEMPTS):
+            claim = await self.begin(key)
+            if claim.result is not None:
+                return claim.result
+            if claim.owner:
+                result = None
+                try:
+                    result = await process()
+                    return result
+                finally:
+                    await self.finish(claim, result)
+            result = await self.wait(claim)
+            if result is not None:
+                return result
+            # 正在处理的请求失败或超时，重新尝试占用
+
+        logger.warning(f"幂等键 {key[:12]} 多次等待未得到结果，直接处理")
+        return await process()
+
+    async def begin(self, key: str) -> IdempotencyClaim:
+        """尝试占用幂等键（不阻塞）"""
+        result = await self._load(key)
+        if result is not None:
+            self.replays += 1
+            return IdempotencyClaim(key, result=result)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.collapsed += 1
+            return IdempotencyClaim(key, future=future)
+
+        lock_token = uuid.uuid4().hex
+        if not await self._acquire_lock(key, lock_token):
+            # 其他 worker 正在处理
+            self.collapsed += 1
+            return IdempotencyClaim(key)
+
+        self.misses += 1
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        return IdempotencyClaim(key, owner=True, lock_token=lock_token)
+
+    async def finish(self, claim: IdempotencyClaim, result: Optional[DataProcessingResult]):
+        """结束占用：保存成功的结果，唤醒等待的请求并释放锁"""
+        if not claim.owner:
+            return
+        try:
+            if result is not None and result.success:
+                await self._save(claim.key, result)
+        finally:
+            future = self._inflight.pop(claim.key, None)
+            if future is not None and not future.done():
+                future.set_result(result if result is not None and result.success else None)
+            await self._release_lock(claim.key, claim.lock_token)
+
+    async def wait(self, claim: IdempotencyClaim) -> Optional[DataProcessingResult]:
+        """等待正在处理的请求完成，返回其结果；对方失败或超时返回 None"""
+        if claim.future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(claim.future), timeout=self.wait_seconds)
+            except asyncio.TimeoutError:
+                # 处理者卡住时不再等待（其占用在处理结束前一直有效，重试仍会等待，最终由 run 直接处理）
+                self.wait_timeouts += 1
+                logger.warning(f"等待幂等键 {claim.key[:12]} 的处理结果超时（{self.wait_seconds} 秒）")
+                return None
+            return self._as_replay(result) if result is not None else None
+
+        deadline = time.monotonic() + self.lock_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+            result = await self._load(claim.key)
+            if result is not None:
+                return result
+            if not await self._lock_held(claim.key):
+                return await self._load(claim.key)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.replays + self.collapsed + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend,
+            "replays": self.replays,
+            "collapsed": self.collapsed,
+            "misses": self.misses,
+            "replay_rate": round((self.replays + self.collapsed) / total, 4) if total else 0.0,
+            "in_flight": len(self._inflight),
+            "wait_timeouts": self.wait_timeouts,
+            "entries": len(self._entries) if self.backend != "redis" else None
+        }
+
+    @staticmethod
+    def _as_replay(result: DataProcessingResult) -> DataProcessingResult:
+        return result.model_copy(update={"idempotent_replay": True})
+
+    # === 存储 ===
+    async def _load(self, key: str) -> Optional[DataProcessingResult]:
+        raw = None
+        if self.backend == "redis":
+            raw = await self._redis_call("get", REDIS_RESULT_PREFIX + key)
+        if raw is None:
+            raw = self._memory_get(key)
+        if raw is None:
+            return None
+        try:
+            return self._as_replay(DataProcessingResult.model_validate_json(raw))
+        except ValueError as e:
+            logger.warning(f"幂等结果格式错误，忽略: {e}")
+            return None
+
+    async def _save(self, key: str, result: DataProcessingResult):
+        raw = result.model_copy(update={"idempotent_replay": False}).model_dump_json()
+        if self.backend == "redis" and await self._redis_call("set", REDIS_RESULT_PREFIX + key, raw, ex=self.ttl_seconds):
+            return
+        self._memory_set(key, raw)
+
+    async def _acquire_lock(self, key: str, token: str) -> bool:
+        if self.backend != "redis":
+            return True
+        from .redis_async import get_async_redis
+        try:
+            return bool(await get_async_redis().set(REDIS_LOCK_PREFIX + key, token, nx=True, ex=self.lock_seconds))
+        except Exception as e:
+            # Redis 不可用时只在进程内合并
+            self._warn_redis(e)
+            return True
+
+    async def _release_lock(self, key: str, token: Optional[str]):
+        if self.backend != "redis" or token is None:
+            return
+        from .redis_async import get_async_redis
+        try:
+            if self._release_script is None:
+                self._release_script = get_async_redis().register_script(_RELEASE_LOCK_SCRIPT)
+            await self._release_script(keys=[REDIS_LOCK_PREFIX + key], args=[token])
+        except Exception as e:
+            self._warn_redis(e)
+
+    async def _lock_held(self, key: str) -> bool:
+        if self.backend != "redis":
+            return False
+        return bool(await self._redis_call("exists", REDIS_LOCK_PREFIX + key))
+
+    async def _redis_call(self, method: str, *args, **kwargs):
+        from .redis_async import get_async_redis
+        try:
+            return await getattr(get_async_redis(), method)(*args, **kwargs)
+        except Exception as e:
+            self._warn_redis(e)
+            return None
+
+    def _warn_redis(self, error: Exception):
+        # Redis 不可用时退回进程内存储，警告每分钟最多输出一次
+        if time.monotonic() - self._last_redis_warning > 60:
+            self._last_redis_warning = time.monotonic()
+            logger.warning(f"Redis 幂等存储不可用，使用进程内存储: {error}")
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, raw = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return raw
+
+    def _memory_set(self, key: str, raw: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, raw)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+# 全局幂等存储实例
+ingest_idempotency = IdempotencyStore()
@@ -0,0 +1,257 @@
+"""
+数据库索引管理
+
+各集合的索引在 _build_index_specs() 中声明，应用启动时（MONGO_ENSURE_INDEXES）或通过
+migrations/ensure_indexes.py 幂等地创建：已存在相同键的索引时跳过，键相同但选项不同时
+只报告冲突，不删除已有索引。上传时按业务键更新插入的集合使用唯一索引。
+
+index_report() 用 $indexStats 汇总每个集合缺失的索引和自统计开始以来未被使用的索引。
+"""
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pymongo
+from pymongo import ASCENDING, DESCENDING
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MONGO_ENSURE_INDEXES = os.environ.get("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+
+class IndexSpec:
+    """一个集合索引的声明"""
+
+    def __init__(
+        self,
+        collection: str,
+        keys: Sequence[Tuple[str, int]],
+        name: str,
+        unique: bool = False,
+        description: str = ""
+    ):
+        self.collection = collection
+        self.keys = list(keys)
+        self.name = name
+        self.unique = unique
+        self.description = description
+
+    def matches(self, info: Dict[str, Any]) -> bool:
+        """已有索引的键是否与声明相同"""
+        return [
+            (field, direction if isinstance(direction, str) else int(direction))
+            for field, direction in info.get("key", [])
+        ] == self.keys
+
+    def options_match(self, info: Dict[str, Any]) -> bool:
+        return bool(info.get("unique", False)) == self.unique
+
+def _build_index_specs() -> List[IndexSpec]:
+    from database import (
+        USERS_COLLECTION, COMMENTS_COLLECTION, NOTES_COLLECTION, NOTIFICATIONS_COLLECTION,
+        USER_NOTES_COLLECTION, STRUCTURED_COMMENTS_COLLECTION, USER_INFO_COLLECTION,
+        NOTE_DETAILS_COLLECTION, RAW_ARCHIVE_COLLECTION
+    )
+    from .rollups import ROLLUP_COLLECTION
+
+    return [
+        # 结构化评论：commentId 为更新插入键；历史评论按作者和被回复评论查询
+        IndexSpec(STRUCTURED_COMMENTS_COLLECTION, [("commentId", ASCENDING)], "commentId_unique", unique=True,
+                  description="save_structured_comments 更新插入键、$graphLookup 查找被回复评论"),
+        IndexSpec(STRUCTURED_COMMENTS_COLLECTION, [("authorId", ASCENDING)], "authorId",
+                  description="get_user_historical_comments、通知关联评论"),
+        IndexSpec(STRUCTURED_COMMENTS_COLLECTION, [("repliedId", ASCENDING)], "repliedId",
+                  description="get_user_historical_comments 的 $graphLookup 查找回复、写入时查找对话参与者"),
+        IndexSpec(STRUCTURED_COMMENTS_COLLECTION, [("noteId", ASCENDING), ("timestamp", ASCENDING)], "noteId_timestamp",
+                  description="按笔记查询评论、笔记评论树、回填线程字段"),
+        IndexSpec(STRUCTURED_COMMENTS_COLLECTION, [("rootCommentId", ASCENDING), ("timestamp", ASCENDING)],
+                  "rootCommentId_timestamp", description="单个线程的评论树、父评论晚到时修复线程字段"),
+        IndexSpec(STRUCTURED_COMMENTS_COLLECTION, [("ancestorIds", ASCENDING)], "ancestorIds",
+                  description="写入时查找对话参与者（多键索引）"),
+        # 原始评论：(id, noteId) 为更新插入键
+        IndexSpec(COMMENTS_COLLECTION, [("id", ASCENDING), ("noteId", ASCENDING)], "id_noteId_unique", unique=True,
+                  description="save_comments_with_upsert 更新插入键"),
+        IndexSpec(COMMENTS_COLLECTION, [("fetch_time", DESCENDING), ("_id", DESCENDING)], "fetch_time_id_desc",
+                  description="评论列表游标分页、按日统计"),
+        IndexSpec(COMMENTS_COLLECTION, [("searchTokens", ASCENDING)], "searchTokens",
+                  description="关键字搜索二元组（多键索引）"),
+        # 笔记
+        IndexSpec(NOTES_COLLECTION, [("noteId", ASCENDING)], "noteId_unique", unique=True,
+                  description="save_notes 更新插入键"),
+        IndexSpec(NOTES_COLLECTION, [("fetchTimestamp", DESCENDING)], "fetchTimestamp_desc",
+                  description="按抓取时间排序"),
+        IndexSpec(NOTES_COLLECTION, [("fetch_time", DESCENDING), ("_id", DESCENDING)], "fetch_time_id_desc",
+                  description="笔记列表游标分页、按日统计"),
+        IndexSpec(NOTES_COLLECTION, [("publishTime", DESCENDING)], "publishTime_desc",
+                  description="get_notes 排序"),
+        IndexSpec(NOTES_COLLECTION, [("searchTokens", ASCENDING)], "searchTokens",
+                  description="关键字搜索二元组（多键索引）"),
+        IndexSpec(NOTE_DETAILS_COLLECTION, [("noteId", ASCENDING)], "noteId_unique", unique=True,
+                  description="笔记详情更新插入键"),
+        IndexSpec(NOTE_DETAILS_COLLECTION, [("fetchTimestamp", DESCENDING), ("_id", DESCENDING)], "fetchTimestamp_id_desc",
+                  description="笔记详情列表游标分页"),
+        IndexSpec(NOTE_DETAILS_COLLECTION, [("searchTokens", ASCENDING)], "searchTokens",
+                  description="关键字搜索二元组（多键索引）"),
+        # 用户
+        IndexSpec(USER_INFO_COLLECTION, [("id", ASCENDING)], "id_unique", unique=True,
+                  description="save_user_info 更新插入键"),
+        IndexSpec(USER_INFO_COLLECTION, [("updatedAt", DESCENDING), ("_id", DESCENDING)], "updatedAt_id_desc",
+                  description="用户列表游标分页"),
+        IndexSpec(USER_INFO_COLLECTION, [("searchTokens", ASCENDING)], "searchTokens",
+                  description="关键字搜索二元组（多键索引）"),
+        IndexSpec(USERS_COLLECTION, [("username", ASCENDING)], "username_unique", unique=True,
+                  description="登录和注册"),
+        # 用户备注
+        IndexSpec(USER_NOTES_COLLECTION, [("userId", ASCENDING), ("notificationHash", ASCENDING)],
+                  "userId_notificationHash_unique", unique=True, description="备注更新插入键"),
+        IndexSpec(USER_NOTES_COLLECTION, [("updatedAt", DESCENDING), ("_id", DESCENDING)], "updatedAt_id_desc",
+                  description="关联评论的备注列表游标分页"),
+        # 通知
+        IndexSpec(NOTIFICATIONS_COLLECTION, [("timestamp", DESCENDING), ("_id", DESCENDING)], "timestamp_id_desc",
+                  description="通知列表游标分页、按日统计"),
+        IndexSpec(NOTIFICATIONS_COLLECTION, [("type", ASCENDING), ("timestamp", DESCENDING)], "type_timestamp",
+                  description="按类型筛选通知"),
+        IndexSpec(NOTIFICATIONS_COLLECTION, [("searchTokens", ASCENDING)], "searchTokens",
+                  description="关键字搜索二元组（多键索引）"),
+        # 原始响应归档：按首次接收时间（和数据类型）顺序重新处理
+        IndexSpec(RAW_ARCHIVE_COLLECTION, [("first_seen", ASCENDING)], "first_seen",
+                  description="iter_archived_payloads 排序"),
+        IndexSpec(RAW_ARCHIVE_COLLECTION, [("data_type", ASCENDING), ("first_seen", ASCENDING)], "data_type_first_seen",
+                  description="按数据类型重新处理"),
+        # 按日汇总：(集合, 维度, 日期, 键) 为 $inc 更新插入键；排行榜按计数降序读取
+        IndexSpec(ROLLUP_COLLECTION, [("collection", ASCENDING), ("dimension", ASCENDING), ("day", ASCENDING),
+                                      ("key", ASCENDING)], "collection_dimension_day_key_unique", unique=True,
+                  description="record_documents 更新插入键、按日读取总数"),
+        IndexSpec(ROLLUP_COLLECTION, [("collection", ASCENDING), ("dimension", ASCENDING), ("day", ASCENDING),
+                                      ("count", DESCENDING)], "collection_dimension_day_count_desc",
+                  description="统计接口排行榜"),
+        # 抓取规则
+        IndexSpec("capture_rules", [("name", ASCENDING)], "name_unique", unique=True,
+                  description="按规则名称查询和更新"),
+    ]
+
+_index_specs: Optional[List[IndexSpec]] = None
+
+def get_index_specs(collections: Optional[Sequence[str]] = None) -> List[IndexSpec]:
+    """声明的索引，可按集合筛选"""
+    global _index_specs
+    if _index_specs is None:
+        _index_specs = _build_index_specs()
+    if collections is None:
+        return list(_index_specs)
+    return [spec for spec in _index_specs if spec.collection in collections]
+
+def _specs_by_collection(specs: Sequence[IndexSpec]) -> Dict[str, List[IndexSpec]]:
+    grouped: Dict[str, List[IndexSpec]] = {}
+    for spec in specs:
+        grouped.setdefault(spec.collection, []).append(spec)
+    return grouped
+
+async def ensure_indexes(
+    collections: Optional[Sequence[str]] = None,
+    dry_run: bool = False
+) -> Dict[str, List[str]]:
+    """
+    创建缺失的声明索引（幂等）
+
+    Returns:
+        {"created": [...], "existing": [...], "conflicts": [...], "failed": [...]}，元素为 "集合.索引名"
+    """
+    from database import get_database
+
+    database = await get_database()
+    summary: Dict[str, List[str]] = {"created": [], "existing": [], "conflicts": [], "failed": []}
+
+    for collection_name, specs in _specs_by_collection(get_index_specs(collections)).items():
+        collection = database[collection_name]
+        existing = await collection.index_information()
+        for spec in specs:
+            label = f"{collection_name}.{spec.name}"
+            current = next((info for info in existing.values() if spec.matches(info)), None)
+            if current is not None:
+                if spec.options_match(current):
+                    summary["existing"].append(label)
+                else:
+                    # 不自动删除已有索引，由运维确认后处理
+                    summary["conflicts"].append(label)
+                    logger.warning(f"索引 {label} 的键已存在但 unique 选项不同，未修改")
+                continue
+
+            if dry_run:
+                summary["created"].append(label)
+                continue
+            try:
+                await collection.create_index(spec.keys, name=spec.name, unique=spec.unique)
+                summary["created"].append(label)
+                logger.info(f"已创建索引 {label}")
+            except pymongo.errors.OperationFailure as e:
+                summary["failed"].append(label)
+                if spec.unique:
+                    logger.error(f"创建唯一索引 {label} 失败，集合中可能存在重复数据，请先去重: {e}")
+                else:
+                    logger.error(f"创建索引 {label} 失败: {e}")
+
+    logger.info(
+        "索引检查完成%s: 新建 %d, 已存在 %d, 冲突 %d, 失败 %d",
+        "（仅预览）" if dry_run else "",
+        len(summary["created"]), len(summary["existing"]), len(summary["conflicts"]), len(summary["failed"])
+    )
+    return summary
+
+async def index_report(collections: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    汇总各集合缺失的声明索引和未被使用的索引
+
+    使用次数来自 $indexStats（自 mongod 启动或索引创建以来的访问次数），
+    没有权限执行 $indexStats 时只报告缺失索引
+    """
+    from database import get_database
+
+    database = await get_database()
+    report: Dict[str, Any] = {}
+    for collection_name, specs in _specs_by_collection(get_index_specs(collections)).items():
+        collection = database[collection_name]
+        existing = await collection.index_information()
+        missing = [
+            spec.name for spec in specs
+            if not any(spec.matches(info) for info in existing.values())
+        ]
+
+        usage: Dict[str, Dict[str, Any]] = {}
+        try:
+            async for stats in collection.aggregate([{"$indexStats": {}}]):
+                accesses = stats.get("accesses", {})
+                usage[stats["name"]] = {
+                    "ops": int(accesses.get("ops", 0)),
+                    "since": accesses.get("since")
+                }
+        except pymongo.errors.OperationFailure as e:
+            logger.warning(f"无法读取集合 {collection_name} 的索引使用统计: {e}")
+            usage = {}
+
+        declared = {name for name, info in existing.items() if any(spec.matches(info) for spec in specs)}
+        report[collection_name] = {
+            "missing": missing,
+            "unused": sorted(name for name, stats in usage.items() if stats["ops"] == 0 and name != "_id_"),
+            "undeclared": sorted(name for name in existing if name != "_id_" and name not in declared),
+            "usage": usage
+        }
+    return report
+
+def log_index_report(report: Dict[str, Any]):
+    """输出索引报告中需要关注的部分"""
+    for collection_name, entry in report.items():
+        if entry["missing"]:
+            logger.warning(f"集合 {collection_name} 缺少索引: {', '.join(entry['missing'])}")
+        if entry["unused"]:
+            logger.info(f"集合 {collection_name} 中未被使用的索引: {', '.join(entry['unused'])}")
+        if entry["undeclared"]:
+            logger.info(f"集合 {collection_name} 中未声明的索引: {', '.join(entry['undeclared'])}")
+
+async def ensure_indexes_on_startup():
+    """应用启动时创建缺失的索引并输出索引报告（MONGO_ENSURE_INDEXES=false 时跳过）"""
+    if not MONGO_ENSURE_INDEXES:
+        logger.info("已关闭启动时索引检查 (MONGO_ENSURE_INDEXES=false)")
+        return
+    await ensure_indexes()
+    log_index_report(await index_report())
@@ -0,0 +1,131 @@
+"""
+上传去重服务
+
+对 (数据类型, 规范化URL, 规范化编码的响应JSON) 计算指纹，并与最近处理过的指纹比对。
+插件重复发送的相同响应（重新打开笔记、失败重试等）会跳过解析和写库
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+INGEST_DEDUP_ENABLED = os.environ.get("INGEST_DEDUP_ENABLED", "true").lower() == "true"
+# 指纹存储后端: memory（进程内LRU）或 redis（多进程共享）
+INGEST_DEDUP_BACKEND = os.environ.get("INGEST_DEDUP_BACKEND", "memory").lower()
+INGEST_DEDUP_MAX_ENTRIES = int(os.environ.get("INGEST_DEDUP_MAX_ENTRIES", 50000))
+INGEST_DEDUP_TTL_SECONDS = int(os.environ.get("INGEST_DEDUP_TTL_SECONDS", 600))
+# 规范化URL时忽略的查询参数（会话相关、不影响响应内容）
+INGEST_DEDUP_IGNORED_PARAMS = frozenset(
+    p.strip() for p in os.environ.get("INGEST_DEDUP_IGNORED_PARAMS", "xsec_token,_,t").split(",") if p.strip()
+)
+REDIS_FINGERPRINT_PREFIX = "xhs:ingest:fp:"
+
+def normalize_url(url: str) -> str:
+    """规范化URL：小写协议和主机、去掉片段和忽略参数、查询参数排序"""
+    try:
+        parts = urlsplit(url or "")
+    except ValueError:
+        return url or ""
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in INGEST_DEDUP_IGNORED_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+def compute_fingerprint(data_type: str, url: str, body: bytes) -> str:
+    """计算上传指纹"""
+    digest = hashlib.sha256()
+    digest.update(data_type.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_url(url).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+class RecentFingerprintStore:
+    """最近指纹存储，带命中率计数"""
+
+    def __init__(
+        self,
+        backend: str = INGEST_DEDUP_BACKEND,
+        max_entries: int = INGEST_DEDUP_MAX_ENTRIES,
+        ttl_seconds: int = INGEST_DEDUP_TTL_SECONDS
+    ):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def seen(self, fingerprint: str) -> bool:
+        """检查指纹是否在最近处理过，并更新命中计数"""
+        if self.backend == "redis":
+            found = await self._redis_exists(fingerprint)
+        else:
+            found = self._memory_exists(fingerprint)
+
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    async def remember(self, fingerprint: str):
+        """记录已成功处理的指纹"""
+        if self.backend == "redis":
+            await self._redis_remember(fingerprint)
+        else:
+            self._memory_remember(fingerprint)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率统计"""
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self._entries) if self.backend != "redis" else None
+        }
+
+    def _memory_exists(self, fingerprint: str) -> bool:
+        expires_at = self._entries.get(fingerprint)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._entries[fingerprint]
+            return False
+        self._entries.move_to_end(fingerprint)
+        return True
+
+    def _memory_remember(self, fingerprint: str):
+        self._entries[fingerprint] = time.monotonic() + self.ttl_seconds
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _redis_exists(self, fingerprint: str) -> bool:
+        from .redis_async import get_async_redis
+        try:
+            return bool(await get_async_redis().exists(REDIS_FINGERPRINT_PREFIX + fingerprint))
+        except Exception as e:
+            # Redis 不可用时不去重，保证数据照常处理
+            logger.warning(f"查询上传指纹失败，跳过去重: {e}")
+            return False
+
+    async def _redis_remember(self, fingerprint: str):
+        from .redis_async import get_async_redis
+        try:
+            await get_async_redis().set(REDIS_FINGERPRINT_PREFIX + fingerprint, 1, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"记录上传指纹失败: {e}")
+
+# 全局指纹存储实例
+recent_fingerprints = RecentFingerprintStore()
@@ -0,0 +1,257 @@
+"""
+异步摄取队列服务
+
+基于 Redis Streams 的持久化摄取队列：上传接口只负责校验并入队，
+由消费组中的工作协程（可分布在多个节点/进程）调用 NetworkDataProcessor 完成解析与保存
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import redis.exceptions
+
+from ..models.network import RawNetworkData, DataProcessingResult, IngestTicket
+from .redis_async import get_async_redis
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 队列配置（可通过环境变量覆盖）
+INGEST_STREAM_KEY = os.environ.get("INGEST_STREAM_KEY", "xhs:ingest:stream")
+INGEST_CONSUMER_GROUP = os.environ.get("INGEST_CONSUMER_GROUP", "xhs-ingest-workers")
+INGEST_TICKET_PREFIX = "xhs:ingest:ticket:"
+INGEST_TICKET_TTL_SECONDS = int(os.environ.get("INGEST_TICKET_TTL_SECONDS", 24 * 3600))
+INGEST_WORKER_COUNT = int(os.environ.get("INGEST_WORKER_COUNT", 0))  # 随应用启动的消费协程数，0 表示不在API进程内消费
+INGEST_READ_COUNT = int(os.environ.get("INGEST_READ_COUNT", 10))  # 每次读取的消息数
+INGEST_BLOCK_MS = int(os.environ.get("INGEST_BLOCK_MS", 5000))  # 阻塞读取的超时时间
+INGEST_CLAIM_IDLE_MS = int(os.environ.get("INGEST_CLAIM_IDLE_MS", 60000))  # 超过该空闲时间的待确认消息会被其他消费者认领
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 5))  # 单条消息的最大处理次数
+
+TICKET_QUEUED = "queued"
+TICKET_PROCESSING = "processing"
+TICKET_SUCCEEDED = "succeeded"
+TICKET_FAILED = "failed"
+
+def _ticket_key(ticket_id: str) -> str:
+    return f"{INGEST_TICKET_PREFIX}{ticket_id}"
+
+async def _save_ticket(ticket: IngestTicket):
+    """写入票据状态（带过期时间）"""
+    ticket.updated_at = datetime.utcnow()
+    await get_async_redis().set(
+        _ticket_key(ticket.ticket_id),
+        ticket.model_dump_json(),
+        ex=INGEST_TICKET_TTL_SECONDS
+    )
+
+async def ensure_consumer_group():
+    """确保消费组存在（幂等）"""
+    try:
+        await get_async_redis().xgroup_create(
+            INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, id="0", mkstream=True
+        )
+        logger.info(f"已创建摄取消费组: {INGEST_CONSUMER_GROUP} (stream: {INGEST_STREAM_KEY})")
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def enqueue_raw_data(
+    raw_data: RawNetworkData,
+    user: Optional[str] = None,
+    idempotency_key: Optional[str] = None
+) -> IngestTicket:
+    """
+    将原始网络数据追加到摄取队列并返回票据（幂等键随消息保存，处理时使用）
+
+    Raises:
+        ConnectionError: Redis 不可用时抛出
+    """
+    ticket = IngestTicket(
+        ticket_id=uuid.uuid4().hex,
+        status=TICKET_QUEUED,
+        rule_name=raw_data.rule_name,
+        url=raw_data.url,
+        submitted_by=user
+    )
+    try:
+        # 先写票据再入队，避免工作协程处理时票据尚不存在
+        await _save_ticket(ticket)
+        await get_async_redis().xadd(
+            INGEST_STREAM_KEY,
+            {
+                "ticket_id": ticket.ticket_id,
+                "user": user or "",
+                "idempotency_key": idempotency_key or "",
+                "payload": raw_data.model_dump_json()
+            }
+        )
+    except redis.exceptions.RedisError as e:
+        logger.error(f"写入摄取队列失败: {e}")
+        raise ConnectionError("摄取队列服务不可用。") from e
+
+    logger.debug(f"已入队摄取票据 {ticket.ticket_id}, 规则: {raw_data.rule_name}")
+    return ticket
+
+async def get_ticket(ticket_id: str) -> Optional[IngestTicket]:
+    """查询票据状态，不存在或已过期时返回 None"""
+    try:
+        raw = await get_async_redis().get(_ticket_key(ticket_id))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"查询摄取票据 {ticket_id} 失败: {e}")
+        raise ConnectionError("摄取队列服务不可用。") from e
+    if not raw:
+        return None
+    return IngestTicket.model_validate_json(raw)
+
+async def get_queue_stats() -> Dict[str, Any]:
+    """获取队列长度与待确认消息数"""
+    client = get_async_redis()
+    length = await client.xlen(INGEST_STREAM_KEY)
+    pending = 0
+    try:
+        summary = await client.xpending(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP)
+        pending = summary.get("pending", 0) if summary else 0
+    except redis.exceptions.ResponseError:
+        # 消费组尚未创建
+        pass
+    return {"stream_length": length, "pending": pending}
+
+class IngestWorkerPool:
+    """摄取队列消费者池，每个协程是消费组中的一个独立消费者"""
+
+    def __init__(self, worker_count: int = INGEST_WORKER_COUNT, consumer_prefix: Optional[str] = None):
+        self.worker_count = worker_count
+        self.consumer_prefix = consumer_prefix or f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self):
+        """启动消费协程"""
+        if self.worker_count <= 0 or self._tasks:
+            return
+        await ensure_consumer_group()
+        self._stopping = False
+        for index in range(self.worker_count):
+            consumer_name = f"{self.consumer_prefix}-{index}"
+            self._tasks.append(asyncio.create_task(self._worker_loop(consumer_name)))
+        logger.info(f"摄取队列消费者已启动: {self.worker_count} 个 (前缀: {self.consumer_prefix})")
+
+    async def stop(self):
+        """停止消费协程，未确认的消息会在空闲超时后被其他消费者认领"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("摄取队列消费者已停止")
+
+    async def run_forever(self):
+        """启动并阻塞运行，直到被取消（用于独立工作进程）"""
+        await self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def _worker_loop(self, consumer_name: str):
+        client = get_async_redis()
+        last_claim = 0.0
+        loop = asyncio.get_running_loop()
+
+        while not self._stopping:
+            try:
+                messages = []
+                # 定期认领崩溃或卡住的消费者遗留的消息
+                if loop.time() - last_claim >= INGEST_CLAIM_IDLE_MS / 1000:
+                    last_claim = loop.time()
+                    claimed = await client.xautoclaim(
+                        INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, consumer_name,
+                        min_idle_time=INGEST_CLAIM_IDLE_MS, start_id="0-0", count=INGEST_READ_COUNT
+                    )
+                    messages = claimed[1] if claimed else []
+                    if messages:
+                        logger.warning(f"[{consumer_name}] 认领了 {len(messages)} 条超时未确认的摄取消息")
+
+                if not messages:
+                    response = await client.xreadgroup(
+                        INGEST_CONSUMER_GROUP, consumer_name,
+                        {INGEST_STREAM_KEY: ">"},
+                        count=INGEST_READ_COUNT, block=INGEST_BLOCK_MS
+                    )
+                    messages = response[0][1] if response else []
+
+                for message_id, fields in messages:
+                    if fields:
+                        await self._handle_message(consumer_name, message_id, fields)
+                    else:
+                        # 消息已被删除（xautoclaim 返回空字段），直接确认
+                        await client.xack(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, message_id)
+
+            except asyncio.CancelledError:
+                raise
+            except redis.exceptions.ResponseError as e:
+                if "NOGROUP" in str(e):
+                    await ensure_consumer_group()
+                else:
+                    logger.error(f"[{consumer_name}] 读取摄取队列出错: {e}")
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.exception(f"[{consumer_name}] 摄取消费循环出错: {e}")
+                await asyncio.sleep(1)
+
+    async def _handle_message(self, consumer_name: str, message_id: str, fields: Dict[str, str]):
+        """处理单条队列消息；只有得到终态结果后才确认并删除消息"""
+        from .network_data_processor import network_processor
+
+        ticket_id = fields.get("ticket_id", "")
+        ticket = await get_ticket(ticket_id) if ticket_id else None
+        if ticket is None:
+            # 票据已过期，仍然处理数据但不再记录状态
+            ticket = IngestTicket(ticket_id=ticket_id or message_id, status=TICKET_QUEUED, submitted_by=fields.get("user") or None)
+
+        ticket.attempts += 1
+        if ticket.attempts > INGEST_MAX_ATTEMPTS:
+            ticket.status = TICKET_FAILED
+            ticket.error_message = f"超过最大处理次数 ({INGEST_MAX_ATTEMPTS})"
+            await _save_ticket(ticket)
+            await self._finish(message_id)
+            logger.error(f"[{consumer_name}] 摄取票据 {ticket.ticket_id} 超过最大处理次数，已丢弃")
+            return
+
+        ticket.status = TICKET_PROCESSING
+        await _save_ticket(ticket)
+
+        try:
+            raw_data = RawNetworkData.model_validate_json(fields["payload"])
+        except Exception as e:
+            ticket.status = TICKET_FAILED
+            ticket.error_message = f"队列消息格式错误: {e}"
+            await _save_ticket(ticket)
+            await self._finish(message_id)
+            return
+
+        # 票据状态要反映真实的入库结果，启用写后缓冲时也等待实际写入
+        result: DataProcessingResult = await network_processor.process_raw_data(
+            raw_data, durable=True, idempotency_key=fields.get("idempotency_key") or None
+        )
+        ticket.result = result
+        ticket.status = TICKET_SUCCEEDED if result.success else TICKET_FAILED
+        ticket.error_message = result.error_message
+        await _save_ticket(ticket)
+        await self._finish(message_id)
+        logger.debug(f"[{consumer_name}] 摄取票据 {ticket.ticket_id} 处理完成: {ticket.status}")
+
+    async def _finish(self, message_id: str):
+        """确认并删除已处理的消息，保持流长度只反映积压量"""
+        client = get_async_redis()
+        await client.xack(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, message_id)
+        await client.xdel(INGEST_STREAM_KEY, message_id)
+
+# 全局消费者池实例（由应用 lifespan 启停）
+ingest_worker_pool = IngestWorkerPool()
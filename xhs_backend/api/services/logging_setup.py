@@ -0,0 +1,168 @@
+"""
+日志配置
+
+上传处理路径上的日志量很大，同步写 stderr 和格式化字符串会占用大量CPU。这里提供：
+1. 非阻塞日志：根日志器的处理器换成 QueueHandler，由 QueueListener 在后台线程格式化并输出，
+   调用线程只把日志记录放入队列（不做格式化）
+2. 按日志器采样：LOG_SAMPLE_RATES 中配置的日志器只保留一定比例的 INFO/DEBUG 日志
+3. 单次请求日志预算：log_budget() 范围内 INFO/DEBUG 日志超过预算后丢弃，结束时汇总丢弃条数
+
+WARNING 及以上级别的日志不受采样和预算影响。
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_ASYNC_ENABLED = os.environ.get("LOG_ASYNC_ENABLED", "true").lower() == "true"
+# 格式: "日志器名=比例,日志器名=比例"，按名称前缀匹配，例如 api.services.network_data_processor=0.1
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+LOG_REQUEST_BUDGET = int(os.environ.get("LOG_REQUEST_BUDGET", 50))  # 单次请求最多输出的 INFO/DEBUG 日志条数，0 表示不限
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """解析 LOG_SAMPLE_RATES"""
+    rates: Dict[str, float] = {}
+    for item in value.split(","):
+        name, sep, rate = item.strip().partition("=")
+        if not sep or not name:
+            continue
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logger.warning(f"忽略无效的日志采样配置: {item}")
+    return rates
+
+class LogSamplingFilter(logging.Filter):
+    """按日志器名称前缀对 INFO/DEBUG 日志采样"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def _rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            # 取最长匹配前缀的比例
+            matches = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + ".")]
+            rate = self.rates[max(matches, key=len)] if matches else 1.0
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+# 当前请求剩余的日志预算: [剩余条数, 已丢弃条数]，在请求内创建的协程共享同一计数
+_log_budget: ContextVar[Optional[list]] = ContextVar("log_budget", default=None)
+
+class LogBudgetFilter(logging.Filter):
+    """超出当前请求预算的 INFO/DEBUG 日志被丢弃"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        budget = _log_budget.get()
+        if budget is None or record.levelno >= logging.WARNING:
+            return True
+        if budget[0] > 0:
+            budget[0] -= 1
+            return True
+        budget[1] += 1
+        return False
+
+@contextmanager
+def log_budget(limit: int = LOG_REQUEST_BUDGET, label: str = "请求"):
+    """
+    为代码块设置 INFO/DEBUG 日志预算（已在预算范围内时沿用外层预算）
+
+    结束时若有日志被丢弃，输出一条汇总
+    """
+    if limit <= 0 or _log_budget.get() is not None:
+        yield
+        return
+    budget = [limit, 0]
+    token = _log_budget.set(budget)
+    try:
+        yield
+    finally:
+        _log_budget.reset(token)
+        if budget[1]:
+            logger.info("%s日志超出预算，已省略 %d 条", label, budget[1])
+
+class _DeferredFormatQueueHandler(QueueHandler):
+    """
+    进程内队列处理器：不在调用线程中格式化消息
+
+    标准 QueueHandler 为了能跨进程传递会先格式化消息，进程内队列不需要，
+    格式化留给监听线程中的处理器
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+_configured = False
+
+def setup_logging(level: str = LOG_LEVEL, async_enabled: bool = LOG_ASYNC_ENABLED, sample_rates: Optional[str] = None):
+    """
+    配置根日志器（应用启动时调用一次）
+
+    沿用已有的根日志处理器（如 basicConfig 创建的 stderr 处理器），
+    启用非阻塞日志时把它们移到后台监听线程中
+    """
+    global _listener, _queue_handler, _configured
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _configured:
+        return
+    _configured = True
+
+    if not root.handlers:
+        logging.basicConfig(level=level)
+    filters = [LogBudgetFilter()]
+    rates = parse_sample_rates(LOG_SAMPLE_RATES if sample_rates is None else sample_rates)
+    if rates:
+        filters.append(LogSamplingFilter(rates))
+
+    if async_enabled:
+        handlers = list(root.handlers)
+        _queue_handler = _DeferredFormatQueueHandler(queue.SimpleQueue())
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        target_handlers = [_queue_handler]
+    else:
+        target_handlers = list(root.handlers)
+
+    for handler in target_handlers:
+        for log_filter in filters:
+            handler.addFilter(log_filter)
+
+def stop_logging():
+    """停止后台日志线程并输出队列中剩余的日志，之后的日志恢复为同步输出（应用关闭时调用）"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        for log_filter in _queue_handler.filters:
+            handler.addFilter(log_filter)
+        root.addHandler(handler)
+    _listener = None
+    _queue_handler = None
@@ -0,0 +1,186 @@
+"""
+上传处理监控指标
+
+以 Prometheus 文本格式导出上传数量、提取/保存条数、失败数、各阶段与各集合写入耗时，
+以及每次上传产生的 MongoDB 命令数；另外导出查询结果缓存各路由的命中/未命中次数。
+
+多个 uvicorn worker 时，设置 PROMETHEUS_MULTIPROC_DIR 为各 worker 共享的空目录
+（启动前需清空），各进程把指标写入该目录，导出时汇总所有进程的数据。
+prometheus_client 为可选依赖，不可用时指标记录为空操作。
+"""
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+    )
+except ImportError:  # prometheus_client 为可选依赖
+    CollectorRegistry = Counter = Histogram = REGISTRY = generate_latest = multiprocess = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+METRICS_AVAILABLE = Counter is not None
+
+# 耗时分桶（秒）：上传处理通常在几毫秒到几秒之间
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每次上传的 MongoDB 命令数分桶
+_MONGO_OPS_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+
+if METRICS_AVAILABLE:
+    UPLOADS_TOTAL = Counter(
+        "xhs_uploads_total", "处理的上传数", ["data_type", "outcome"]
+    )
+    UPLOAD_FAILURES_TOTAL = Counter(
+        "xhs_upload_failures_total", "处理失败的上传数", ["data_type"]
+    )
+    ITEMS_EXTRACTED_TOTAL = Counter(
+        "xhs_upload_items_extracted_total", "从上传中提取的条目数", ["data_type"]
+    )
+    ITEMS_SAVED_TOTAL = Counter(
+        "xhs_upload_items_saved_total", "保存成功的条目数", ["data_type"]
+    )
+    UPLOAD_SECONDS = Histogram(
+        "xhs_upload_processing_seconds", "单次上传的处理耗时", ["data_type"], buckets=_LATENCY_BUCKETS
+    )
+    STAGE_SECONDS = Histogram(
+        "xhs_upload_stage_seconds", "上传各处理阶段的耗时", ["stage"], buckets=_LATENCY_BUCKETS
+    )
+    COLLECTION_SAVE_SECONDS = Histogram(
+        "xhs_collection_save_seconds", "各集合一次批量写入的耗时", ["collection"], buckets=_LATENCY_BUCKETS
+    )
+    MONGO_OPS_PER_UPLOAD = Histogram(
+        "xhs_mongo_ops_per_upload", "单次上传产生的MongoDB命令数", ["data_type"], buckets=_MONGO_OPS_BUCKETS
+    )
+    QUERY_CACHE_REQUESTS_TOTAL = Counter(
+        "xhs_query_cache_requests_total", "查询结果缓存的查找次数（outcome: hit、collapsed、miss）", ["route", "outcome"]
+    )
+
+# === MongoDB 命令计数 ===
+# Motor 在线程池中执行命令时会复制当前上下文，命令监听器因此能找到发起命令的上传
+_mongo_op_counter: ContextVar[Optional[list]] = ContextVar("mongo_op_counter", default=None)
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """把 MongoDB 命令计入当前上下文中的上传"""
+
+    def started(self, event):
+        counter = _mongo_op_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# 创建 MongoDB 客户端时注册的命令监听器
+mongo_command_counter = MongoCommandCounter()
+
+@contextmanager
+def count_mongo_ops():
+    """
+    统计代码块内（包括其中创建的协程）发出的 MongoDB 命令数
+
+    用法:
+        with count_mongo_ops() as ops:
+            ...
+        ops[0]  # 命令数
+    """
+    counter = [0]
+    token = _mongo_op_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _mongo_op_counter.reset(token)
+
+@contextmanager
+def detached_mongo_ops():
+    """代码块内的命令不计入任何上传（后台写入任务使用）"""
+    token = _mongo_op_counter.set(None)
+    try:
+        yield
+    finally:
+        _mongo_op_counter.reset(token)
+
+# === 指标记录 ===
+def observe_upload(result: Any, mongo_ops: Optional[int] = None):
+    """记录一次上传的处理结果（DataProcessingResult）"""
+    if not METRICS_AVAILABLE:
+        return
+    data_type = result.data_type or "unknown"
+    if result.idempotent_replay:
+        # 重复请求直接返回保存的结果，不计入处理量和耗时
+        UPLOADS_TOTAL.labels(data_type, "replayed").inc()
+        return
+    if result.deduplicated:
+        outcome = "deduplicated"
+    elif result.success:
+        outcome = "success"
+    else:
+        outcome = "failed"
+        UPLOAD_FAILURES_TOTAL.labels(data_type).inc()
+
+    UPLOADS_TOTAL.labels(data_type, outcome).inc()
+    ITEMS_EXTRACTED_TOTAL.labels(data_type).inc(result.items_extracted)
+    ITEMS_SAVED_TOTAL.labels(data_type).inc(result.items_saved)
+    UPLOAD_SECONDS.labels(data_type).observe(result.processing_time_ms / 1000)
+    for stage, elapsed_ms in (result.stage_timings_ms or {}).items():
+        STAGE_SECONDS.labels(stage).observe(elapsed_ms / 1000)
+    if mongo_ops is not None:
+        MONGO_OPS_PER_UPLOAD.labels(data_type).observe(mongo_ops)
+
+def observe_collection_save(collection: str, elapsed_ms: float):
+    """记录一个集合一次批量写入的耗时"""
+    if METRICS_AVAILABLE:
+        COLLECTION_SAVE_SECONDS.labels(collection).observe(elapsed_ms / 1000)
+
+def observe_query_cache(route: str, outcome: str):
+    """记录一次查询结果缓存查找（命中率 = (hit + collapsed) / 全部）"""
+    if METRICS_AVAILABLE:
+        QUERY_CACHE_REQUESTS_TOTAL.labels(route, outcome).inc()
+
+# === 导出 ===
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    生成 Prometheus 文本格式的指标
+
+    Returns:
+        (指标文本, Content-Type)
+
+    Raises:
+        RuntimeError: prometheus_client 不可用
+    """
+    if not METRICS_AVAILABLE:
+        raise RuntimeError("prometheus_client 未安装，无法导出指标")
+    if PROMETHEUS_MULTIPROC_DIR:
+        # 多进程模式：每次导出时汇总所有 worker 写入的指标文件
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    """worker 退出时清理其在多进程目录中的实时数据（应用关闭时调用）"""
+    if METRICS_AVAILABLE and PROMETHEUS_MULTIPROC_DIR:
+        try:
+            multiprocess.mark_process_dead(os.getpid())
+        except Exception as e:
+            logger.warning(f"清理多进程指标文件失败: {e}")
+
+def metrics_status() -> Dict[str, Any]:
+    """指标导出状态"""
+    return {
+        "available": METRICS_AVAILABLE,
+        "multiprocess": bool(METRICS_AVAILABLE and PROMETHEUS_MULTIPROC_DIR),
+    }
@@ -0,0 +1,232 @@
+"""
+NDJSON 流式上传服务
+
+批量回填时一次上传成千上万条数据，/upload/batch 需要先把整个JSON数组解码成
+List[RawNetworkData] 才开始处理，内存占用随批次大小增长。这里按行读取
+application/x-ndjson 请求体（每行一条上传信封），边读边处理，处理结果也按行流式返回：
+1. 请求体按块读取并切分成行，单行长度有上限，读取位置之外的数据不会进入内存
+2. 同时处理的记录数受限，结果队列有界，客户端读取变慢时暂停读取请求体
+3. 每条记录消耗上传用户的一个令牌，令牌不足时等待而不是拒绝整个上传
+
+因此峰值内存只与并发数和单行长度有关，与上传总条数无关。
+"""
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from ..models.network import DataProcessingResult
+from .network_data_processor import NetworkDataProcessor, NETWORK_BATCH_CONCURRENCY
+from .idempotency import idempotency_key
+from .rate_limit import ingest_rate_limiter
+from .upload_codec import decode_upload_envelope, dumps, loads
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_MAX_LINE_BYTES = int(os.environ.get("NDJSON_MAX_LINE_BYTES", 16 * 1024 * 1024))  # 单行（单条上传）的大小上限
+NDJSON_STREAM_CONCURRENCY = int(os.environ.get("NDJSON_STREAM_CONCURRENCY", NETWORK_BATCH_CONCURRENCY))  # 同时处理的记录数
+NDJSON_MAX_CONCURRENCY = 32  # 客户端可指定的并发数上限
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes],
+    max_line_bytes: int = NDJSON_MAX_LINE_BYTES
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    把请求体数据块切分成行
+
+    Yields:
+        (行号, 行内容)。空行跳过；超过长度上限的行返回 None，其内容被丢弃到下一个换行符
+    """
+    buffer = bytearray()
+    line_no = 0
+    oversized = False
+
+    async for chunk in chunks:
+        start = 0
+        while True:
+            newline = chunk.find(b"\n", start)
+            if newline < 0:
+                break
+            line_no += 1
+            if oversized:
+                oversized = False
+                yield line_no, None
+            else:
+                buffer += chunk[start:newline]
+                if len(buffer) > max_line_bytes:
+                    yield line_no, None
+                elif buffer.strip():
+                    yield line_no, bytes(buffer)
+            buffer.clear()
+            start = newline + 1
+
+        if not oversized:
+            buffer += chunk[start:]
+            if len(buffer) > max_line_bytes:
+                # 超长行不再缓存，读到换行符时报告错误
+                oversized = True
+                buffer.clear()
+
+    if oversized or buffer.strip():
+        line_no += 1
+        yield line_no, None if oversized or len(buffer) > max_line_bytes else bytes(buffer)
+
+def _encode_line(record: Dict[str, Any]) -> bytes:
+    return dumps(record) + b"\n"
+
+async def ingest_ndjson(
+    chunks: AsyncIterator[bytes],
+    processor: NetworkDataProcessor,
+    user: str,
+    durable: bool = False,
+    concurrency: int = NDJSON_STREAM_CONCURRENCY,
+    prepaid_tokens: int = 0
+) -> AsyncIterator[bytes]:
+    """
+    逐行处理 NDJSON 上传，按完成顺序输出每条记录的处理结果，最后输出一行汇总
+
+    输出的每一行:
+        {"type": "result", "line": 行号, ...DataProcessingResult}
+        {"type": "error", "line": 行号或null, "error_message": ...}  记录无法解析、处理时出错或请求体读取失败
+        {"type": "summary", "total": ..., "succeeded": ..., "failed": ..., "items_saved": ...}
+
+    Args:
+        chunks: 请求体数据块
+        processor: 网络数据处理器
+        user: 上传用户（限流键）
+        durable: 启用写后缓冲时，是否等待数据实际写入数据库后再返回结果
+        concurrency: 同时处理的记录数
+        prepaid_tokens: 已在接口依赖中消耗的令牌数，前几条记录不再重复消耗
+    """
+    concurrency = max(1, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    # 结果队列有界：客户端读取变慢时处理协程阻塞在放入结果上，进而暂停读取请求体
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    pending: Set[asyncio.Task] = set()
+    summary = {"type": "summary", "total": 0, "succeeded": 0, "failed": 0, "items_saved": 0}
+    done = object()
+
+    async def process_line(line_no: int, line: bytes):
+        try:
+            try:
+                data, response_json, body = decode_upload_envelope(loads(line))
+            except ValueError as e:
+                record = {"type": "error", "line": line_no, "error_message": f"数据校验失败: {e}"}
+            else:
+                try:
+                    result: DataProcessingResult = await processor.process_raw_data(
+                        data, durable=durable, response_json=response_json, body=body,
+                        canonical_body=response_json is not None,
+                        idempotency_key=idempotency_key(user, data)
+                    )
+                    record = {"type": "result", "line": line_no, **result.model_dump(mode="json")}
+                except Exception as e:
+                    logger.exception(f"处理流式上传第 {line_no} 行时发生错误: {e}")
+                    record = {"type": "error", "line": line_no, "error_message": f"服务器内部错误: {e}"}
+            await results.put(record)
+        finally:
+            semaphore.release()
+
+    async def produce():
+        tokens = prepaid_tokens
+        try:
+            async for line_no, line in iter_ndjson_lines(chunks):
+                if line is None:
+                    await results.put({
+                        "type": "error", "line": line_no,
+                        "error_message": f"单行超过上限 {NDJSON_MAX_LINE_BYTES} 字节"
+                    })
+                    continue
+
+                await semaphore.acquire()
+                if tokens > 0:
+                    tokens -= 1
+                else:
+                    # 令牌不足时等待补充，相当于对这一个上传流限速
+                    while True:
+                        allowed, wait_seconds = await ingest_rate_limiter.acquire(user)
+                        if allowed:
+                            break
+                        await asyncio.sleep(wait_seconds)
+
+                task = asyncio.create_task(process_line(line_no, line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except HTTPException as e:
+            # gzip 请求体解压失败或超出大小上限
+            await results.put({"type": "error", "line": None, "error_message": e.detail})
+        except ClientDisconnect:
+            logger.warning(f"用户 {user} 的流式上传在读取请求体时断开")
+        except Exception as e:
+            logger.exception(f"读取流式上传时发生错误: {e}")
+            await results.put({"type": "error", "line": None, "error_message": f"服务器内部错误: {e}"})
+        finally:
+            if pending:
+                await asyncio.gather(*list(pending), return_exceptions=True)
+            await results.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            record = await results.get()
+            if record is done:
+                break
+            summary["total"] += 1
+            if record.get("success"):
+                summary["succeeded"] += 1
+                summary["items_saved"] += record.get("items_saved", 0)
+            else:
+                summary["failed"] += 1
+            yield _encode_line(record)
+
+        await producer
+        logger.info(
+            "用户 %s 的流式上传完成: 共 %d 条, 成功 %d, 失败 %d, 保存 %d 条目",
+            user, summary["total"], summary["succeeded"], summary["failed"], summary["items_saved"]
+        )
+        yield _encode_line(summary)
+    finally:
+        # 客户端中途断开时停止读取并取消尚未完成的处理
+        if not producer.done():
+            producer.cancel()
+            for task in list(pending):
+                task.cancel()
+
+class NdjsonStreamingResponse(StreamingResponse):
+    """
+    边读请求体边返回的 NDJSON 响应
+
+    StreamingResponse 在旧版 ASGI 协议下会同时监听客户端断开并为此读取请求消息，
+    会吞掉尚未读取的请求体，这里只发送响应；客户端断开时发送失败即停止。
+    响应结束（包括客户端断开）后调用 on_complete
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    def __init__(self, content: AsyncIterator[bytes], on_complete: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_complete = on_complete
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            try:
+                await self.stream_response(send)
+            except OSError:
+                raise ClientDisconnect()
+            finally:
+                # 提前结束时关闭生成器，取消仍在进行的处理
+                aclose = getattr(self.body_iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            if self.background is not None:
+                await self.background()
+        finally:
+            if self.on_complete is not None:
+                self.on_complete()
@@ -4,158 +4,436 @@
 负责将原始网络请求数据解析为结构化数据，并路由到相应的处理流程
 """
 import json
-import re
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Set, Tuple
 from datetime import datetime, timezone
 import asyncio
+import os
+import time
+from collections import Counter
 
 from ..models.network import RawNetworkData, DataProcessingResult
 from ..models.content import CommentItem, Note, IllegalInfo
 from ..models.common import UserInfo
-from ..services.comment import save_comments_with_upsert
-from ..services.note import save_notes
-from ..services.user import save_user_info
-from database import get_database, NOTES_COLLECTION
+from ..services.bulk_writer import WRITE_BUFFER_ENABLED, bulk_writer, write_entities
+from ..services.entity_merge import (
+    ENTITY_USERS, ENTITY_NOTES, ENTITY_STRUCTURED_COMMENTS, ENTITY_COMMENTS,
+    empty_entities, entity_id, merge_entity_list, merge_entity_batches
+)
+from ..services.raw_archive import archive_raw_data
+from ..services.ingest_dedup import INGEST_DEDUP_ENABLED, compute_fingerprint, recent_fingerprints
+from ..services.note_cache import note_metadata_cache
+from ..services.upload_codec import decode_response_body, dumps
+from ..services.data_pipelines import DataTypePipeline, StageTimer, pipeline_registry
+from ..services.metrics import count_mongo_ops, observe_upload
+from ..services.logging_setup import LOG_REQUEST_BUDGET, log_budget
+from ..services.idempotency import ingest_idempotency
 
 logger = logging.getLogger(__name__)
 
+# 批量上传时同时解析的最大数量
+NETWORK_BATCH_CONCURRENCY = int(os.environ.get("NETWORK_BATCH_CONCURRENCY", 8))
+
+# 等待写后缓冲写入后记录指纹的任务（保持引用，避免任务被回收）
+_pending_fingerprints: Set[asyncio.Task] = set()
+
 class NetworkDataProcessor:
-    """网络数据处理器"""
-    
-    def __init__(self):
-        self.parsers = {
-            'comment': self._parse_comment_data,
-            'comment_page': self._parse_comment_page_data,  # 新增评论页面解析器
-            'sub_comment_page': self._parse_sub_comment_page_data,  # 新增子评论页面解析器
-            'notification': self._parse_notification_data,
-            'comment_notification_feed': self._parse_comment_notification_feed_data, # 重构后的提及通知解析器
-            'note': self._parse_note_data,
-            'user': self._parse_user_data,
-            'search': self._parse_search_data,
-            'recommendation': self._parse_recommendation_data
+    """
+    网络数据处理器
+
+    各数据类型的识别规则和处理阶段登记在 pipeline_registry 中（见模块末尾），
+    处理器本身不保存每次请求的状态，可以在所有请求间共享
+    """
+
+    @property
+    def parsers(self) -> Dict[str, Any]:
+        """各数据类型的解析器（兼容旧接口）"""
+        return {
+            pipeline.data_type: pipeline.parser.__get__(self)
+            for pipeline in pipeline_registry if pipeline.parser is not None
         }
     
-    async def process_raw_data(self, raw_data: RawNetworkData) -> DataProcessingResult:
+    async def process_raw_data(
+        self,
+        raw_data: RawNetworkData,
+        archive: bool = True,
+        dedup: bool = True,
+        durable: bool = False,
+        response_json: Optional[Any] = None,
+        body: Optional[bytes] = None,
+        canonical_body: bool = False,
+        idempotency_key: Optional[str] = None
+    ) -> DataProcessingResult:
         """
         处理原始网络数据
+
+        Args:
+            raw_data: 原始网络数据
+            archive: 是否归档原始响应体（从归档重新处理时应关闭）
+            dedup: 是否跳过最近已处理过的相同上传（从归档重新处理时应关闭）
+            durable: 启用写后缓冲时，是否等待数据实际写入数据库后再返回
+            response_json: 已解码的响应JSON，提供时不再解码 raw_data.response_body
+            body: 响应体字节（与 response_json 一起提供，用于归档和去重）
+            canonical_body: body 是否就是 response_json 的规范化编码（upload_codec.dumps 的结果），是时去重指纹直接使用 body
+            idempotency_key: 幂等键，已成功处理过的上传直接返回保存的结果
         """
+        if idempotency_key:
+            result = await ingest_idempotency.run(
+                idempotency_key,
+                lambda: self.process_raw_data(
+                    raw_data, archive=archive, dedup=dedup, durable=durable,
+                    response_json=response_json, body=body, canonical_body=canonical_body
+                )
+            )
+            if result.idempotent_replay:
+                observe_upload(result)
+            return result
+
         start_time = datetime.utcnow()
         
-        try:
-            # 根据规则名称确定数据类型
-            data_type = self._determine_data_type(raw_data.rule_name, raw_data.url)
-            
-            if not data_type:
-                return DataProcessingResult(
-                    raw_data_id=str(raw_data.request_id),
-                    success=False,
-                    error_message="无法确定数据类型"
+        with count_mongo_ops() as mongo_ops, log_budget(label="上传处理"):
+            try:
+                parsed = await self.parse_raw_data(
+                    raw_data, archive=archive, dedup=dedup, start_time=start_time,
+                    response_json=response_json, body=body, canonical_body=canonical_body
                 )
-            
-            # 解析响应数据
-            parsed_data = await self._parse_response_data(raw_data, data_type)
-            
-            if not parsed_data:
-                return DataProcessingResult(
+                if isinstance(parsed, DataProcessingResult):
+                    result = parsed
+                else:
+                    with parsed.timer.stage('persist'):
+                        outcomes = await parsed.pipeline.persister(self, parsed.entities, durable=durable)
+                    result = await self._build_result(parsed, outcomes)
+                
+            except Exception as e:
+                processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
+                logger.exception(f"处理网络数据时发生错误: {e}")
+                
+                result = DataProcessingResult(
                     raw_data_id=str(raw_data.request_id),
                     success=False,
-                    data_type=data_type,
-                    error_message="响应数据解析失败"
+                    error_message=str(e),
+                    processing_time_ms=processing_time
                 )
-            
-            # 保存解析后的数据
-            save_result = await self._save_parsed_data(data_type, parsed_data)
-
-            items_extracted = 0
-            if isinstance(parsed_data, list):
-                items_extracted = len(parsed_data)
-            elif isinstance(parsed_data, dict):
-                items_extracted = sum(len(v) for v in parsed_data.values())
-            
-            processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
-            
-            return DataProcessingResult(
-                raw_data_id=str(raw_data.request_id),
-                success=save_result['success'],
-                data_type=data_type,
-                items_extracted=items_extracted,
-                items_saved=save_result.get('saved_count', 0),
-                error_message=save_result.get('error'),
-                processing_time_ms=processing_time
+
+        observe_upload(result, mongo_ops[0])
+        return result
+
+    async def process_batch(
+        self,
+        raw_data_list: List[RawNetworkData],
+        archive: bool = True,
+        dedup: bool = True,
+        durable: bool = False,
+        concurrency: int = NETWORK_BATCH_CONCURRENCY,
+        idempotency_keys: Optional[List[Optional[str]]] = None
+    ) -> List[DataProcessingResult]:
+        """
+        批量处理原始网络数据
+
+        各条数据并发解析（并发数受限），使用同一保存器的数据解析出的用户、笔记、评论
+        按ID合并去重后每个集合只执行一次批量写入，再按各条数据自身的实体统计保存结果。
+        返回的结果列表与输入顺序一致。
+
+        idempotency_keys 与 raw_data_list 一一对应：已处理过的数据直接返回保存的结果；
+        正由其他请求处理的数据在本批写入完成后再等待，避免两个批次互相等待
+        """
+        if idempotency_keys and ingest_idempotency.enabled:
+            return await self._process_batch_idempotent(
+                raw_data_list, idempotency_keys, archive=archive, dedup=dedup, durable=durable, concurrency=concurrency
             )
-            
-        except Exception as e:
-            processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
-            logger.exception(f"处理网络数据时发生错误: {e}")
-            
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def parse_one(raw_data: RawNetworkData):
+            async with semaphore:
+                start_time = datetime.utcnow()
+                # 每个协程有自己的上下文，解析阶段（归档、笔记查询）的命令分别计数
+                with count_mongo_ops() as ops:
+                    try:
+                        item = await self.parse_raw_data(raw_data, archive=archive, dedup=dedup, start_time=start_time)
+                    except Exception as e:
+                        logger.exception(f"批量解析其中一条数据时失败: {e}, URL: {raw_data.url}")
+                        item = DataProcessingResult(
+                            raw_data_id=str(raw_data.request_id),
+                            success=False,
+                            error_message=str(e),
+                            processing_time_ms=int((datetime.utcnow() - start_time).total_seconds() * 1000)
+                        )
+                mongo_ops[id(item)] = ops[0]
+                return item
+
+        mongo_ops: Dict[int, float] = {}
+        with log_budget(LOG_REQUEST_BUDGET * max(1, len(raw_data_list)), label="批量上传"):
+            parsed_items = await asyncio.gather(*(parse_one(raw_data) for raw_data in raw_data_list))
+
+            # 按保存器分组，同一组的实体合并后一起保存
+            groups: Dict[Any, List[ParsedUpload]] = {}
+            for item in parsed_items:
+                if isinstance(item, ParsedUpload):
+                    groups.setdefault(item.pipeline.persister, []).append(item)
+
+            outcomes_by_item: Dict[int, Dict[str, Dict[str, Any]]] = {}
+            for persister, items in groups.items():
+                merged_entities = merge_entity_batches(item.entities for item in items)
+                started = time.perf_counter()
+                with count_mongo_ops() as persist_ops:
+                    outcomes = await persister(self, merged_entities, durable=durable)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                for item in items:
+                    # 批量写入的耗时由整组共享，命令数按条数平均分摊
+                    item.timer.record('persist', elapsed_ms)
+                    outcomes_by_item[id(item)] = outcomes
+                    mongo_ops[id(item)] += persist_ops[0] / len(items)
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        "批量写入完成: %d 条数据, %s", len(items),
+                        ", ".join(f"{entity_type}={len(entities)}" for entity_type, entities in merged_entities.items() if entities)
+                    )
+
+        results = []
+        for item in parsed_items:
+            if isinstance(item, ParsedUpload):
+                result = await self._build_result(item, outcomes_by_item[id(item)])
+            else:
+                result = item
+            observe_upload(result, mongo_ops[id(item)])
+            results.append(result)
+        return results
+
+    async def _process_batch_idempotent(
+        self,
+        raw_data_list: List[RawNetworkData],
+        idempotency_keys: List[Optional[str]],
+        **kwargs
+    ) -> List[DataProcessingResult]:
+        results: List[Optional[DataProcessingResult]] = [None] * len(raw_data_list)
+        owned: Dict[int, Any] = {}
+        waiting: List[int] = []
+        seen_keys: Dict[str, int] = {}
+        try:
+            for index, key in enumerate(idempotency_keys):
+                if not key:
+                    owned[index] = None
+                elif key in seen_keys:
+                    # 同一批次内的重复数据等待第一条的结果
+                    waiting.append(index)
+                else:
+                    seen_keys[key] = index
+                    claim = await ingest_idempotency.begin(key)
+                    if claim.result is not None:
+                        results[index] = claim.result
+                        observe_upload(claim.result)
+                    elif claim.owner:
+                        owned[index] = claim
+                    else:
+                        waiting.append(index)
+
+            indexes = list(owned)
+            processed = await self.process_batch([raw_data_list[i] for i in indexes], **kwargs)
+            for index, result in zip(indexes, processed):
+                results[index] = result
+        finally:
+            for index, claim in owned.items():
+                if claim is not None:
+                    await ingest_idempotency.finish(claim, results[index])
+
+        async def process_waiting(index: int):
+            results[index] = await self.process_raw_data(
+                raw_data_list[index], idempotency_key=idempotency_keys[index], **kwargs
+            )
+
+        if waiting:
+            kwargs.pop("concurrency", None)
+            await asyncio.gather(*(process_waiting(index) for index in waiting))
+        return results
+
+    async def parse_raw_data(
+        self,
+        raw_data: RawNetworkData,
+        archive: bool = True,
+        dedup: bool = True,
+        start_time: Optional[datetime] = None,
+        response_json: Optional[Any] = None,
+        body: Optional[bytes] = None,
+        canonical_body: bool = False
+    ):
+        """
+        识别、归档、解码、去重并解析一条原始网络数据，提取待保存的实体
+
+        上传时已解码响应的调用方可传入 response_json 与 body，跳过对 response_body 的解码与编码；
+        body 由 response_json 规范化编码得到时传入 canonical_body=True，去重时不再重复编码。
+        不保存数据的类型在归档和解码之前就会被拒绝。
+
+        Returns:
+            ParsedUpload: 需要保存的实体
+            DataProcessingResult: 无需保存时的最终结果（识别/解析失败或重复上传）
+        """
+        start_time = start_time or datetime.utcnow()
+        timer = StageTimer()
+
+        def failure(error_message: str, data_type: Optional[str] = None) -> DataProcessingResult:
             return DataProcessingResult(
                 raw_data_id=str(raw_data.request_id),
                 success=False,
-                error_message=str(e),
-                processing_time_ms=processing_time
+                data_type=data_type,
+                error_message=error_message,
+                processing_time_ms=int((datetime.utcnow() - start_time).total_seconds() * 1000),
+                stage_timings_ms=timer.timings
             )
-    
-    def _determine_data_type(self, rule_name: str, url: str) -> Optional[str]:
-        """根据规则名称和URL确定数据类型"""
-        
-        rule_mapping = {
-            '评论接口': 'comment',
-            '评论页面接口': 'comment_page',  # 新增评论页面接口
-            '子评论页面接口': 'sub_comment_page',  # 新增子评论页面接口
-            '通知接口': 'notification',
-            '评论通知接口': 'comment_notification_feed',
-            '通知列表': 'comment_notification_feed',  # 固化抓取规则的通知列表
-            '笔记内容接口': 'note',
-            '用户信息接口': 'user',
-            '搜索接口': 'search',
-            '热门推荐接口': 'recommendation'
-        }
-        
-        if rule_name in rule_mapping:
-            return rule_mapping[rule_name]
-        
-        url_patterns = {
-            'comment': [r'/api/sns/web/v1/comment/'],
-            'comment_page': [r'/api/sns/web/v2/comment/page'],  # 新增评论页面URL模式
-            'sub_comment_page': [r'/api/sns/web/v2/comment/sub/page'],  # 新增子评论页面URL模式
-            'notification': [r'/api/sns/web/v1/notify/'],
-            'comment_notification_feed': [r'/api/sns/web/v1/you/mentions'],
-            'note': [r'/api/sns/web/v1/feed/', r'/api/sns/web/v1/note/'],
-            'user': [r'/api/sns/web/v1/user/', r'/api/sns/web/v2/user/'],
-            'search': [r'/api/sns/web/v1/search/'],
-            'recommendation': [r'/api/sns/web/v1/homefeed/']
-        }
+
+        # 根据规则名称和URL确定数据类型
+        with timer.stage('classify'):
+            pipeline = pipeline_registry.match(raw_data.rule_name, raw_data.url)
         
-        for data_type, patterns in url_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, url):
-                    return data_type
+        if pipeline is None:
+            return failure("无法确定数据类型")
+        data_type = pipeline.data_type
+        if not pipeline.accepts_uploads:
+            return failure(f"数据类型 {data_type} 不保存数据", data_type)
         
-        return None
-    
-    async def _parse_response_data(self, raw_data: RawNetworkData, data_type: str) -> Optional[Any]:
-        """解析响应数据"""
+        if body is None:
+            body = raw_data.response_body.encode("utf-8") if raw_data.response_body else b""
+
+        # 归档原始响应体，便于解析器修复后重新处理
+        if archive:
+            with timer.stage('archive'):
+                await archive_raw_data(raw_data, data_type, body=body)
         
-        if not raw_data.response_body:
-            return None
+        # 解码响应数据
+        if response_json is None:
+            if not raw_data.response_body:
+                return failure("响应数据解析失败", data_type)
+            try:
+                with timer.stage('decode'):
+                    response_json = decode_response_body(raw_data)
+            except ValueError as e:
+                logger.error(f"JSON解析失败: {e}")
+                return failure("响应数据解析失败", data_type)
+
+        # 最近处理过的相同响应直接跳过解析和保存。指纹按规范化编码的JSON计算，
+        # 同一响应经不同上传格式（字符串响应体、内嵌JSON、multipart）上传时指纹相同
+        fingerprint = None
+        if dedup and INGEST_DEDUP_ENABLED and response_json is not None:
+            with timer.stage('dedup'):
+                canonical = body if canonical_body and body else dumps(response_json)
+                fingerprint = compute_fingerprint(data_type, raw_data.url, canonical)
+                duplicated = await recent_fingerprints.seen(fingerprint)
+            if duplicated:
+                logger.debug("重复上传已跳过: type=%s, url=%s", data_type, raw_data.url)
+                return DataProcessingResult(
+                    raw_data_id=str(raw_data.request_id),
+                    success=True,
+                    data_type=data_type,
+                    deduplicated=True,
+                    dedup_stats=recent_fingerprints.stats(),
+                    processing_time_ms=int((datetime.utcnow() - start_time).total_seconds() * 1000),
+                    stage_timings_ms=timer.timings
+                )
         
+        # 解析响应数据
         try:
-            response_json = json.loads(raw_data.response_body)
-            
-            if data_type in self.parsers:
-                # The parser now returns a dict for multi-type data or a list for single-type data
-                return await self.parsers[data_type](response_json, raw_data)
-            else:
-                logger.warning(f"未找到数据类型 {data_type} 的解析器")
-                return None
-                
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析失败: {e}")
-            return None
+            with timer.stage('parse'):
+                parsed_data = await pipeline.parser(self, response_json, raw_data)
         except Exception as e:
             logger.exception(f"解析响应数据时发生错误: {e}")
-            return None
+            parsed_data = None
+        
+        if not parsed_data:
+            return failure("响应数据解析失败", data_type)
+
+        try:
+            with timer.stage('normalize'):
+                entities = pipeline.normalizer(self, data_type, parsed_data)
+        except ValueError as e:
+            return failure(str(e), data_type)
+
+        items_extracted = 0
+        if isinstance(parsed_data, list):
+            items_extracted = len(parsed_data)
+        elif isinstance(parsed_data, dict):
+            items_extracted = sum(len(v) for v in parsed_data.values())
+
+        return ParsedUpload(
+            raw_data=raw_data,
+            pipeline=pipeline,
+            entities=entities,
+            items_extracted=items_extracted,
+            fingerprint=fingerprint,
+            start_time=start_time,
+            timer=timer
+        )
+
+    async def _build_result(self, parsed: "ParsedUpload", outcomes: Dict[str, Dict[str, Any]]) -> DataProcessingResult:
+        """根据各集合的写入结果统计单条数据的保存情况"""
+        saved_count = 0
+        errors = []
+        for entity_type, entities in parsed.entities.items():
+            if not entities:
+                continue
+            outcome = outcomes.get(entity_type, {})
+            failed_ids = outcome.get('failed_ids', set())
+            saved_count += sum(
+                1 for entity in entities
+                if entity_id(entity_type, entity) and entity_id(entity_type, entity) not in failed_ids
+            )
+            if outcome.get('error'):
+                errors.append(f"{entity_type}: {outcome['error']}")
+
+            if outcome.get('elapsed_ms') is not None:
+                # 直接写入（或 durable 等待）时记录各集合的批量写入耗时
+                parsed.timer.record(f"save.{entity_type}", outcome['elapsed_ms'])
+
+        success = not errors
+
+        # 只有保存成功后才记录指纹，失败的上传重试时仍会被处理；
+        # 写后缓冲中尚未写入的实体要等实际写入成功后再记录
+        if parsed.fingerprint and success:
+            pending = {id(outcome['pending']): outcome['pending'] for outcome in outcomes.values() if outcome.get('pending')}
+            if pending:
+                self._remember_after_flush(parsed, list(pending.values()))
+            else:
+                await recent_fingerprints.remember(parsed.fingerprint)
+        
+        processing_time = int((datetime.utcnow() - parsed.start_time).total_seconds() * 1000)
+        
+        return DataProcessingResult(
+            raw_data_id=str(parsed.raw_data.request_id),
+            success=success,
+            data_type=parsed.data_type,
+            items_extracted=parsed.items_extracted,
+            items_saved=saved_count,
+            error_message="; ".join(errors) or None,
+            processing_time_ms=processing_time,
+            dedup_stats=recent_fingerprints.stats() if parsed.fingerprint else None,
+            stage_timings_ms=parsed.timer.timings
+        )
+    
+    def _remember_after_flush(self, parsed: "ParsedUpload", waiters: List[asyncio.Future]):
+        """写后缓冲写入完成且本条数据的实体都写入成功后记录指纹"""
+        async def remember():
+            for waiter in waiters:
+                flushed = await waiter
+                for entity_type, entities in parsed.entities.items():
+                    outcome = flushed.get(entity_type)
+                    if not entities or outcome is None:
+                        continue
+                    if outcome.get('error') or any(entity_id(entity_type, entity) in outcome['failed_ids'] for entity in entities):
+                        return
+            await recent_fingerprints.remember(parsed.fingerprint)
+
+        task = asyncio.ensure_future(remember())
+        _pending_fingerprints.add(task)
+        task.add_done_callback(_pending_fingerprints.discard)
+
+    def _determine_data_type(self, rule_name: str, url: str) -> Optional[str]:
+        """根据规则名称和URL确定数据类型"""
+        pipeline = pipeline_registry.match(rule_name, url)
+        return pipeline.data_type if pipeline else None
+
+    def accepts_upload(self, rule_name: str, url: str) -> bool:
+        """上传是否属于会保存数据的类型（用于入队前校验）"""
+        pipeline = pipeline_registry.match(rule_name, url)
+        return pipeline is not None and pipeline.accepts_uploads
 
     def _safe_ts_to_dt(self, timestamp_s: Any) -> Optional[datetime]:
         """Safely convert second timestamp to datetime."""
@@ -247,8 +525,9 @@ class NetworkDataProcessor:
         user_info = item_info.get('user_info', {})
         author_id = user_info.get('userid') or user_info.get('id')
         
-        # 调试日志：输出原始数据结构
-        logger.debug(f"提取笔记信息，原始item_info: {json.dumps(item_info, ensure_ascii=False, indent=2)}")
+        # 调试日志：输出原始数据结构（仅在开启DEBUG时序列化）
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("提取笔记信息，原始item_info: %s", json.dumps(item_info, ensure_ascii=False, indent=2))
         
         # 尝试多种可能的字段名来提取笔记信息
         note_id = item_info.get('id')
@@ -279,8 +558,8 @@ class NetworkDataProcessor:
                         item_info.get('comment_count') or 
                         item_info.get('comments_count') or 0)
         
-        logger.info(f"提取笔记信息 - ID: {note_id}, 标题: {title}, 内容长度: {len(content) if content else 0}, "
-                   f"发布时间: {publish_time}, 点赞数: {like_count}, 评论数: {comment_count}")
+        logger.debug("提取笔记信息 - ID: %s, 标题: %s, 内容长度: %d, 发布时间: %s, 点赞数: %s, 评论数: %s",
+                     note_id, title, len(content) if content else 0, publish_time, like_count, comment_count)
         
         return Note(
             noteId=note_id,
@@ -416,9 +695,7 @@ class NetworkDataProcessor:
             # 如果数据库中已有该笔记的完整信息，不要创建基础笔记对象
             
             try:
-                database = await get_database()
-                notes_collection = database[NOTES_COLLECTION]
-                existing_note = await notes_collection.find_one({"noteId": note_id})
+                existing_note = await note_metadata_cache.get(note_id)
                 
                 if existing_note:
                     # 如果已存在笔记，使用现有的完整信息
@@ -431,25 +708,26 @@ class NetworkDataProcessor:
                         'noteLike': existing_note.get('noteLike', 0),
                         'noteCommitCount': len(comments),  # 使用当前评论数量
                     }
-                    logger.info(f"[评论页面解析] 使用已存在的笔记信息: {note_id}, 标题: {existing_note.get('title', '无标题')}")
+                    logger.debug("[评论页面解析] 使用已存在的笔记信息: %s, 标题: %s", note_id, existing_note.get('title', '无标题'))
                 else:
                     # 如果不存在，创建基本笔记对象，但不设置空标题
+                    # 未知字段设为None，保存时只在新建笔记时写入，避免覆盖后续的真实信息
                     note_dict = {
                         'noteId': note_id,
-                        'title': None,  # 设为None而不是空字符串，避免覆盖后续的标题信息
-                        'noteContent': '',
-                        'authorId': '',
+                        'title': None,
+                        'noteContent': None,
+                        'authorId': None,
                         'publishTime': None,
-                        'noteLike': 0,
+                        'noteLike': None,
                         'noteCommitCount': len(comments),
                     }
-                    logger.info(f"[评论页面解析] 创建基础笔记对象: {note_id}")
+                    logger.debug("[评论页面解析] 创建基础笔记对象: %s", note_id)
                 
                 notes.append(Note(**note_dict))
             except Exception as e:
                 logger.warning(f"[评论页面解析] 查询现有笔记信息失败: {e}, 跳过笔记创建")
         
-        logger.info(f"[评论页面解析] 提取到 {len(comments)} 条评论, {len(users)} 个用户, {len(notes)} 个笔记")
+        logger.info("[评论页面解析] 提取到 %d 条评论, %d 个用户, %d 个笔记", len(comments), len(users), len(notes))
         
         return {
             'comments': comments,
@@ -467,7 +745,7 @@ class NetworkDataProcessor:
         user_ids = set()
         note_ids = set()
         
-        logger.info(f"[子评论页面解析] 开始解析子评论页面数据")
+        logger.debug("[子评论页面解析] 开始解析子评论页面数据")
         
         # 检查响应是否成功
         if not response_json.get('success', True) or response_json.get('code') != 0:
@@ -514,29 +792,44 @@ class NetworkDataProcessor:
                 logger.warning(f"[子评论页面解析] 解析评论失败: {e}")
                 continue
         
-        # 4. 为每个笔记ID创建基础笔记对象（如果数据库中不存在）
+        # 4. 为每个笔记ID创建基础笔记对象（已存在的笔记沿用缓存中的元数据）
+        comment_counts = Counter(c.noteId for c in comments if c.noteId)
+        try:
+            existing_notes = await note_metadata_cache.get_many(note_ids)
+        except Exception as e:
+            logger.warning(f"[子评论页面解析] 查询现有笔记信息失败: {e}, 跳过笔记创建")
+            note_ids = set()
+            existing_notes = {}
+
         for note_id in note_ids:
-            try:
-                db = await get_database()
-                existing_note = await db[NOTES_COLLECTION].find_one({"noteId": note_id})
-                
-                if not existing_note:
-                    note_dict = {
-                        'noteId': note_id,
-                        'title': f'笔记-{note_id}',
-                        'noteContent': '',
-                        'authorId': '',
-                        'publishTime': None,
-                        'noteLike': 0,
-                        'noteCommitCount': len([c for c in comments if c.noteId == note_id]),
-                    }
-                    logger.info(f"[子评论页面解析] 创建基础笔记对象: {note_id}")
-                
-                notes.append(Note(**note_dict))
-            except Exception as e:
-                logger.warning(f"[子评论页面解析] 查询现有笔记信息失败: {e}, 跳过笔记创建")
+            existing_note = existing_notes.get(note_id)
+            if existing_note:
+                # 子评论数量不是笔记的评论数，不覆盖已有笔记的评论数
+                note_dict = {
+                    'noteId': note_id,
+                    'title': existing_note.get('title'),
+                    'noteContent': existing_note.get('noteContent'),
+                    'authorId': existing_note.get('authorId'),
+                    'publishTime': existing_note.get('publishTime'),
+                    'noteLike': existing_note.get('noteLike'),
+                    'noteCommitCount': None,
+                }
+            else:
+                # 占位标题和未知字段只在新建笔记时写入
+                note_dict = {
+                    'noteId': note_id,
+                    'title': f'笔记-{note_id}',
+                    'noteContent': None,
+                    'authorId': None,
+                    'publishTime': None,
+                    'noteLike': None,
+                    'noteCommitCount': comment_counts[note_id],
+                }
+                logger.debug("[子评论页面解析] 创建基础笔记对象: %s", note_id)
+            
+            notes.append(Note(**note_dict))
         
-        logger.info(f"[子评论页面解析] 提取到 {len(comments)} 条子评论, {len(users)} 个用户, {len(notes)} 个笔记")
+        logger.info("[子评论页面解析] 提取到 %d 条子评论, %d 个用户, %d 个笔记", len(comments), len(users), len(notes))
         
         return {
             'comments': comments,
@@ -544,10 +837,6 @@ class NetworkDataProcessor:
             'notes': notes
         }
     
-    async def _parse_notification_data(self, response_json: Dict, raw_data: RawNetworkData) -> List[Dict]:
-        # 功能已废弃
-        return []
-
     async def _parse_note_data(self, response_json: Dict, raw_data: RawNetworkData) -> List[Note]:
         """解析笔记数据"""
         notes = []
@@ -575,14 +864,6 @@ class NetworkDataProcessor:
         
         return users
     
-    async def _parse_search_data(self, response_json: Dict, raw_data: RawNetworkData) -> List[Dict[str, Any]]:
-        """解析搜索数据"""
-        return []
-
-    async def _parse_recommendation_data(self, response_json: Dict, raw_data: RawNetworkData) -> List[Dict[str, Any]]:
-        """解析推荐数据"""
-        return []
-
     def _extract_comment_from_api_response(self, comment_data: Dict) -> Optional[Dict[str, Any]]:
         """从API响应中提取评论信息"""
         try:
@@ -600,10 +881,7 @@ class NetworkDataProcessor:
             target_comment_id = None
             if 'target_comment' in comment_data and comment_data['target_comment']:
                 target_comment_id = comment_data['target_comment'].get('id')
-                logger.info(f"[评论解析] 评论 {comment_data.get('id')} 的target_comment: {comment_data['target_comment']}")
-                logger.info(f"[评论解析] 提取到的target_comment_id: {target_comment_id}")
-            else:
-                logger.info(f"[评论解析] 评论 {comment_data.get('id')} 没有target_comment字段")
+                logger.debug("[评论解析] 评论 %s 回复 %s", comment_data.get('id'), target_comment_id)
             
             return {
                 'id': comment_data.get('id', ''),
@@ -657,223 +935,189 @@ class NetworkDataProcessor:
             logger.error(f"提取用户信息失败: {e}")
             return None
 
-    async def _save_parsed_data(self, data_type: str, parsed_data: Any) -> Dict[str, Any]:
-        """保存解析后的数据"""
-        try:
-            if data_type == 'comment':
-                comments_dicts = [comment.model_dump() for comment in parsed_data]
-                result = await save_comments_with_upsert(comments_dicts)
-                return {'success': True, 'saved_count': result.get('inserted', 0) + result.get('updated', 0)}
-            
-            elif data_type == 'comment_page':
-                if not isinstance(parsed_data, dict):
-                    return {'success': False, 'error': 'Invalid data format for comment_page'}
+    def _finalize_entities(self, entities: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+        """同一条数据内的实体按ID合并"""
+        return {
+            entity_type: merge_entity_list(entity_type, items)
+            for entity_type, items in entities.items()
+        }
 
-                total_saved = 0
-                
-                # Save users
-                users_list = parsed_data.get('users', [])
-                if users_list:
-                    saved_user_count = 0
-                    for user in users_list:
-                        res = await save_user_info(user.model_dump())
-                        if res.get('success'):
-                            saved_user_count += 1
-                    total_saved += saved_user_count
-
-                # Save notes
-                notes_list = parsed_data.get('notes', [])
-                if notes_list:
-                    notes_dicts = [note.model_dump() for note in notes_list]
-                    res = await save_notes(notes_dicts)
-                    total_saved += res.get('inserted', 0) + res.get('updated', 0)
-
-                # Save comments - 转换为结构化评论并保存
-                comments_list = parsed_data.get('comments', [])
-                if comments_list:
-                    # 将CommentItem转换为结构化评论格式
-                    structured_comments = []
-                    for comment in comments_list:
-                        comment_dict = comment.model_dump()
-                        # 转换为结构化评论格式
-                        structured_comment = {
-                            "commentId": comment_dict.get('id'),
-                            "noteId": comment_dict.get('noteId'),
-                            "content": comment_dict.get('content'),
-                            "authorId": comment_dict.get('authorId'),
-                            "authorName": comment_dict.get('authorName'),
-                            "authorAvatar": comment_dict.get('authorAvatar'),
-                            "timestamp": comment_dict.get('timestamp'),
-                            "repliedId": comment_dict.get('parentCommentId'),  # 父评论ID
-                            "repliedOrder": None,
-                            "fetchTimestamp": datetime.utcnow(),
-                            "likeCount": comment_dict.get('likeCount'),
-                            "ipLocation": comment_dict.get('ipLocation'),
-                            "illegal_info": comment_dict.get('illegal_info')
-                        }
-                        
-                        # 添加调试日志
-                        if comment_dict.get('parentCommentId'):
-                            logger.info(f"[评论页面数据处理] 子评论 {comment_dict.get('id')} 回复 {comment_dict.get('parentCommentId')}")
-                        else:
-                            logger.info(f"[评论页面数据处理] 主评论 {comment_dict.get('id')}")
-                        
-                        structured_comments.append(structured_comment)
-                    
-                    # 保存到结构化评论集合
-                    from ..services.comment import save_structured_comments
-                    res = await save_structured_comments(structured_comments)
-                    total_saved += res.get('upserted', 0) + res.get('matched', 0)
-                
-                return {'success': True, 'saved_count': total_saved}
-            
-            elif data_type == 'sub_comment_page':
-                if not isinstance(parsed_data, dict):
-                    return {'success': False, 'error': 'Invalid data format for sub_comment_page'}
+    def _normalize_comments(self, data_type: str, parsed_data: Any) -> Dict[str, List[Dict[str, Any]]]:
+        """旧版评论接口：保存到旧版评论集合"""
+        entities = empty_entities()
+        entities[ENTITY_COMMENTS] = [comment.model_dump() for comment in parsed_data]
+        return self._finalize_entities(entities)
 
-                total_saved = 0
-                
-                # Save users
-                users_list = parsed_data.get('users', [])
-                if users_list:
-                    saved_user_count = 0
-                    for user in users_list:
-                        res = await save_user_info(user.model_dump())
-                        if res.get('success'):
-                            saved_user_count += 1
-                    total_saved += saved_user_count
-
-                # Save notes
-                notes_list = parsed_data.get('notes', [])
-                if notes_list:
-                    notes_dicts = [note.model_dump() for note in notes_list]
-                    res = await save_notes(notes_dicts)
-                    total_saved += res.get('inserted', 0) + res.get('updated', 0)
-
-                # Save comments - 转换为结构化评论并保存
-                comments_list = parsed_data.get('comments', [])
-                if comments_list:
-                    # 将CommentItem转换为结构化评论格式
-                    structured_comments = []
-                    for comment in comments_list:
-                        comment_dict = comment.model_dump()
-                        # 转换为结构化评论格式
-                        structured_comment = {
-                            "commentId": comment_dict.get('id'),
-                            "noteId": comment_dict.get('noteId'),
-                            "content": comment_dict.get('content'),
-                            "authorId": comment_dict.get('authorId'),
-                            "authorName": comment_dict.get('authorName'),
-                            "authorAvatar": comment_dict.get('authorAvatar'),
-                            "timestamp": comment_dict.get('timestamp'),
-                            "repliedId": comment_dict.get('parentCommentId'),  # 父评论ID
-                            "repliedOrder": None,
-                            "fetchTimestamp": datetime.utcnow(),
-                            "likeCount": comment_dict.get('likeCount'),
-                            "ipLocation": comment_dict.get('ipLocation'),
-                            "illegal_info": comment_dict.get('illegal_info')
-                        }
-                        
-                        # 添加调试日志
-                        if comment_dict.get('parentCommentId'):
-                            logger.info(f"[子评论页面数据处理] 子评论 {comment_dict.get('id')} 回复 {comment_dict.get('parentCommentId')}")
-                        else:
-                            logger.info(f"[子评论页面数据处理] 主评论 {comment_dict.get('id')}")
-                        
-                        structured_comments.append(structured_comment)
-                    
-                    # 保存到结构化评论集合
-                    from ..services.comment import save_structured_comments
-                    res = await save_structured_comments(structured_comments)
-                    total_saved += res.get('upserted', 0) + res.get('matched', 0)
-                
-                return {'success': True, 'saved_count': total_saved}
-            
-            elif data_type == 'note':
-                result = await save_notes(parsed_data)
-                return {'success': True, 'saved_count': result.get('inserted', 0) + result.get('updated', 0)}
-            
-            elif data_type == 'notification':
-                # 功能已废弃，不再保存
-                return {'success': True, 'saved_count': 0, 'message': 'notification data saving is deprecated'}
-            
-            elif data_type == 'comment_notification_feed':
-                if not isinstance(parsed_data, dict):
-                    return {'success': False, 'error': 'Invalid data format for feed'}
+    def _normalize_comment_bundle(self, data_type: str, parsed_data: Any) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        评论页、子评论页、评论通知：用户、笔记及转换为结构化格式的评论
 
-                total_saved = 0
-                
-                # Save users
-                users_list = parsed_data.get('users', [])
-                if users_list:
-                    saved_user_count = 0
-                    for user in users_list:
-                        res = await save_user_info(user.model_dump())
-                        if res.get('success'):
-                            saved_user_count += 1
-                    total_saved += saved_user_count
-
-                # Save notes
-                notes_list = parsed_data.get('notes', [])
-                if notes_list:
-                    notes_dicts = [note.model_dump() for note in notes_list]
-                    res = await save_notes(notes_dicts)
-                    total_saved += res.get('inserted', 0) + res.get('updated', 0)
-
-                # Save comments - 修复：转换为结构化评论并保存
-                comments_list = parsed_data.get('comments', [])
-                if comments_list:
-                    # 将CommentItem转换为结构化评论格式
-                    structured_comments = []
-                    for comment in comments_list:
-                        comment_dict = comment.model_dump()
-                        # 转换为结构化评论格式
-                        structured_comment = {
-                            "commentId": comment_dict.get('id'),
-                            "noteId": comment_dict.get('noteId'),
-                            "content": comment_dict.get('content'),
-                            "authorId": comment_dict.get('authorId'),
-                            "authorName": comment_dict.get('authorName'),
-                            "authorAvatar": comment_dict.get('authorAvatar'),
-                            "timestamp": comment_dict.get('timestamp'),
-                            "repliedId": None,  # mentions API中的评论通常是顶级评论
-                            "repliedOrder": None,
-                            "fetchTimestamp": datetime.utcnow(),
-                            "likeCount": comment_dict.get('likeCount'),
-                            "ipLocation": comment_dict.get('ipLocation'),
-                            "illegal_info": comment_dict.get('illegal_info')
-                        }
-                        structured_comments.append(structured_comment)
-                    
-                    # 保存到结构化评论集合
-                    from ..services.comment import save_structured_comments
-                    res = await save_structured_comments(structured_comments)
-                    total_saved += res.get('upserted', 0) + res.get('matched', 0)
-
-                # Save notifications - 功能已废弃，不再保存
-                # notifications_list = parsed_data.get('notifications', [])
-                # if notifications_list:
-                #     notifications_dicts = [n.model_dump() for n in notifications_list]
-                #     res = await save_notifications(notifications_dicts)
-                #     total_saved += res.get('inserted', 0) + res.get('updated', 0)
-                
-                return {'success': True, 'saved_count': total_saved}
-            
-            elif data_type == 'user':
-                saved_count = 0
-                for user_data in parsed_data:
-                    user_info = UserInfo(**user_data)
-                    result = await save_user_info(user_info.model_dump())
-                    if result.get('success'):
-                        saved_count += 1
-                return {'success': True, 'saved_count': saved_count}
-            
-            else:
-                return {'success': False, 'error': f'不支持的数据类型: {data_type}'}
-                
-        except Exception as e:
-            logger.exception(f"保存解析数据时发生错误: {e}")
-            return {'success': False, 'error': str(e)}
+        Raises:
+            ValueError: 数据格式无效
+        """
+        if not isinstance(parsed_data, dict):
+            raise ValueError(f'Invalid data format for {data_type}')
+
+        entities = empty_entities()
+        entities[ENTITY_USERS] = [user.model_dump() for user in parsed_data.get('users', [])]
+        entities[ENTITY_NOTES] = [note.model_dump() for note in parsed_data.get('notes', [])]
+        # mentions API中的评论通常是顶级评论，不保留回复关系
+        keep_reply = data_type != 'comment_notification_feed'
+        entities[ENTITY_STRUCTURED_COMMENTS] = [
+            self._to_structured_comment(comment, data_type, keep_reply)
+            for comment in parsed_data.get('comments', [])
+        ]
+        return self._finalize_entities(entities)
+
+    def _normalize_notes(self, data_type: str, parsed_data: Any) -> Dict[str, List[Dict[str, Any]]]:
+        """笔记接口"""
+        entities = empty_entities()
+        entities[ENTITY_NOTES] = [
+            note.model_dump() if hasattr(note, 'model_dump') else note for note in parsed_data
+        ]
+        return self._finalize_entities(entities)
+
+    def _normalize_users(self, data_type: str, parsed_data: Any) -> Dict[str, List[Dict[str, Any]]]:
+        """用户信息接口"""
+        entities = empty_entities()
+        entities[ENTITY_USERS] = [UserInfo(**user_data).model_dump() for user_data in parsed_data]
+        return self._finalize_entities(entities)
+
+    def _to_structured_comment(self, comment: CommentItem, data_type: str, keep_reply: bool) -> Dict[str, Any]:
+        """将CommentItem转换为结构化评论格式"""
+        comment_dict = comment.model_dump()
+        replied_id = comment_dict.get('parentCommentId') if keep_reply else None
+
+        if replied_id:
+            logger.debug("[%s] 子评论 %s 回复 %s", data_type, comment_dict.get('id'), replied_id)
+        else:
+            logger.debug("[%s] 主评论 %s", data_type, comment_dict.get('id'))
+
+        return {
+            "commentId": comment_dict.get('id'),
+            "noteId": comment_dict.get('noteId'),
+            "content": comment_dict.get('content'),
+            "authorId": comment_dict.get('authorId'),
+            "authorName": comment_dict.get('authorName'),
+            "authorAvatar": comment_dict.get('authorAvatar'),
+            "timestamp": comment_dict.get('timestamp'),
+            "repliedId": replied_id,  # 父评论ID
+            "repliedOrder": None,
+            "fetchTimestamp": datetime.utcnow(),
+            "likeCount": comment_dict.get('likeCount'),
+            "ipLocation": comment_dict.get('ipLocation'),
+            "illegal_info": comment_dict.get('illegal_info')
+        }
+
+    async def persist_entities(self, entities: Dict[str, List[Dict[str, Any]]], durable: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        保存实体，每个集合一次批量写入
+
+        启用写后缓冲时实体交给全局缓冲合并写入，durable=True 时等待实际写入完成。
+
+        Returns:
+            每个实体类型的写入结果: {'failed_ids': 写入失败的ID集合, 'error': 整体失败时的错误信息}
+        """
+        if WRITE_BUFFER_ENABLED:
+            return await bulk_writer.submit(entities, durable=durable)
+        return await write_entities(entities)
+
+class ParsedUpload:
+    """一条上传解析后、保存前的中间结果"""
+
+    def __init__(
+        self,
+        raw_data: RawNetworkData,
+        pipeline: DataTypePipeline,
+        entities: Dict[str, List[Dict[str, Any]]],
+        items_extracted: int,
+        fingerprint: Optional[str],
+        start_time: datetime,
+        timer: StageTimer
+    ):
+        self.raw_data = raw_data
+        self.pipeline = pipeline
+        self.data_type = pipeline.data_type
+        self.entities = entities
+        self.items_extracted = items_extracted
+        self.fingerprint = fingerprint
+        self.start_time = start_time
+        self.timer = timer
 
 # 全局处理器实例
-network_processor = NetworkDataProcessor() 
\ No newline at end of file
+network_processor = NetworkDataProcessor() 
+
+# === 内置数据类型流水线 ===
+# URL 模式按注册顺序匹配；没有保存器的类型（通知、搜索、推荐）在解码响应体之前就被拒绝
+_BUILTIN_PIPELINES = [
+    DataTypePipeline(
+        'comment',
+        rule_names=('评论接口',),
+        url_patterns=(r'/api/sns/web/v1/comment/',),
+        parser=NetworkDataProcessor._parse_comment_data,
+        normalizer=NetworkDataProcessor._normalize_comments,
+        persister=NetworkDataProcessor.persist_entities
+    ),
+    DataTypePipeline(
+        'comment_page',
+        rule_names=('评论页面接口',),
+        url_patterns=(r'/api/sns/web/v2/comment/page',),
+        parser=NetworkDataProcessor._parse_comment_page_data,
+        normalizer=NetworkDataProcessor._normalize_comment_bundle,
+        persister=NetworkDataProcessor.persist_entities
+    ),
+    DataTypePipeline(
+        'sub_comment_page',
+        rule_names=('子评论页面接口',),
+        url_patterns=(r'/api/sns/web/v2/comment/sub/page',),
+        parser=NetworkDataProcessor._parse_sub_comment_page_data,
+        normalizer=NetworkDataProcessor._normalize_comment_bundle,
+        persister=NetworkDataProcessor.persist_entities
+    ),
+    DataTypePipeline(
+        'notification',
+        rule_names=('通知接口',),
+        url_patterns=(r'/api/sns/web/v1/notify/',),
+        description='功能已废弃，不再保存'
+    ),
+    DataTypePipeline(
+        'comment_notification_feed',
+        rule_names=('评论通知接口', '通知列表'),  # 通知列表为固化抓取规则的名称
+        url_patterns=(r'/api/sns/web/v1/you/mentions',),
+        parser=NetworkDataProcessor._parse_comment_notification_feed_data,
+        normalizer=NetworkDataProcessor._normalize_comment_bundle,
+        persister=NetworkDataProcessor.persist_entities
+    ),
+    DataTypePipeline(
+        'note',
+        rule_names=('笔记内容接口',),
+        url_patterns=(r'/api/sns/web/v1/feed/', r'/api/sns/web/v1/note/'),
+        parser=NetworkDataProcessor._parse_note_data,
+        normalizer=NetworkDataProcessor._normalize_notes,
+        persister=NetworkDataProcessor.persist_entities
+    ),
+    DataTypePipeline(
+        'user',
+        rule_names=('用户信息接口',),
+        url_patterns=(r'/api/sns/web/v1/user/', r'/api/sns/web/v2/user/'),
+        parser=NetworkDataProcessor._parse_user_data,
+        normalizer=NetworkDataProcessor._normalize_users,
+        persister=NetworkDataProcessor.persist_entities
+    ),
+    DataTypePipeline(
+        'search',
+        rule_names=('搜索接口',),
+        url_patterns=(r'/api/sns/web/v1/search/',),
+        description='暂不解析'
+    ),
+    DataTypePipeline(
+        'recommendation',
+        rule_names=('热门推荐接口',),
+        url_patterns=(r'/api/sns/web/v1/homefeed/',),
+        description='暂不解析'
+    ),
+]
+
+for _pipeline in _BUILTIN_PIPELINES:
+    pipeline_registry.register(_pipeline)
+pipeline_registry.compile()
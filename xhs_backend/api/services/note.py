@@ -6,78 +6,142 @@
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+import pymongo
+
+from .entity_merge import ENTITY_NOTES, is_placeholder_title, merge_entity_list
+from .note_cache import note_metadata_cache
+from .query_cache import query_cache, write_tags
+from .rollups import bulk_error_upserted_ids, record_documents, upserted_documents
+from .search_index import HIDE_SEARCH_TOKENS, KeywordSearch, search_tokens_update
+from .totals import total_counter
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+def _is_placeholder_value(field: str, value: Any) -> bool:
+    """判断字段值是否只是占位（不应覆盖数据库中已有的真实值）"""
+    if value is None or value == "":
+        return True
+    return is_placeholder_title(field, value)
+
+def build_note_upsert(note_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    构建笔记的更新插入操作
+
+    有效值放入 $set；占位值（None、空字符串、占位标题）放入 $setOnInsert，
+    只在新建笔记时写入，不会覆盖已有笔记的真实数据
+    """
+    from database import NOTES_COLLECTION
+
+    set_fields = {}
+    set_on_insert_fields = {}
+    for field, value in note_data.items():
+        if field in ("_id", "noteId"):
+            continue
+        if _is_placeholder_value(field, value):
+            set_on_insert_fields[field] = value
+        else:
+            set_fields[field] = value
+
+    update = {"$set": set_fields}
+    if set_on_insert_fields:
+        update["$setOnInsert"] = set_on_insert_fields
+    # 追加关键字搜索的二元组（占位标题也参与，新建笔记时可以被搜到）
+    update.update(search_tokens_update(NOTES_COLLECTION, note_data))
+    return update
+
+async def ensure_note_indexes():
+    """创建笔记集合的索引（包括 noteId 唯一索引），保证并发上传时同一笔记只有一份文档"""
+    from database import NOTES_COLLECTION
+    from .indexes import ensure_indexes
+
+    summary = await ensure_indexes([NOTES_COLLECTION])
+    if summary["failed"]:
+        logger.error("创建笔记索引失败，可能存在重复笔记，请先运行 migrations/dedupe_notes.py")
+
 async def save_notes(data: List[Dict[str, Any]]):
-    """保存笔记列表，如果笔记已存在则更新"""
+    """保存笔记列表，如果笔记已存在则更新（单次批量写入，依赖 noteId 唯一索引）"""
     # 在函数内部导入模块
     from database import get_database, NOTES_COLLECTION
     
     if not data:
         logger.info("没有笔记数据需要保存")
-        return {"inserted": 0, "updated": 0}
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "failed_ids": []}
 
     database = await get_database()
     collection = database[NOTES_COLLECTION]
-    inserted_count = 0
-    updated_count = 0
+    bulk_operations = []
+    operation_note_ids = []
+    operation_notes = []
 
-    for note_data in data:
+    # 同一批次中重复的笔记先合并，避免对同一个 noteId 发出多个更新插入
+    for note_data in merge_entity_list(ENTITY_NOTES, data):
         note_id = note_data.get("noteId")
 
         if not note_id:
-            logger.warning(f"跳过笔记，缺少 noteId: {note_data.get('noteContent', '')[:50]}...")
+            logger.warning(f"跳过笔记，缺少 noteId: {(note_data.get('noteContent') or '')[:50]}...")
             continue
 
-        try:
-            # 确保 fetchTimestamp 字段存在且是 datetime 类型
-            if 'fetchTimestamp' not in note_data or not isinstance(note_data['fetchTimestamp'], datetime):
-                note_data['fetchTimestamp'] = datetime.utcnow()
-            
-            # 处理 publishTime 字段，将其转换为 datetime 类型
-            if 'publishTime' in note_data and note_data['publishTime']:
-                # 使用 parse_relative_timestamp 函数解析发布时间
-                try:
-                    from utils.time_utils import parse_relative_timestamp  # 假设有此工具函数
-                    
-                    publish_time_str = note_data['publishTime']
-                    parsed_publish_time = parse_relative_timestamp(publish_time_str)
-                    
-                    if parsed_publish_time:
-                        note_data['publishTime'] = parsed_publish_time
-                    else:
-                        logger.warning(f"无法解析笔记发布时间: {publish_time_str}，维持原始值")
-                except ImportError:
-                    logger.warning("时间解析工具不可用，保留原始发布时间")
+        # 确保 fetchTimestamp 字段存在且是 datetime 类型
+        if 'fetchTimestamp' not in note_data or not isinstance(note_data['fetchTimestamp'], datetime):
+            note_data['fetchTimestamp'] = datetime.utcnow()
+        
+        # 处理 publishTime 字段，将其转换为 datetime 类型
+        if 'publishTime' in note_data and note_data['publishTime'] and not isinstance(note_data['publishTime'], datetime):
+            # 使用 parse_relative_timestamp 函数解析发布时间
+            try:
+                from utils.time_utils import parse_relative_timestamp  # 假设有此工具函数
                 
-            # 尝试查找已存在的笔记
-            existing_note = await collection.find_one({"noteId": note_id})
-
-            if existing_note:
-                # 更新现有笔记
-                result = await collection.replace_one({"_id": existing_note["_id"]}, note_data)
-                if result.modified_count > 0:
-                    updated_count += 1
-                    logger.debug(f"更新笔记: noteId={note_id}")
-                else:
-                    logger.warning(f"尝试更新笔记但 modified_count 为 0: noteId={note_id}")
-            else:
-                # 插入新笔记
-                result = await collection.insert_one(note_data)
-                if result.inserted_id:
-                    inserted_count += 1
-                    logger.debug(f"插入新笔记: noteId={note_id}")
+                publish_time_str = note_data['publishTime']
+                parsed_publish_time = parse_relative_timestamp(publish_time_str)
+                
+                if parsed_publish_time:
+                    note_data['publishTime'] = parsed_publish_time
                 else:
-                    logger.warning(f"尝试插入新笔记但未获取 inserted_id: noteId={note_id}")
+                    logger.warning(f"无法解析笔记发布时间: {publish_time_str}，维持原始值")
+            except ImportError:
+                logger.warning("时间解析工具不可用，保留原始发布时间")
+
+        bulk_operations.append(pymongo.UpdateOne({"noteId": note_id}, build_note_upsert(note_data), upsert=True))
+        operation_note_ids.append(note_id)
+        operation_notes.append(note_data)
+
+    if not bulk_operations:
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "failed_ids": []}
+
+    upserted_ids = {}
+    try:
+        result = await collection.bulk_write(bulk_operations, ordered=False)
+        upserted_ids = result.upserted_ids
+        inserted_count = result.upserted_count
+        updated_count = result.modified_count
+        unchanged_count = result.matched_count - result.modified_count
+        failed_ids = []
+    except pymongo.errors.BulkWriteError as bwe:
+        logger.error(f"批量保存笔记时部分写入失败: {bwe.details.get('writeErrors')}")
+        upserted_ids = bulk_error_upserted_ids(bwe.details)
+        inserted_count = bwe.details.get('nUpserted', 0)
+        updated_count = bwe.details.get('nModified', 0)
+        unchanged_count = bwe.details.get('nMatched', 0) - updated_count
+        failed_ids = [operation_note_ids[error['index']] for error in bwe.details.get('writeErrors', [])]
+    except Exception as e:
+        logger.error(f"批量保存笔记时出错: {e}")
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "failed_ids": operation_note_ids, "error": str(e)}
+    finally:
+        total_counter.invalidate(NOTES_COLLECTION)
+        # 新插入的笔记计入按日汇总
+        await record_documents(NOTES_COLLECTION, upserted_documents(upserted_ids, dict(enumerate(operation_notes))))
+        await query_cache.invalidate(*write_tags(NOTES_COLLECTION, note=operation_note_ids))
 
-        except Exception as e:
-            logger.error(f"处理笔记 noteId={note_id} 时出错: {e}")
-            # 继续处理下一个
+    # 刷新解析器使用的笔记元数据缓存
+    failed = set(failed_ids)
+    note_metadata_cache.update_from_notes(
+        {field: value for field, value in note_data.items() if not _is_placeholder_value(field, value)}
+        for note_data in operation_notes if note_data["noteId"] not in failed
+    )
 
-    logger.info(f"笔记保存/更新完成。插入: {inserted_count}, 更新: {updated_count}")
-    return {"inserted": inserted_count, "updated": updated_count}
+    logger.info("笔记保存/更新完成。插入: %d, 更新: %d, 无变化: %d, 失败: %d", inserted_count, updated_count, unchanged_count, len(failed_ids))
+    return {"inserted": inserted_count, "updated": updated_count, "unchanged": unchanged_count, "failed_ids": failed_ids}
 
 async def get_note_by_id(note_id: str) -> Optional[Dict[str, Any]]:
     """根据ID获取笔记详情"""
@@ -88,7 +152,7 @@ async def get_note_by_id(note_id: str) -> Optional[Dict[str, Any]]:
         return None
         
     database = await get_database()
-    note = await database[NOTES_COLLECTION].find_one({"noteId": note_id})
+    note = await database[NOTES_COLLECTION].find_one({"noteId": note_id}, HIDE_SEARCH_TOKENS)
     
     # 处理结果
     if note and '_id' in note:
@@ -105,27 +169,26 @@ async def search_notes(
     page: int = 1,
     page_size: int = 10
 ) -> Dict[str, Any]:
-    """搜索笔记，支持多种过滤条件"""
+    """搜索笔记，支持多种过滤条件（有关键字时按匹配次数和发布时间排序）"""
     # 在函数内部导入模块
     from database import get_database, NOTES_COLLECTION
+    from .pagination import find_page
     
     database = await get_database()
     collection = database[NOTES_COLLECTION]
     
     # 构建查询条件
     query = {}
+    search = KeywordSearch(NOTES_COLLECTION)
     
     if noteId:
         query["noteId"] = noteId
     
     if authorName:
-        query["user.nickname"] = {"$regex": authorName, "$options": "i"}
+        query.update(search.match(("user.nickname",), authorName))
     
     if keyword:
-        query["$or"] = [
-            {"title": {"$regex": keyword, "$options": "i"}},
-            {"noteContent": {"$regex": keyword, "$options": "i"}}
-        ]
+        query.update(search.match(("title", "noteContent"), keyword))
     
     # 处理日期范围
     date_query = {}
@@ -145,15 +208,17 @@ async def search_notes(
     if date_query:
         query["publishTime"] = date_query
     
-    # 计算分页参数
-    skip = (page - 1) * page_size
+    # 二元组索引就绪时用其缩小候选范围
+    await search.apply(query)
     
-    # 获取总数
-    total = await collection.count_documents(query)
+    # 获取总数（精确计数，短时缓存）
+    total, total_exact = await total_counter.count(collection, query, "exact")
     
     # 获取笔记列表
-    cursor = collection.find(query).sort("publishTime", -1).skip(skip).limit(page_size)
-    notes = await cursor.to_list(length=page_size)
+    notes, _ = await find_page(
+        collection, query, "publishTime", page_size, page=page,
+        projection=HIDE_SEARCH_TOKENS, score=search.score()
+    )
     
     # 处理结果（特别是将_id转换为字符串）
     for note in notes:
@@ -168,6 +233,7 @@ async def search_notes(
     return {
         "items": notes,
         "total": total,
+        "total_exact": total_exact,
         "page": page,
         "page_size": page_size
     } 
\ No newline at end of file
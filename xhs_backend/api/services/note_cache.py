@@ -0,0 +1,120 @@
+"""
+笔记元数据缓存
+
+评论页、子评论页解析时需要知道笔记是否已存在及其标题、作者、发布时间。
+同一笔记的评论会被连续翻页抓取，进程内的有界TTL缓存让重复页面不再查询数据库，
+未命中的笔记合并为一次 $in 查询
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+NOTE_CACHE_MAX_ENTRIES = int(os.environ.get("NOTE_CACHE_MAX_ENTRIES", 20000))
+NOTE_CACHE_TTL_SECONDS = int(os.environ.get("NOTE_CACHE_TTL_SECONDS", 600))
+
+# 缓存的笔记字段
+NOTE_METADATA_FIELDS = ("noteId", "title", "authorId", "publishTime", "noteContent", "noteLike")
+
+# 表示"数据库中不存在该笔记"的缓存值
+_MISSING = object()
+
+class NoteMetadataCache:
+    """笔记元数据的有界TTL缓存，带命中率计数"""
+
+    def __init__(self, max_entries: int = NOTE_CACHE_MAX_ENTRIES, ttl_seconds: int = NOTE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0  # 实际发出的数据库查询次数
+
+    async def get_many(self, note_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        获取多个笔记的元数据
+
+        Returns:
+            {noteId: 元数据}，数据库中不存在的笔记不包含在结果中
+        """
+        result: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        now = time.monotonic()
+
+        for note_id in dict.fromkeys(note_id for note_id in note_ids if note_id):
+            entry = self._entries.get(note_id)
+            if entry is not None and entry[0] >= now:
+                self.hits += 1
+                self._entries.move_to_end(note_id)
+                if entry[1] is not _MISSING:
+                    result[note_id] = entry[1]
+            else:
+                self.misses += 1
+                missing.append(note_id)
+
+        if missing:
+            found = await self._load(missing)
+            for note_id in missing:
+                metadata = found.get(note_id)
+                self._store(note_id, metadata if metadata is not None else _MISSING)
+                if metadata is not None:
+                    result[note_id] = metadata
+
+        return result
+
+    async def get(self, note_id: str) -> Optional[Dict[str, Any]]:
+        """获取单个笔记的元数据，不存在时返回 None"""
+        return (await self.get_many([note_id])).get(note_id)
+
+    def update_from_notes(self, notes: Iterable[Dict[str, Any]]):
+        """笔记保存后刷新缓存：已缓存的元数据合并新的非空值，未缓存的笔记不主动加入"""
+        now = time.monotonic()
+        for note in notes:
+            note_id = note.get("noteId")
+            entry = self._entries.get(note_id) if note_id else None
+            if entry is None:
+                continue
+            metadata = {} if entry[1] is _MISSING or entry[0] < now else dict(entry[1])
+            metadata["noteId"] = note_id
+            for field in NOTE_METADATA_FIELDS:
+                if note.get(field) not in (None, ""):
+                    metadata[field] = note[field]
+            self._store(note_id, metadata)
+
+    def invalidate(self, note_id: str):
+        """移除单个笔记的缓存"""
+        self._entries.pop(note_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "db_lookups": self.lookups,
+            "entries": len(self._entries)
+        }
+
+    async def _load(self, note_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        from database import get_database, NOTES_COLLECTION
+
+        self.lookups += 1
+        projection = {field: 1 for field in NOTE_METADATA_FIELDS}
+        projection["_id"] = 0
+        database = await get_database()
+        cursor = database[NOTES_COLLECTION].find({"noteId": {"$in": note_ids}}, projection)
+        return {doc["noteId"]: doc async for doc in cursor}
+
+    def _store(self, note_id: str, value: Any):
+        self._entries[note_id] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(note_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+# 全局笔记元数据缓存实例
+note_metadata_cache = NoteMetadataCache()
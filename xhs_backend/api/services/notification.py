@@ -9,6 +9,9 @@ from datetime import datetime
 from api.models.common import UserInfo # 假设 UserInfo 在这里或 common.py 中定义
 from pydantic import BaseModel # 确保 BaseModel 已导入
 
+from .query_cache import query_cache, write_tags
+from .totals import total_counter
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
@@ -61,6 +64,8 @@ async def save_user_note(user_id: str, notification_hash: str, note_content: str
         {"$set": note_data},
         upsert=True
     )
+    total_counter.invalidate(USER_NOTES_COLLECTION)
+    await query_cache.invalidate(*write_tags(USER_NOTES_COLLECTION, user=[user_id]))
     
     if result.upserted_id or result.modified_count > 0:
         logger.info(f"成功保存/更新用户备注: userId={user_id}, hash={notification_hash}, commentId={comment_id}")
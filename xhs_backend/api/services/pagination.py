@@ -0,0 +1,173 @@
+"""
+游标（keyset）分页
+
+skip 分页翻到第 N 页时数据库要扫描并丢弃前 (N-1)*page_size 条文档，页数越深越慢。
+游标分页按 (排序字段, _id) 记住上一页最后一条文档的位置，下一页直接从索引中该位置之后开始读取，
+任意深度的页面耗时都与第一页相同（需要 (排序字段, _id) 复合索引，见 indexes.py）。
+
+游标对客户端是不透明的字符串，与 page/page_size 分页并存：两种方式的响应都带 next_cursor。
+排序字段为空的文档排在最后；类型与上一页末尾不同的排序值（如同一字段中混有字符串和日期）不会出现在后续页。
+
+提供 score（聚合表达式，如关键字匹配次数）时按 (score 降序, 排序字段, _id) 排序，游标中同时记录 score。
+"""
+import base64
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+from fastapi import HTTPException, status
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_SCORE_FIELD = "_pageScore"
+
+def encode_cursor(sort_value: Any, doc_id: Any, score: Any = None) -> str:
+    """把排序值和 _id（以及 score）编码为游标（保留 datetime、ObjectId 等类型）"""
+    payload = {"v": sort_value, "id": doc_id}
+    if score is not None:
+        payload["s"] = score
+    raw = json_util.dumps(payload)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Any, Any, Any]:
+    """
+    解码游标
+
+    Returns:
+        (排序值, _id, score)，游标中没有 score 时为 None
+
+    Raises:
+        HTTPException: 游标格式错误（400）
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        return payload["v"], payload["id"], payload.get("s")
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+def _seek_condition(sort_field: str, direction: int, sort_value: Any, doc_id: Any) -> Dict[str, Any]:
+    """位于游标之后的文档条件"""
+    after = "$lt" if direction < 0 else "$gt"
+    if sort_value is None:
+        # 降序时空值排在最后，只剩同为空值且 _id 更靠后的文档
+        if direction < 0:
+            return {sort_field: None, "_id": {after: doc_id}}
+        return {"$or": [
+            {sort_field: None, "_id": {after: doc_id}},
+            {sort_field: {"$ne": None}}
+        ]}
+
+    conditions = [
+        {sort_field: {after: sort_value}},
+        {sort_field: sort_value, "_id": {after: doc_id}}
+    ]
+    if direction < 0:
+        conditions.append({sort_field: None})
+    return {"$or": conditions}
+
+async def find_page(
+    collection,
+    query: Dict[str, Any],
+    sort_field: str,
+    page_size: int,
+    cursor: Optional[str] = None,
+    page: int = 1,
+    direction: int = -1,
+    projection: Optional[Dict[str, Any]] = None,
+    score: Optional[Dict[str, Any]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    查询一页文档，按 (sort_field, _id) 排序
+
+    提供 cursor 时从游标位置开始读取（忽略 page），否则按 page 跳过前面的文档。
+    提供 score 时先按 score 降序排序（见 _find_scored_page）。
+
+    Returns:
+        (文档列表, 下一页游标)，没有更多数据时游标为 None
+    """
+    if score is not None:
+        return await _find_scored_page(
+            collection, query, sort_field, page_size, cursor, page, direction, projection, score
+        )
+
+    if cursor:
+        sort_value, doc_id, _ = decode_cursor(cursor)
+        seek = _seek_condition(sort_field, direction, sort_value, doc_id)
+        query = {"$and": [query, seek]} if query else seek
+        skip = 0
+    else:
+        skip = (page - 1) * page_size
+
+    find_cursor = collection.find(query, projection).sort([(sort_field, direction), ("_id", direction)])
+    if skip:
+        find_cursor = find_cursor.skip(skip)
+    # 多取一条判断是否还有下一页
+    docs = await find_cursor.limit(page_size + 1).to_list(length=page_size + 1)
+
+    next_cursor = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        last = docs[-1]
+        next_cursor = encode_cursor(_get_field(last, sort_field), last["_id"])
+    return docs, next_cursor
+
+async def _find_scored_page(
+    collection,
+    query: Dict[str, Any],
+    sort_field: str,
+    page_size: int,
+    cursor: Optional[str],
+    page: int,
+    direction: int,
+    projection: Optional[Dict[str, Any]],
+    score: Dict[str, Any]
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    按 (score 降序, sort_field, _id) 查询一页
+
+    聚合只取出本页文档的 _id 和排序值，文档本身再用 find 按 projection 读取
+    （find 投影语法如 $slice 在聚合 $project 中不可用）
+    """
+    pipeline: List[Dict[str, Any]] = [{"$match": query}, {"$addFields": {_SCORE_FIELD: score}}]
+    if cursor:
+        sort_value, doc_id, score_value = decode_cursor(cursor)
+        if score_value is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的分页游标"
+            )
+        pipeline.append({"$match": {"$or": [
+            {_SCORE_FIELD: {"$lt": score_value}},
+            {"$and": [{_SCORE_FIELD: score_value}, _seek_condition(sort_field, direction, sort_value, doc_id)]}
+        ]}})
+    pipeline.append({"$sort": {_SCORE_FIELD: -1, sort_field: direction, "_id": direction}})
+    if not cursor and page > 1:
+        pipeline.append({"$skip": (page - 1) * page_size})
+    pipeline.extend([
+        {"$limit": page_size + 1},
+        {"$project": {_SCORE_FIELD: 1, sort_field: 1}}
+    ])
+    ranked = await collection.aggregate(pipeline).to_list(length=page_size + 1)
+
+    next_cursor = None
+    if len(ranked) > page_size:
+        ranked = ranked[:page_size]
+        last = ranked[-1]
+        next_cursor = encode_cursor(_get_field(last, sort_field), last["_id"], last[_SCORE_FIELD])
+
+    ids = [row["_id"] for row in ranked]
+    docs = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": ids}}, projection)} if ids else {}
+    return [docs[doc_id] for doc_id in ids if doc_id in docs], next_cursor
+
+def _get_field(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
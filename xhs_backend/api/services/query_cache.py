@@ -0,0 +1,303 @@
+"""
+查询结果缓存
+
+管理界面反复请求相同的列表、详情和统计接口，每个 worker 都要重新查询 MongoDB。
+这里按 (路由, 规范化的参数, 用户) 缓存接口返回值，每个条目带有所涉及实体的标签：
+- collection:<集合名>：集合中任意文档变化（列表接口）
+- stats:<集合名>：集合的统计数据变化（统计接口）
+- note:<noteId>、user:<用户ID>、comment:<评论_id>：单个实体变化（详情接口）
+
+api/services 中的保存函数写入后调用 query_cache.invalidate() 发布所写实体的标签，
+带有这些标签的条目随即失效；没有写入路径的集合（如通知）只能等条目过期。
+
+后端为 memory（进程内，单 worker）或 redis（多个 worker 共享条目和失效）。
+redis 后端中每个标签对应一个随机版本号，失效时更换版本号；条目保存写入时各标签的版本号，
+读取时版本号不一致即视为未命中。条目在查询开始前读取版本号，查询期间发生的失效不会被覆盖。
+Redis 不可用时退回进程内存储。命中率通过 Prometheus 指标和 /monitoring/query-cache 导出。
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+from bson import json_util
+
+from .metrics import observe_query_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_ENABLED = os.environ.get("QUERY_CACHE_ENABLED", "true").lower() == "true"
+# 存储后端: memory（进程内）或 redis（多进程共享）
+QUERY_CACHE_BACKEND = os.environ.get("QUERY_CACHE_BACKEND", "memory").lower()
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_TTL_SECONDS", 30))  # 列表和详情接口
+QUERY_CACHE_STATS_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_STATS_TTL_SECONDS", 120))  # 统计接口
+# 用户历史评论（评论写入时按 user:<用户ID> 失效，笔记信息的变化要等条目过期）
+QUERY_CACHE_USER_HISTORY_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_USER_HISTORY_TTL_SECONDS", 300))
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 2000))  # 进程内存储的最大条数
+REDIS_ENTRY_PREFIX = "xhs:qcache:entry:"
+REDIS_TAG_PREFIX = "xhs:qcache:tag:"
+# 标签版本号的保存时间，必须长于任何条目的 TTL（版本号过期后读取为初始值，不会与已有条目的版本号相同）
+_TAG_TTL_SECONDS = 24 * 3600
+_INITIAL_VERSION = "0"
+
+# 接口参数中不参与缓存键的部分（数据库连接、当前用户单独处理）
+_UNKEYED_PARAMS = ("db", "current_user", "user")
+
+# 计算失败时通知等待者自行查询
+_FAILED = object()
+
+def collection_tag(collection_name: str) -> str:
+    return f"collection:{collection_name}"
+
+def stats_tag(collection_name: str) -> str:
+    return f"stats:{collection_name}"
+
+def write_tags(collection_name: str, **entity_ids: Iterable[Any]) -> List[str]:
+    """
+    写入集合后需要发布的标签
+
+    用法：
+        write_tags(NOTES_COLLECTION, note=note_ids)  # collection:notes, stats:notes, note:<id>...
+    """
+    tags = [collection_tag(collection_name), stats_tag(collection_name)]
+    for kind, ids in entity_ids.items():
+        tags.extend(f"{kind}:{entity_id}" for entity_id in dict.fromkeys(ids) if entity_id)
+    return tags
+
+def _key_value(value: Any) -> Any:
+    """参数值的可序列化形式（依赖项返回的 pydantic 模型转换为字典）"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return value
+
+def cache_key(route: str, params: Dict[str, Any], user: Optional[str]) -> str:
+    """(路由, 规范化的参数, 用户) 的缓存键"""
+    material = json_util.dumps({"r": route, "p": params, "u": user}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class QueryCache:
+    """接口返回值的TTL缓存，按标签失效，合并同时进行的相同查询"""
+
+    def __init__(
+        self,
+        backend: str = QUERY_CACHE_BACKEND,
+        ttl_seconds: int = QUERY_CACHE_TTL_SECONDS,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        enabled: bool = QUERY_CACHE_ENABLED
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        # 进程内存储: {缓存键: (过期时间, 标签, 返回值)}，以及标签到缓存键的反向索引
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, ...], Any]]" = OrderedDict()
+        self._tag_keys: Dict[str, Set[str]] = {}
+        # 正在计算的查询: {缓存键: (Future, 标签)}；计算期间标签失效的查询不保存结果
+        self._inflight: Dict[str, Tuple[asyncio.Future, Tuple[str, ...]]] = {}
+        self._stale_inflight: Set[str] = set()
+        self._last_redis_warning = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.invalidations = 0
+        self.uncacheable = 0
+
+    async def get_or_compute(
+        self,
+        route: str,
+        params: Dict[str, Any],
+        user: Optional[str],
+        tags: Sequence[str],
+        compute: Callable[[], Awaitable[Any]],
+        ttl_seconds: Optional[int] = None
+    ) -> Any:
+        """缓存命中时直接返回，否则执行 compute 并缓存其返回值（compute 抛出异常时不缓存）"""
+        if not self.enabled:
+            return await compute()
+
+        key = cache_key(route, params, user)
+        tags = tuple(dict.fromkeys(tags))
+        found, value, versions = await self._lookup(key, tags)
+        if found:
+            self.hits += 1
+            observe_query_cache(route, "hit")
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            value = await asyncio.shield(inflight[0])
+            if value is not _FAILED:
+                self.collapsed += 1
+                observe_query_cache(route, "collapsed")
+                return value
+
+        self.misses += 1
+        observe_query_cache(route, "miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, tags)
+        value = _FAILED
+        try:
+            value = await compute()
+            if key not in self._stale_inflight:
+                await self._store(key, tags, value, versions, min(ttl_seconds or self.ttl_seconds, _TAG_TTL_SECONDS))
+            return value
+        finally:
+            self._inflight.pop(key, None)
+            self._stale_inflight.discard(key)
+            if not future.done():
+                future.set_result(value)
+
+    async def invalidate(self, *tags: str):
+        """发布标签失效（保存函数写入后调用，不会抛出异常）"""
+        tags = tuple(dict.fromkeys(tags))
+        if not self.enabled or not tags:
+            return
+        self.invalidations += 1
+        self._memory_invalidate(tags)
+        if self.backend == "redis":
+            from .redis_async import get_async_redis
+            try:
+                pipeline = get_async_redis().pipeline(transaction=False)
+                for tag in tags:
+                    pipeline.set(REDIS_TAG_PREFIX + tag, uuid.uuid4().hex, ex=_TAG_TTL_SECONDS)
+                await pipeline.execute()
+            except Exception as e:
+                self._warn_redis(e)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.collapsed + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend,
+            "hits": self.hits,
+            "collapsed": self.collapsed,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.collapsed) / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "uncacheable": self.uncacheable,
+            "in_flight": len(self._inflight),
+            "entries": len(self._entries)
+        }
+
+    # === 存储 ===
+    async def _lookup(self, key: str, tags: Tuple[str, ...]) -> Tuple[bool, Any, Optional[List[str]]]:
+        """
+        Returns:
+            (是否命中, 返回值, 当前各标签的版本号)。版本号为 None 时使用进程内存储
+        """
+        if self.backend == "redis":
+            from .redis_async import get_async_redis
+            try:
+                pipeline = get_async_redis().pipeline(transaction=False)
+                pipeline.get(REDIS_ENTRY_PREFIX + key)
+                if tags:
+                    pipeline.mget([REDIS_TAG_PREFIX + tag for tag in tags])
+                replies = await pipeline.execute()
+            except Exception as e:
+                self._warn_redis(e)
+            else:
+                versions = [version or _INITIAL_VERSION for version in replies[1]] if tags else []
+                if replies[0] is not None:
+                    try:
+                        entry = json_util.loads(replies[0])
+                        if entry.get("t") == versions:
+                            return True, entry.get("d"), versions
+                    except ValueError as e:
+                        logger.warning(f"查询缓存条目格式错误，忽略: {e}")
+                return False, None, versions
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                return True, entry[2], None
+            self._memory_delete(key)
+        return False, None, None
+
+    async def _store(self, key: str, tags: Tuple[str, ...], value: Any, versions: Optional[List[str]], ttl_seconds: int):
+        if versions is not None:
+            try:
+                raw = json_util.dumps({"t": versions, "d": value})
+            except (TypeError, ValueError) as e:
+                self.uncacheable += 1
+                logger.debug(f"查询结果无法序列化，不缓存: {e}")
+                return
+            from .redis_async import get_async_redis
+            try:
+                await get_async_redis().set(REDIS_ENTRY_PREFIX + key, raw, ex=ttl_seconds)
+                return
+            except Exception as e:
+                self._warn_redis(e)
+        self._memory_set(key, tags, value, ttl_seconds)
+
+    def _memory_set(self, key: str, tags: Tuple[str, ...], value: Any, ttl_seconds: int):
+        self._memory_delete(key)
+        self._entries[key] = (time.monotonic() + ttl_seconds, tags, value)
+        for tag in tags:
+            self._tag_keys.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._memory_delete(next(iter(self._entries)))
+
+    def _memory_delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_keys[tag]
+
+    def _memory_invalidate(self, tags: Tuple[str, ...]):
+        for tag in tags:
+            for key in list(self._tag_keys.get(tag, ())):
+                self._memory_delete(key)
+        invalidated = set(tags)
+        self._stale_inflight.update(
+            key for key, (_, inflight_tags) in self._inflight.items() if invalidated.intersection(inflight_tags)
+        )
+
+    def _warn_redis(self, error: Exception):
+        # Redis 不可用时退回进程内存储，警告每分钟最多输出一次
+        if time.monotonic() - self._last_redis_warning > 60:
+            self._last_redis_warning = time.monotonic()
+            logger.warning(f"Redis 查询缓存不可用，使用进程内存储: {error}")
+
+# 全局查询缓存实例
+query_cache = QueryCache()
+
+def cached_query(
+    route: str,
+    tags: Union[Sequence[str], Callable[[Dict[str, Any]], Iterable[str]]],
+    ttl_seconds: Optional[int] = None
+):
+    """
+    缓存接口返回值的装饰器（放在 @router.get 之下）
+
+    缓存键由路由名、除 db/当前用户外的接口参数和当前用户组成；
+    tags 为标签列表，或根据接口参数返回标签的函数
+
+    用法：
+        @router.get("/{note_id}")
+        @cached_query("notes.get", lambda params: [f"note:{params['note_id']}"])
+        async def get_note(note_id: str, current_user: str = Depends(get_current_user), db=Depends(get_database)):
+            ...
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            params = {name: _key_value(value) for name, value in kwargs.items() if name not in _UNKEYED_PARAMS}
+            user = kwargs.get("current_user", kwargs.get("user"))
+            entry_tags = list(tags(kwargs) if callable(tags) else tags)
+            return await query_cache.get_or_compute(
+                route, params, user, entry_tags, lambda: func(*args, **kwargs), ttl_seconds
+            )
+        return wrapper
+    return decorator
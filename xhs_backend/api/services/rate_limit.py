@@ -0,0 +1,172 @@
+"""
+上传限流服务
+
+1. 按上传用户的令牌桶限流：桶状态保存在 Redis 中（Lua 脚本原子更新），所有 worker 共享同一限额；
+   Redis 不可用时退回进程内令牌桶
+2. 进程内并发上限：正在处理的同步上传达到上限时直接拒绝，避免请求堆积把数据库压垮
+
+超出限额的请求由接口返回 429/503 和 Retry-After，插件据此退避后重新排队上传。
+"""
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+INGEST_RATE_LIMIT_ENABLED = os.environ.get("INGEST_RATE_LIMIT_ENABLED", "true").lower() == "true"
+# 令牌桶存储后端: redis（多进程共享）或 memory（进程内）
+INGEST_RATE_LIMIT_BACKEND = os.environ.get("INGEST_RATE_LIMIT_BACKEND", "redis").lower()
+INGEST_RATE_PER_SECOND = float(os.environ.get("INGEST_RATE_PER_SECOND", 5))  # 每个用户每秒补充的令牌数
+INGEST_RATE_BURST = int(os.environ.get("INGEST_RATE_BURST", 60))  # 令牌桶容量（允许的突发上传数）
+INGEST_MAX_IN_FLIGHT = int(os.environ.get("INGEST_MAX_IN_FLIGHT", 32))  # 每个 worker 同时处理的上传数上限，0 表示不限
+INGEST_OVERLOAD_RETRY_AFTER = int(os.environ.get("INGEST_OVERLOAD_RETRY_AFTER", 2))  # 并发已满时建议的重试间隔（秒）
+REDIS_BUCKET_PREFIX = "xhs:ingest:bucket:"
+
+# KEYS[1]: 桶键; ARGV: 每秒补充令牌数, 容量, 当前时间(毫秒), 本次消耗
+# 返回: {是否允许(1/0), 剩余令牌数(取整), 需等待的毫秒数}
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+local wait_ms = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait_ms = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, math.floor(tokens), wait_ms}
+"""
+
+class TokenBucketLimiter:
+    """按键（上传用户）的令牌桶限流器"""
+
+    def __init__(
+        self,
+        rate: float = INGEST_RATE_PER_SECOND,
+        burst: int = INGEST_RATE_BURST,
+        backend: str = INGEST_RATE_LIMIT_BACKEND,
+        enabled: bool = INGEST_RATE_LIMIT_ENABLED
+    ):
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst, 1)
+        self.backend = backend
+        self.enabled = enabled
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._script = None
+        self._last_redis_warning = 0.0
+        self.allowed = 0
+        self.rejected = 0
+
+    async def acquire(self, key: str, cost: int = 1) -> Tuple[bool, float]:
+        """
+        为 key 消耗 cost 个令牌
+
+        Returns:
+            (是否允许, 需等待的秒数)。单次消耗超过桶容量时按容量计算，避免永远无法通过
+        """
+        if not self.enabled or cost <= 0:
+            return True, 0.0
+        cost = min(cost, self.burst)
+
+        if self.backend == "redis":
+            result = await self._redis_acquire(key, cost)
+        else:
+            result = None
+        if result is None:
+            result = self._memory_acquire(key, cost)
+
+        if result[0]:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend,
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+    def _memory_acquire(self, key: str, cost: int) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens >= cost:
+            self._buckets[key] = (tokens - cost, now)
+            return True, 0.0
+        self._buckets[key] = (tokens, now)
+        return False, (cost - tokens) / self.rate
+
+    async def _redis_acquire(self, key: str, cost: int):
+        from .redis_async import get_async_redis
+        try:
+            if self._script is None:
+                self._script = get_async_redis().register_script(_TOKEN_BUCKET_SCRIPT)
+            allowed, _, wait_ms = await self._script(
+                keys=[REDIS_BUCKET_PREFIX + key],
+                args=[self.rate, self.burst, int(time.time() * 1000), cost]
+            )
+            return bool(int(allowed)), int(wait_ms) / 1000
+        except Exception as e:
+            # Redis 不可用时退回进程内令牌桶，限额变为每个 worker 独立计算
+            if time.monotonic() - self._last_redis_warning > 60:
+                self._last_redis_warning = time.monotonic()
+                logger.warning(f"Redis 令牌桶不可用，使用进程内限流: {e}")
+            return None
+
+class InFlightLimiter:
+    """进程内同时处理的上传数上限"""
+
+    def __init__(self, max_in_flight: int = INGEST_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.peak = 0
+        self.shed = 0
+
+    def try_acquire(self) -> bool:
+        """占用一个处理名额，已满时返回 False"""
+        if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        return True
+
+    def release(self):
+        self.in_flight = max(self.in_flight - 1, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "peak": self.peak,
+            "shed": self.shed
+        }
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After 取整秒数（至少1秒）"""
+    return str(max(1, math.ceil(seconds)))
+
+# 全局上传限流实例
+ingest_rate_limiter = TokenBucketLimiter()
+ingest_in_flight = InFlightLimiter()
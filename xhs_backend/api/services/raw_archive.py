@@ -0,0 +1,157 @@
+"""
+原始响应体归档服务
+
+每个被接受的上传都会以响应体内容哈希为键压缩存档一次，
+解析器修复后可以从归档中重新处理历史数据，而不需要重新浏览小红书
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from ..models.network import RawNetworkData
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖，不可用时退回 gzip
+    zstandard = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+RAW_ARCHIVE_ENABLED = os.environ.get("RAW_ARCHIVE_ENABLED", "true").lower() == "true"
+# 压缩编码：zstd 或 gzip，未安装 zstandard 时始终使用 gzip
+RAW_ARCHIVE_CODEC = os.environ.get("RAW_ARCHIVE_CODEC", "zstd" if zstandard else "gzip")
+RAW_ARCHIVE_LEVEL = int(os.environ.get("RAW_ARCHIVE_LEVEL", 6))
+
+CODEC_ZSTD = "zstd"
+CODEC_GZIP = "gzip"
+
+def compute_body_hash(body: bytes) -> str:
+    """计算响应体的内容哈希（归档主键）"""
+    return hashlib.sha256(body).hexdigest()
+
+def compress_body(body: bytes) -> Tuple[str, bytes]:
+    """按配置的编码压缩响应体，返回 (编码, 压缩数据)"""
+    if RAW_ARCHIVE_CODEC == CODEC_ZSTD and zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=RAW_ARCHIVE_LEVEL).compress(body)
+    return CODEC_GZIP, gzip.compress(body, compresslevel=RAW_ARCHIVE_LEVEL)
+
+def decompress_body(codec: str, data: bytes) -> bytes:
+    """解压归档的响应体"""
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("归档使用 zstd 压缩，但当前环境未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_GZIP:
+        return gzip.decompress(data)
+    raise ValueError(f"未知的归档压缩编码: {codec}")
+
+async def archive_raw_data(raw_data: RawNetworkData, data_type: str, body: Optional[bytes] = None) -> Optional[str]:
+    """
+    归档一次上传的原始响应体
+
+    同一响应体只存储一份，重复上传只更新 last_seen 与 seen_count。
+    归档失败不影响正常的数据处理流程。
+
+    Args:
+        raw_data: 原始网络数据
+        data_type: 已识别的数据类型
+        body: 已编码的响应体字节，调用方已有时传入以避免重复编码
+
+    Returns:
+        归档键（内容哈希），未归档时返回 None
+    """
+    from database import get_database, RAW_ARCHIVE_COLLECTION
+
+    if not RAW_ARCHIVE_ENABLED:
+        return None
+
+    if body is None:
+        if not raw_data.response_body:
+            return None
+        body = raw_data.response_body.encode("utf-8")
+    elif not body:
+        return None
+    body_hash = compute_body_hash(body)
+    now = datetime.utcnow()
+
+    try:
+        database = await get_database()
+        collection = database[RAW_ARCHIVE_COLLECTION]
+        seen_update = {"$set": {"last_seen": now}, "$inc": {"seen_count": 1}}
+        # 大多数重复上传的响应体已在归档中，先只更新访问信息，未命中时才压缩并插入
+        existing = await collection.update_one({"_id": body_hash}, seen_update)
+        if existing.matched_count:
+            return body_hash
+
+        # 压缩几百KB的响应体需要数毫秒，放到线程中执行，避免阻塞事件循环
+        codec, compressed = await asyncio.to_thread(compress_body, body)
+        try:
+            await collection.insert_one({
+                "_id": body_hash,
+                "codec": codec,
+                "body": compressed,
+                "size": len(body),
+                "compressed_size": len(compressed),
+                "data_type": data_type,
+                "rule_name": raw_data.rule_name,
+                "url": raw_data.url,
+                "method": raw_data.method,
+                "status_code": raw_data.status_code,
+                "captured_at": raw_data.timestamp,
+                "first_seen": now,
+                "last_seen": now,
+                "seen_count": 1
+            })
+        except DuplicateKeyError:
+            # 并发上传的相同响应体已由另一请求插入
+            await collection.update_one({"_id": body_hash}, seen_update)
+        return body_hash
+    except Exception as e:
+        logger.error(f"归档原始响应体失败 (type={data_type}, url={raw_data.url}): {e}")
+        return None
+
+def archived_doc_to_raw_data(doc: Dict[str, Any]) -> RawNetworkData:
+    """将归档文档还原为 RawNetworkData，用于重新处理"""
+    body = decompress_body(doc["codec"], doc["body"])
+    return RawNetworkData(
+        rule_name=doc.get("rule_name") or "",
+        url=doc.get("url") or "",
+        method=doc.get("method") or "GET",
+        status_code=doc.get("status_code"),
+        response_body=body.decode("utf-8"),
+        timestamp=doc.get("captured_at") or doc.get("first_seen") or datetime.utcnow(),
+        request_id=f"archive:{doc['_id']}"
+    )
+
+def build_archive_query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    data_type: Optional[str] = None
+) -> Dict[str, Any]:
+    """构建归档查询条件（按首次接收时间范围和数据类型过滤）"""
+    query: Dict[str, Any] = {}
+    if data_type:
+        query["data_type"] = data_type
+    if start or end:
+        time_range = {}
+        if start:
+            time_range["$gte"] = start
+        if end:
+            time_range["$lt"] = end
+        query["first_seen"] = time_range
+    return query
+
+async def iter_archived_payloads(database, query: Dict[str, Any], batch_size: int = 100) -> AsyncIterator[Dict[str, Any]]:
+    """按首次接收时间顺序流式读取归档文档"""
+    from database import RAW_ARCHIVE_COLLECTION
+
+    cursor = database[RAW_ARCHIVE_COLLECTION].find(query).sort("first_seen", 1).batch_size(batch_size)
+    async for doc in cursor:
+        yield doc
@@ -0,0 +1,40 @@
+"""
+异步 Redis 连接服务
+
+为摄取队列等需要在事件循环中访问 Redis 的功能提供共享的 redis.asyncio 客户端，
+连接参数与 session.py 的会话存储保持一致
+"""
+import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+from .session import REDIS_HOST, REDIS_PORT, REDIS_DB
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_async_client: Optional[aioredis.Redis] = None
+
+def get_async_redis() -> aioredis.Redis:
+    """获取进程内共享的异步 Redis 客户端（惰性创建，连接在首次命令时建立）"""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            decode_responses=True
+        )
+        logger.info(f"已创建异步 Redis 客户端 ({REDIS_HOST}:{REDIS_PORT}, DB: {REDIS_DB})")
+    return _async_client
+
+async def close_async_redis():
+    """关闭异步 Redis 客户端"""
+    global _async_client
+    if _async_client is not None:
+        try:
+            await _async_client.aclose()
+        except Exception as e:
+            logger.warning(f"关闭异步 Redis 客户端时出错: {e}")
+        _async_client = None
@@ -0,0 +1,81 @@
+"""
+压缩请求体支持
+
+插件批量上传时用 gzip 压缩请求体（Content-Encoding: gzip）。GzipRoute 在读取请求体时
+逐块流式解压，不需要先把整个压缩包读入内存，并限制解压后的大小，防止压缩炸弹。
+"""
+import logging
+import os
+import zlib
+from typing import AsyncGenerator, Callable
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 解压后请求体的大小上限（字节）
+MAX_DECOMPRESSED_BODY_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BODY_BYTES", 64 * 1024 * 1024))
+
+class GzipRequest(Request):
+    """请求体为 gzip 压缩数据的请求，读取时流式解压"""
+
+    max_body_bytes = MAX_DECOMPRESSED_BODY_BYTES
+
+    async def stream(self) -> AsyncGenerator[bytes, None]:
+        if hasattr(self, "_body"):
+            yield self._body
+            yield b""
+            return
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        total = 0
+        try:
+            async for chunk in super().stream():
+                data = chunk
+                while data:
+                    # 限制单次输出长度，超出上限时不会先解压出整个炸弹
+                    output = decompressor.decompress(data, self.max_body_bytes - total + 1)
+                    total += len(output)
+                    if total > self.max_body_bytes:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"解压后的请求体超过上限 {self.max_body_bytes} 字节"
+                        )
+                    if output:
+                        yield output
+                    data = decompressor.unconsumed_tail
+            output = decompressor.flush()
+        except zlib.error as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"gzip 请求体解压失败: {e}"
+            )
+
+        if not decompressor.eof:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="gzip 请求体不完整"
+            )
+        if total + len(output) > self.max_body_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"解压后的请求体超过上限 {self.max_body_bytes} 字节"
+            )
+        if output:
+            yield output
+        yield b""
+
+class GzipRoute(APIRoute):
+    """接受 Content-Encoding: gzip 请求体的路由"""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def gzip_route_handler(request: Request) -> Response:
+            if request.headers.get("content-encoding", "").strip().lower() == "gzip":
+                request = GzipRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return gzip_route_handler
@@ -0,0 +1,434 @@
+"""
+按日汇总的统计数据（daily_rollups）
+
+统计接口每次加载都要对整个集合执行多次 count_documents 和全表 $group，集合越大越慢。
+这里把计数预先汇总到 daily_rollups 集合，每个文档是一个 (集合, 维度, 日期, 键) 的计数：
+1. 维度：total（总数，键固定为 "*"）、note（笔记）、author（作者）、type（通知类型）、ip_location（IP属地）
+2. 日期：UTC 日期 "YYYY-MM-DD"，另有 "all" 表示不分日期的累计
+3. 上传保存新文档时按批次 $inc 对应的日期和 "all" 计数（一次无序批量写入），删除评论时 $inc -1
+4. 统计接口用一次索引查询读取最近 30 天的总数，排行榜各用一次按 count 排序的索引查询
+
+文档的日期是首次入库的日期（_id 的生成时间），通知使用通知时间（timestamp）。
+已有文档需要用 migrations/build_daily_rollups.py 重建汇总，重建完成后集合被标记为就绪；
+未就绪的集合统计接口仍直接查询原集合。文档被更新时计数不变（维度取首次入库时的值），
+其他程序直接写入或删除的文档不会反映到汇总中，需要重新运行重建脚本。
+"""
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUP_COLLECTION = "daily_rollups"
+ROLLUP_STATE_COLLECTION = "daily_rollup_state"
+ROLLUP_VERSION = 1  # 维度或日期规则变化时递增，旧版本的就绪标记失效，需要重新重建
+ROLLUP_ALL_DAYS = "all"
+ROLLUP_TOTAL_KEY = "*"
+_READY_CACHE_SECONDS = 60
+
+DIMENSION_TOTAL = "total"
+DIMENSION_NOTE = "note"
+DIMENSION_AUTHOR = "author"
+DIMENSION_TYPE = "type"
+DIMENSION_IP_LOCATION = "ip_location"
+
+# 统计接口的时间段：(名称, 起始日距今天的天数, 结束日距今天的天数)，均包含两端
+STAT_PERIODS = (
+    ("today", 0, 0),
+    ("yesterday", 1, 1),
+    ("week", 6, 0),
+    ("month", 29, 0),
+)
+
+class RollupSpec:
+    """一个集合的汇总声明"""
+
+    def __init__(
+        self,
+        collection: str,
+        dimensions: Dict[str, Sequence[str]],
+        time_field: Optional[str] = None
+    ):
+        self.collection = collection
+        # 维度 -> 候选字段（依次取第一个存在的字段，兼容新旧两种字段名）
+        self.dimensions = {name: tuple(fields) for name, fields in dimensions.items()}
+        # 日期字段，为空或文档中不是日期时使用 _id 的生成时间
+        self.time_field = time_field
+
+def _build_rollup_specs() -> Dict[str, RollupSpec]:
+    from database import (
+        COMMENTS_COLLECTION, STRUCTURED_COMMENTS_COLLECTION, NOTES_COLLECTION, NOTIFICATIONS_COLLECTION
+    )
+
+    specs = [
+        RollupSpec(COMMENTS_COLLECTION, {
+            DIMENSION_NOTE: ("note_id", "noteId"),
+            DIMENSION_AUTHOR: ("user_name", "authorName"),
+            DIMENSION_IP_LOCATION: ("ipLocation",),
+        }),
+        RollupSpec(STRUCTURED_COMMENTS_COLLECTION, {
+            DIMENSION_NOTE: ("noteId",),
+            DIMENSION_AUTHOR: ("authorName",),
+            DIMENSION_IP_LOCATION: ("ipLocation",),
+        }),
+        RollupSpec(NOTES_COLLECTION, {
+            DIMENSION_AUTHOR: ("user.nickname", "authorId"),
+        }),
+        # 本项目没有写入通知的上传路径，通知的汇总只由重建脚本生成
+        RollupSpec(NOTIFICATIONS_COLLECTION, {
+            DIMENSION_TYPE: ("type",),
+            DIMENSION_AUTHOR: ("username",),
+        }, time_field="timestamp"),
+    ]
+    return {spec.collection: spec for spec in specs}
+
+_rollup_specs: Optional[Dict[str, RollupSpec]] = None
+
+def _get_rollup_specs() -> Dict[str, RollupSpec]:
+    global _rollup_specs
+    if _rollup_specs is None:
+        _rollup_specs = _build_rollup_specs()
+    return _rollup_specs
+
+def get_rollup_spec(collection_name: str) -> Optional[RollupSpec]:
+    return _get_rollup_specs().get(collection_name)
+
+def rollup_collections() -> List[str]:
+    """维护按日汇总的集合"""
+    return list(_get_rollup_specs())
+
+def _get_field(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _valid_key(value: Any) -> bool:
+    return isinstance(value, (str, int, float, bool)) and value != ""
+
+def _day(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%d")
+
+def document_day(spec: RollupSpec, doc: Dict[str, Any]) -> Optional[str]:
+    """文档所属的日期（UTC），无法确定时为 None（只计入 "all"）"""
+    if spec.time_field:
+        value = _get_field(doc, spec.time_field)
+        if isinstance(value, datetime):
+            return _day(value)
+    doc_id = doc.get("_id")
+    if isinstance(doc_id, ObjectId):
+        return _day(doc_id.generation_time)
+    return None
+
+def document_keys(spec: RollupSpec, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """文档在各维度上的键（缺失或为空的维度不计数）"""
+    keys = {DIMENSION_TOTAL: ROLLUP_TOTAL_KEY}
+    for dimension, fields in spec.dimensions.items():
+        value = next((v for v in (_get_field(doc, f) for f in fields) if v is not None), None)
+        if _valid_key(value):
+            keys[dimension] = value
+    return keys
+
+def rollup_increments(collection_name: str, docs: Iterable[Dict[str, Any]], delta: int = 1) -> Counter:
+    """一批文档对应的计数增量: {(维度, 日期, 键): 增量}"""
+    increments: Counter = Counter()
+    spec = get_rollup_spec(collection_name)
+    if spec is None:
+        return increments
+    for doc in docs:
+        day = document_day(spec, doc)
+        for dimension, key in document_keys(spec, doc).items():
+            increments[(dimension, ROLLUP_ALL_DAYS, key)] += delta
+            if day is not None:
+                increments[(dimension, day, key)] += delta
+    return increments
+
+async def _apply_increments(database, collection_name: str, increments: Counter):
+    import pymongo
+
+    now = datetime.utcnow()
+    operations = [
+        pymongo.UpdateOne(
+            {"collection": collection_name, "dimension": dimension, "day": day, "key": key},
+            {"$inc": {"count": count}, "$set": {"updatedAt": now}},
+            upsert=True
+        )
+        for (dimension, day, key), count in increments.items() if count
+    ]
+    if operations:
+        await database[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+async def record_documents(collection_name: str, docs: Sequence[Dict[str, Any]], delta: int = 1):
+    """
+    把新保存（delta=1）或已删除（delta=-1）的文档计入汇总
+
+    docs 需要包含 _id。统计失败只记录警告，不影响保存结果。
+    """
+    if not ROLLUPS_ENABLED or not docs:
+        return
+    increments = rollup_increments(collection_name, docs, delta)
+    if not increments:
+        return
+
+    from database import get_database
+
+    try:
+        database = await get_database()
+        await _apply_increments(database, collection_name, increments)
+    except Exception as e:
+        logger.warning(f"更新集合 {collection_name} 的按日汇总失败（{len(docs)} 条文档），可重新运行重建脚本修正: {e}")
+
+def upserted_documents(upserted_ids: Dict[int, Any], docs_by_index: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    批量写入中新插入的文档（带上插入时生成的 _id）
+
+    Args:
+        upserted_ids: bulk_write 结果的 upserted_ids（操作序号 -> _id）
+        docs_by_index: 操作序号 -> 该操作保存的文档
+    """
+    return [
+        dict(docs_by_index[index], _id=doc_id)
+        for index, doc_id in upserted_ids.items() if index in docs_by_index
+    ]
+
+def bulk_error_upserted_ids(details: Dict[str, Any]) -> Dict[int, Any]:
+    """BulkWriteError 中已成功插入的操作: 操作序号 -> _id"""
+    return {item["index"]: item["_id"] for item in details.get("upserted", [])}
+
+# 各集合的就绪状态缓存: {集合名: (过期时间, 是否就绪)}
+_ready_cache: Dict[str, Tuple[float, bool]] = {}
+
+async def is_rollup_ready(collection_name: str) -> bool:
+    """集合的按日汇总是否已重建完成（结果缓存一分钟）"""
+    if not ROLLUPS_ENABLED:
+        return False
+    cached = _ready_cache.get(collection_name)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    from database import get_database
+
+    try:
+        database = await get_database()
+        state = await database[ROLLUP_STATE_COLLECTION].find_one({"_id": collection_name})
+        ready = bool(state and state.get("ready") and state.get("version") == ROLLUP_VERSION)
+    except Exception as e:
+        logger.warning(f"读取集合 {collection_name} 的汇总状态失败，本次直接查询原集合: {e}")
+        return False
+    _ready_cache[collection_name] = (time.monotonic() + _READY_CACHE_SECONDS, ready)
+    return ready
+
+async def set_rollup_ready(collection_name: str, ready: bool, groups: int = 0):
+    """记录集合的重建状态（重建开始时置为未就绪，完成后置为就绪）"""
+    from database import get_database
+
+    database = await get_database()
+    await database[ROLLUP_STATE_COLLECTION].update_one(
+        {"_id": collection_name},
+        {"$set": {
+            "ready": ready,
+            "version": ROLLUP_VERSION,
+            "groups": groups,
+            "updatedAt": datetime.utcnow()
+        }},
+        upsert=True
+    )
+    _ready_cache.pop(collection_name, None)
+
+def _day_expression(spec: RollupSpec) -> Dict[str, Any]:
+    """与 document_day 相同规则的聚合表达式"""
+    id_time = {"$convert": {"input": "$_id", "to": "date", "onError": None, "onNull": None}}
+    doc_time: Any = id_time
+    if spec.time_field:
+        field = f"${spec.time_field}"
+        doc_time = {"$cond": [{"$eq": [{"$type": field}, "date"]}, field, id_time]}
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": doc_time}}
+
+def _key_expression(fields: Sequence[str]) -> Any:
+    """与 document_keys 相同规则的聚合表达式（依次取第一个非空字段）"""
+    expression: Any = f"${fields[-1]}"
+    for field in reversed(fields[:-1]):
+        expression = {"$ifNull": [f"${field}", expression]}
+    return expression
+
+async def rebuild_rollups(collection_name: str, batch_size: int = 1000, dry_run: bool = False) -> int:
+    """
+    删除集合的汇总并从原集合重新按日分组计数，完成后标记集合就绪
+
+    重建开始后新写入的文档由上传路径计数，重建只统计开始前插入的文档（按 _id 划分）。
+    分界点与清除汇总之间（通常只有几毫秒）插入的文档，其增量会随汇总一起被清除而少计。
+
+    Returns:
+        汇总文档（分组）数
+    """
+    from database import get_database
+
+    spec = get_rollup_spec(collection_name)
+    if spec is None:
+        raise ValueError(f"集合 {collection_name} 不维护按日汇总")
+
+    database = await get_database()
+    source = database[collection_name]
+    # 先取分界点再清除汇总：清除之后插入的文档由上传路径计数，不会被重建再计一次
+    cutoff = ObjectId.from_datetime(datetime.utcnow())
+    if not dry_run:
+        await set_rollup_ready(collection_name, False)
+        await database[ROLLUP_COLLECTION].delete_many({"collection": collection_name})
+
+    dimensions = {DIMENSION_TOTAL: None, **spec.dimensions}
+    groups = 0
+    for dimension, fields in dimensions.items():
+        key_expression = fields and _key_expression(fields)
+        pipeline = [
+            {"$match": {"$or": [{"_id": {"$lt": cutoff}}, {"_id": {"$not": {"$type": "objectId"}}}]}},
+            {"$project": {"_id": 0, "day": _day_expression(spec), "key": key_expression or ROLLUP_TOTAL_KEY}},
+        ]
+        if key_expression:
+            pipeline.append({"$match": {"key": {"$type": ["string", "number", "bool"], "$ne": ""}}})
+        pipeline.append({"$group": {"_id": {"day": "$day", "key": "$key"}, "count": {"$sum": 1}}})
+
+        totals: Counter = Counter()
+        batch: Counter = Counter()
+        async for row in source.aggregate(pipeline, allowDiskUse=True):
+            day, key = row["_id"].get("day"), row["_id"]["key"]
+            totals[key] += row["count"]
+            if day is not None:
+                batch[(dimension, day, key)] += row["count"]
+            if len(batch) >= batch_size:
+                groups += len(batch)
+                if not dry_run:
+                    await _apply_increments(database, collection_name, batch)
+                batch = Counter()
+        batch.update({(dimension, ROLLUP_ALL_DAYS, key): count for key, count in totals.items()})
+        groups += len(batch)
+        if not dry_run:
+            await _apply_increments(database, collection_name, batch)
+        logger.info(f"{collection_name}.{dimension}: {len(totals)} 个键")
+
+    if not dry_run:
+        await set_rollup_ready(collection_name, True, groups=groups)
+    return groups
+
+def _period_days(now: datetime) -> Dict[str, List[str]]:
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        name: [_day(today - timedelta(days=offset)) for offset in range(end, start + 1)]
+        for name, start, end in STAT_PERIODS
+    }
+
+async def _read_rollup_stats(
+    database,
+    collection_name: str,
+    top: Dict[str, Optional[int]],
+    now: datetime
+) -> Dict[str, Any]:
+    rollups = database[ROLLUP_COLLECTION]
+    periods = _period_days(now)
+    days = sorted({day for period_days in periods.values() for day in period_days})
+
+    # 一次查询读取累计总数和最近 30 天每天的新增数
+    counts = {
+        doc["day"]: doc["count"]
+        async for doc in rollups.find(
+            {"collection": collection_name, "dimension": DIMENSION_TOTAL, "day": {"$in": days + [ROLLUP_ALL_DAYS]}},
+            {"_id": 0, "day": 1, "count": 1}
+        )
+    }
+    ranked: Dict[str, List[Dict[str, Any]]] = {}
+    for dimension, limit in top.items():
+        cursor = rollups.find(
+            {"collection": collection_name, "dimension": dimension, "day": ROLLUP_ALL_DAYS, "count": {"$gt": 0}},
+            {"_id": 0, "key": 1, "count": 1}
+        ).sort("count", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        ranked[dimension] = [{"key": doc["key"], "count": doc["count"]} async for doc in cursor]
+
+    return {
+        "total": counts.get(ROLLUP_ALL_DAYS, 0),
+        "period": {name: sum(counts.get(day, 0) for day in period_days) for name, period_days in periods.items()},
+        "top": ranked,
+        "source": "rollup"
+    }
+
+async def _read_live_stats(
+    database,
+    spec: RollupSpec,
+    top: Dict[str, Optional[int]],
+    now: datetime
+) -> Dict[str, Any]:
+    """汇总未就绪时直接查询原集合（与汇总相同的日期和维度规则）"""
+    collection = database[spec.collection]
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def since(start: datetime) -> Dict[str, Any]:
+        if spec.time_field:
+            return {spec.time_field: {"$gte": start}}
+        return {"_id": {"$gte": ObjectId.from_datetime(start)}}
+
+    period = {}
+    for name, start, end in STAT_PERIODS:
+        query = since(today - timedelta(days=start))
+        if end:
+            upper = today - timedelta(days=end - 1)
+            bound = spec.time_field or "_id"
+            query[bound]["$lt"] = upper if spec.time_field else ObjectId.from_datetime(upper)
+        period[name] = await collection.count_documents(query)
+
+    ranked: Dict[str, List[Dict[str, Any]]] = {}
+    for dimension, limit in top.items():
+        pipeline: List[Dict[str, Any]] = [
+            {"$project": {"_id": 0, "key": _key_expression(spec.dimensions[dimension])}},
+            {"$match": {"key": {"$type": ["string", "number", "bool"], "$ne": ""}}},
+            {"$group": {"_id": "$key", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ]
+        if limit:
+            pipeline.append({"$limit": limit})
+        ranked[dimension] = [
+            {"key": row["_id"], "count": row["count"]}
+            async for row in collection.aggregate(pipeline)
+        ]
+
+    return {
+        "total": await collection.estimated_document_count(),
+        "period": period,
+        "top": ranked,
+        "source": "collection"
+    }
+
+async def read_stats(
+    database,
+    collection_name: str,
+    top: Optional[Dict[str, Optional[int]]] = None,
+    now: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """
+    读取集合的统计数据
+
+    Args:
+        top: 需要排行的维度 -> 条数（None 表示全部）
+
+    Returns:
+        {"total": 累计总数, "period": {today, yesterday, week, month},
+         "top": {维度: [{"key", "count"}]}, "source": "rollup" 或 "collection"}
+    """
+    spec = get_rollup_spec(collection_name)
+    if spec is None:
+        raise ValueError(f"集合 {collection_name} 不维护按日汇总")
+    top = top or {}
+    now = now or datetime.utcnow()
+    if await is_rollup_ready(collection_name):
+        return await _read_rollup_stats(database, collection_name, top, now)
+    return await _read_live_stats(database, spec, top, now)
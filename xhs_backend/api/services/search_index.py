@@ -0,0 +1,244 @@
+"""
+关键字搜索倒排索引
+
+列表接口的关键字过滤是对两三个字段的无锚点、不区分大小写的 $regex，每次搜索都要扫描整个集合；
+MongoDB 的 $text 不会切分中文。这里在写入时把可搜索字段切分成二元组（相邻两个字符，小写），
+存入文档的 searchTokens 数组并建立多键索引：
+1. 查询时要求文档包含关键字的全部二元组（$all，走索引），原有的 $regex 条件保留，
+   因此结果与原来完全一致，只是候选文档从整个集合缩小到包含这些二元组的文档
+2. 单字关键字没有二元组，含正则元字符的关键字无法按字面切分，这两种情况只使用 $regex
+3. 有关键字时结果按匹配次数（关键字在各字段中出现的总次数）降序、再按时间倒序排列
+
+旧文档需要先用 migrations/build_search_index.py 回填 searchTokens，回填完成后该集合被标记为
+就绪，此后查询才使用二元组过滤（未就绪时只用 $regex，避免漏掉尚未回填的文档）。
+写入路径和回填脚本都用 $addToSet 追加二元组（回填与并发写入交错时不会覆盖对方追加的内容），
+文本变化后旧的二元组不删除：多余的二元组只会让候选集略大，不影响结果。
+集合中的文档若由其他程序写入，写入方需同样维护 searchTokens。
+"""
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_ENABLED = os.environ.get("SEARCH_INDEX_ENABLED", "true").lower() == "true"
+SEARCH_QUERY_MAX_TOKENS = int(os.environ.get("SEARCH_QUERY_MAX_TOKENS", 16))  # 单次查询最多使用的二元组数
+SEARCH_TOKENS_FIELD = "searchTokens"
+SEARCH_INDEX_STATE_COLLECTION = "search_index_state"
+SEARCH_INDEX_VERSION = 1  # 切分规则变化时递增，旧版本的就绪标记失效，需要重新回填
+_READY_CACHE_SECONDS = 60
+
+# 列表接口返回文档时不需要二元组
+HIDE_SEARCH_TOKENS = {SEARCH_TOKENS_FIELD: 0}
+
+_REGEX_SPECIAL_CHARS = set(".^$*+?()[]{}|\\")
+
+def _search_field_map() -> Dict[str, Tuple[str, ...]]:
+    """维护 searchTokens 的集合及其可搜索字段（各列表接口关键字过滤字段的并集）"""
+    from database import (
+        COMMENTS_COLLECTION, NOTES_COLLECTION, NOTE_DETAILS_COLLECTION,
+        NOTIFICATIONS_COLLECTION, USER_INFO_COLLECTION
+    )
+
+    return {
+        COMMENTS_COLLECTION: ("content", "user_name"),
+        NOTES_COLLECTION: ("title", "content", "noteContent", "user.nickname"),
+        NOTE_DETAILS_COLLECTION: ("title", "desc", "user.nickname"),
+        NOTIFICATIONS_COLLECTION: ("content", "title", "username"),
+        USER_INFO_COLLECTION: ("id", "name"),
+    }
+
+def search_fields(collection_name: str) -> Tuple[str, ...]:
+    """集合中参与关键字搜索的字段"""
+    return _search_field_map().get(collection_name, ())
+
+def searchable_collections() -> List[str]:
+    """维护 searchTokens 的集合"""
+    return list(_search_field_map())
+
+def text_bigrams(text: str) -> Set[str]:
+    """文本的二元组集合（小写）"""
+    text = text.lower()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def _get_field(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def build_search_tokens(collection_name: str, doc: Dict[str, Any]) -> List[str]:
+    """文档可搜索字段的二元组（排序后的列表）"""
+    tokens: Set[str] = set()
+    for field in search_fields(collection_name):
+        value = _get_field(doc, field)
+        if isinstance(value, str):
+            tokens |= text_bigrams(value)
+    return sorted(tokens)
+
+def search_tokens_update(collection_name: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """写入文档时追加其二元组的更新片段（合并到 UpdateOne 的更新文档中），没有可搜索文本时为空"""
+    tokens = build_search_tokens(collection_name, doc)
+    if not tokens:
+        return {}
+    return {"$addToSet": {SEARCH_TOKENS_FIELD: {"$each": tokens}}}
+
+def keyword_bigrams(keyword: str) -> Optional[List[str]]:
+    """
+    关键字的二元组，按在关键字中出现的顺序排列
+
+    单字关键字或含正则元字符的关键字返回 None（只能使用 $regex）
+    """
+    if len(keyword) < 2 or any(char in _REGEX_SPECIAL_CHARS for char in keyword):
+        return None
+    # 与 text_bigrams 一样先转小写再切分
+    keyword = keyword.lower()
+    return list(dict.fromkeys(keyword[i:i + 2] for i in range(len(keyword) - 1)))
+
+def _limit_tokens(tokens: List[str], limit: int) -> List[str]:
+    """二元组太多时均匀抽取 limit 个（$all 只用第一个二元组走索引，其余逐个过滤）"""
+    if len(tokens) <= limit:
+        return tokens
+    step = len(tokens) / limit
+    return [tokens[int(i * step)] for i in range(limit)]
+
+def _match_count_expression(field: str, keyword: str) -> Dict[str, Any]:
+    """关键字在字段中出现次数的聚合表达式（非字符串字段为 0）"""
+    return {"$size": {"$regexFindAll": {
+        "input": {"$cond": [{"$eq": [{"$type": f"${field}"}, "string"]}, f"${field}", ""]},
+        "regex": keyword,
+        "options": "i"
+    }}}
+
+class KeywordSearch:
+    """
+    一次列表查询的关键字条件
+
+    用法：
+        search = KeywordSearch(COMMENTS_COLLECTION)
+        if keyword:
+            query.update(search.match(("content", "user_name"), keyword))
+        await search.apply(query)
+        docs, next_cursor = await find_page(..., score=search.score())
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self._tokens: List[str] = []
+        self._terms: List[Tuple[str, str]] = []
+
+    def match(self, fields: Sequence[str], keyword: str) -> Dict[str, Any]:
+        """
+        字段包含关键字（不区分大小写的正则，与原有过滤语义相同）的查询条件
+
+        多个字段时返回 {"$or": [...]}，单个字段时返回 {字段: 条件}
+        """
+        conditions = [{field: {"$regex": keyword, "$options": "i"}} for field in fields]
+        self._terms.extend((field, keyword) for field in fields)
+
+        tokens = keyword_bigrams(keyword)
+        if tokens and set(fields) <= set(search_fields(self.collection_name)):
+            self._tokens.extend(token for token in tokens if token not in self._tokens)
+        return {"$or": conditions} if len(conditions) > 1 else conditions[0]
+
+    async def apply(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        """集合的二元组索引就绪时，在查询中加入 searchTokens 过滤"""
+        if self._tokens and await is_search_index_ready(self.collection_name):
+            query[SEARCH_TOKENS_FIELD] = {"$all": _limit_tokens(self._tokens, SEARCH_QUERY_MAX_TOKENS)}
+        return query
+
+    def score(self) -> Optional[Dict[str, Any]]:
+        """排序用的匹配次数表达式，没有关键字时为 None（按时间排序）"""
+        if not self._terms:
+            return None
+        expressions = [_match_count_expression(field, keyword) for field, keyword in self._terms]
+        return expressions[0] if len(expressions) == 1 else {"$add": expressions}
+
+# 各集合的就绪状态缓存: {集合名: (过期时间, 是否就绪)}
+_ready_cache: Dict[str, Tuple[float, bool]] = {}
+
+async def is_search_index_ready(collection_name: str) -> bool:
+    """集合的 searchTokens 是否已回填完成（结果缓存一分钟）"""
+    if not SEARCH_INDEX_ENABLED:
+        return False
+    cached = _ready_cache.get(collection_name)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    from database import get_database
+
+    try:
+        database = await get_database()
+        state = await database[SEARCH_INDEX_STATE_COLLECTION].find_one({"_id": collection_name})
+        ready = bool(state and state.get("ready") and state.get("version") == SEARCH_INDEX_VERSION)
+    except Exception as e:
+        logger.warning(f"读取集合 {collection_name} 的搜索索引状态失败，本次只使用正则过滤: {e}")
+        return False
+    _ready_cache[collection_name] = (time.monotonic() + _READY_CACHE_SECONDS, ready)
+    return ready
+
+async def set_search_index_ready(collection_name: str, ready: bool, documents: int = 0):
+    """记录集合的回填状态（回填开始时置为未就绪，完成后置为就绪）"""
+    from database import get_database
+
+    database = await get_database()
+    await database[SEARCH_INDEX_STATE_COLLECTION].update_one(
+        {"_id": collection_name},
+        {"$set": {
+            "ready": ready,
+            "version": SEARCH_INDEX_VERSION,
+            "documents": documents,
+            "updatedAt": datetime.utcnow()
+        }},
+        upsert=True
+    )
+    _ready_cache.pop(collection_name, None)
+
+async def backfill_search_tokens(
+    collection_name: str,
+    batch_size: int = 500,
+    dry_run: bool = False,
+    on_progress: Optional[Callable[[str, int], None]] = None
+) -> int:
+    """
+    为集合中所有文档追加当前内容的 searchTokens，完成后标记集合就绪
+
+    Returns:
+        处理的文档数
+    """
+    import pymongo
+    from database import get_database
+
+    database = await get_database()
+    collection = database[collection_name]
+    fields = search_fields(collection_name)
+    projection = {field: 1 for field in fields}
+
+    if not dry_run:
+        # 旧文档回填完成前查询只使用正则过滤
+        await set_search_index_ready(collection_name, False)
+
+    processed = 0
+    operations: List[Any] = []
+    async for doc in collection.find({}, projection).sort("_id", 1).batch_size(batch_size):
+        processed += 1
+        update = search_tokens_update(collection_name, doc)
+        if update:
+            operations.append(pymongo.UpdateOne({"_id": doc["_id"]}, update))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                await collection.bulk_write(operations, ordered=False)
+            operations = []
+            if on_progress is not None:
+                on_progress(collection_name, processed)
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+
+    if not dry_run:
+        await set_search_index_ready(collection_name, True, documents=processed)
+    return processed
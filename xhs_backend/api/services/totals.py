@@ -0,0 +1,134 @@
+"""
+列表总数统计
+
+列表接口每次翻页都对同一查询条件执行 count_documents，关键字（正则）过滤时每次都要全表扫描。
+这里按客户端要求的方式（total=exact|estimate|none）计算总数：
+1. 无过滤条件时使用 estimated_document_count（读取集合元数据，不扫描文档）
+2. 有过滤条件时精确计数，结果按 (集合, 规范化的查询条件) 缓存一段时间，
+   上传写入对应集合后清除该集合的缓存
+3. estimate 模式最多计数到 TOTALS_ESTIMATE_LIMIT 条，超过时返回该上限（不精确）
+
+缓存在进程内，其他 worker 的写入只能等缓存过期后反映（最长 TOTALS_CACHE_TTL_SECONDS 秒）。
+因此"精确"指计数时精确：缓存的计数在 TTL 内可能还不包含其他 worker 随后的写入。
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from bson import json_util
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+TOTAL_MODES = ("exact", "estimate", "none")
+TOTAL_MODE_PATTERN = "^(exact|estimate|none)$"
+TOTALS_DEFAULT_MODE = os.environ.get("TOTALS_DEFAULT_MODE", "exact").lower()
+TOTALS_CACHE_TTL_SECONDS = int(os.environ.get("TOTALS_CACHE_TTL_SECONDS", 30))  # 精确计数的缓存时间
+TOTALS_CACHE_MAX_ENTRIES = int(os.environ.get("TOTALS_CACHE_MAX_ENTRIES", 2000))
+TOTALS_ESTIMATE_LIMIT = int(os.environ.get("TOTALS_ESTIMATE_LIMIT", 10000))  # estimate 模式的计数上限
+
+if TOTALS_DEFAULT_MODE not in TOTAL_MODES:
+    logger.warning(f"无效的 TOTALS_DEFAULT_MODE: {TOTALS_DEFAULT_MODE}，使用 exact")
+    TOTALS_DEFAULT_MODE = "exact"
+
+def normalize_query(query: Dict[str, Any]) -> str:
+    """查询条件的规范化表示（键排序），作为缓存键"""
+    return json_util.dumps(query, sort_keys=True)
+
+class TotalCounter:
+    """按模式计算列表总数，精确计数结果带TTL缓存"""
+
+    def __init__(
+        self,
+        ttl_seconds: int = TOTALS_CACHE_TTL_SECONDS,
+        max_entries: int = TOTALS_CACHE_MAX_ENTRIES,
+        estimate_limit: int = TOTALS_ESTIMATE_LIMIT
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.estimate_limit = estimate_limit
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int]]" = OrderedDict()
+        # 每个集合的写入代数：计数期间集合被写入时不缓存该次结果
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.estimated = 0
+        self.invalidations = 0
+
+    async def count(self, collection, query: Dict[str, Any], mode: str = TOTALS_DEFAULT_MODE) -> Tuple[Optional[int], bool]:
+        """
+        计算查询条件匹配的文档数
+
+        Returns:
+            (总数, 是否精确)。mode 为 none 时返回 (None, False)；
+            精确计数可能来自缓存，在 TTL 内不反映其他 worker 的写入
+        """
+        if mode == "none":
+            return None, False
+        if not query:
+            self.estimated += 1
+            return await collection.estimated_document_count(), False
+
+        key = (collection.name, normalize_query(query))
+        cached = self._get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached, True
+
+        self.misses += 1
+        generation = self._generations.get(collection.name, 0)
+        if mode == "estimate":
+            total = await collection.count_documents(query, limit=self.estimate_limit)
+            if total >= self.estimate_limit:
+                return total, False
+        else:
+            total = await collection.count_documents(query)
+
+        if self._generations.get(collection.name, 0) == generation:
+            self._set(key, total)
+        return total, True
+
+    def invalidate(self, *collection_names: str):
+        """清除集合的计数缓存（写入后调用）"""
+        names = set(collection_names)
+        for name in names:
+            self._generations[name] = self._generations.get(name, 0) + 1
+        stale = [key for key in self._entries if key[0] in names]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            self.invalidations += len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "default_mode": TOTALS_DEFAULT_MODE,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "estimated": self.estimated,
+            "invalidations": self.invalidations
+        }
+
+    def _get(self, key: Tuple[str, str]) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, total = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return total
+
+    def _set(self, key: Tuple[str, str], total: int):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, total)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+# 全局总数计数器（保存函数写入后清除对应集合的缓存）
+total_counter = TotalCounter()
@@ -0,0 +1,116 @@
+"""
+上传数据解码服务
+
+插件捕获的响应体通常有几百KB。普通上传接口把响应体作为字符串嵌在JSON信封中，
+信封解码后解析器还要再对字符串做一次 json.loads。这里提供只解码一次的上传格式，
+并在 orjson 可用时使用它解码
+"""
+import json
+import logging
+from typing import Any, Optional, Tuple, Union
+
+from pydantic import ValidationError
+
+from ..models.network import RawNetworkData
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，不可用时退回标准库
+    orjson = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 单次解码上传格式中的字段/表单部分名称
+EMBEDDED_RESPONSE_FIELD = "response_json"  # application/json：信封中以JSON对象形式内嵌的响应
+MULTIPART_META_PART = "meta"  # multipart/form-data：不含响应体的信封JSON
+MULTIPART_RESPONSE_PART = "response"  # multipart/form-data：原始响应字节
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """解码JSON（优先使用 orjson）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj: Any) -> bytes:
+    """编码为JSON字节（优先使用 orjson）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _build_raw_data(envelope: Any) -> RawNetworkData:
+    if not isinstance(envelope, dict):
+        raise ValueError("上传信封必须是JSON对象")
+    # 响应体由调用方单独传递，信封中的字符串响应体被忽略
+    envelope.pop("response_body", None)
+    try:
+        return RawNetworkData(**envelope)
+    except ValidationError as e:
+        raise ValueError(f"上传信封格式错误: {e}") from e
+
+def decode_embedded_upload(payload: bytes) -> Tuple[RawNetworkData, Any, bytes]:
+    """
+    解码 application/json 格式的单次解码上传
+
+    Returns:
+        (信封, 已解码的响应JSON, 响应体字节)。响应体字节用于归档，由已解码的对象重新编码得到，
+        因此归档中保存的是重新编码的JSON而不是插件抓到的原始字节
+        （去重指纹在各上传格式中都按重新编码的JSON计算，这份字节可直接作为指纹输入，
+        见 NetworkDataProcessor.parse_raw_data 的 canonical_body 参数）
+
+    Raises:
+        ValueError: 格式错误
+    """
+    try:
+        envelope = loads(payload)
+    except ValueError as e:
+        raise ValueError(f"JSON解析失败: {e}") from e
+    if not isinstance(envelope, dict) or envelope.get(EMBEDDED_RESPONSE_FIELD) is None:
+        raise ValueError(f"缺少 {EMBEDDED_RESPONSE_FIELD} 字段")
+
+    return decode_upload_envelope(envelope)
+
+def decode_upload_envelope(envelope: Any) -> Tuple[RawNetworkData, Optional[Any], Optional[bytes]]:
+    """
+    从已解码的信封构建上传数据，两种格式均可：响应以JSON对象内嵌在 response_json 字段中
+    （响应体字节为重新编码的JSON，归档中保存的是这份字节），
+    或以字符串放在 response_body 字段中（此时返回的响应JSON和响应体字节为 None，由处理器解码）
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if isinstance(envelope, dict) and envelope.get(EMBEDDED_RESPONSE_FIELD) is not None:
+        response_json = envelope.pop(EMBEDDED_RESPONSE_FIELD)
+        return _build_raw_data(envelope), response_json, dumps(response_json)
+
+    if not isinstance(envelope, dict):
+        raise ValueError("上传信封必须是JSON对象")
+    try:
+        return RawNetworkData(**envelope), None, None
+    except ValidationError as e:
+        raise ValueError(f"上传信封格式错误: {e}") from e
+
+def decode_multipart_upload(meta: Union[str, bytes], response: bytes) -> Tuple[RawNetworkData, Any, bytes]:
+    """
+    解码 multipart/form-data 格式的单次解码上传（信封与原始响应字节分开传递）
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if not response:
+        raise ValueError(f"缺少 {MULTIPART_RESPONSE_PART} 部分")
+    try:
+        envelope = loads(meta)
+    except ValueError as e:
+        raise ValueError(f"{MULTIPART_META_PART} 部分JSON解析失败: {e}") from e
+    try:
+        response_json = loads(response)
+    except ValueError as e:
+        raise ValueError(f"响应体JSON解析失败: {e}") from e
+    return _build_raw_data(envelope), response_json, response
+
+def decode_response_body(raw_data: RawNetworkData) -> Optional[Any]:
+    """解码普通上传中以字符串形式嵌入的响应体"""
+    if not raw_data.response_body:
+        return None
+    return loads(raw_data.response_body)
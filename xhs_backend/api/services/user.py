@@ -3,13 +3,20 @@
 
 提供用户账户管理相关的业务逻辑功能
 """
+import hashlib
 import logging
 import bcrypt
 import pyotp
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+import pymongo
+from fastapi import HTTPException
 
 from ..models.user import User, UserInRegister, TokenResponse
+from .entity_merge import ENTITY_USERS, merge_entity_list
+from .query_cache import query_cache, write_tags
+from .search_index import HIDE_SEARCH_TOKENS, KeywordSearch, search_tokens_update
+from .totals import total_counter
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -84,7 +91,7 @@ async def get_user_info(user_id: str) -> Optional[Dict[str, Any]]:
         collection = db[USER_INFO_COLLECTION]
         
         # 查询用户信息
-        user_info = await collection.find_one({"id": user_id})
+        user_info = await collection.find_one({"id": user_id}, HIDE_SEARCH_TOKENS)
         
         # 处理结果（特别是将_id转换为字符串）
         if user_info and '_id' in user_info:
@@ -110,7 +117,7 @@ async def batch_get_user_info(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         
         # 构建批量查询
         query = {"id": {"$in": user_ids}}
-        user_infos = await collection.find(query).to_list(length=None)
+        user_infos = await collection.find(query, HIDE_SEARCH_TOKENS).to_list(length=None)
         
         # 构建结果映射
         result = {}
@@ -126,20 +133,42 @@ async def batch_get_user_info(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         logger.exception(f"批量获取用户信息时出错: {e}")
         return {}
 
-async def get_all_user_info_paginated(page: int = 1, page_size: int = 10) -> Dict[str, Any]:
-    """分页获取所有小红书用户信息"""
+async def get_all_user_info_paginated(
+    page: int = 1,
+    page_size: int = 10,
+    cursor: Optional[str] = None,
+    query: Optional[Dict[str, Any]] = None,
+    total_mode: Optional[str] = None,
+    search: Optional[KeywordSearch] = None
+) -> Dict[str, Any]:
+    """
+    分页获取小红书用户信息（按 updatedAt 倒序）
+
+    提供 cursor（上一页返回的 next_cursor）时按游标翻页，不计算总数；
+    total_mode 为总数计算方式（exact/estimate/none，见 totals.py），默认为 TOTALS_DEFAULT_MODE；
+    search 为构建 query 时使用的关键字条件，有关键字时按匹配次数和更新时间排序
+    """
     # 在函数内部导入模块
     from database import get_database, USER_INFO_COLLECTION
+    from .pagination import find_page
+    from .totals import total_counter, TOTALS_DEFAULT_MODE
     
     try:
         db = await get_database()
         collection = db[USER_INFO_COLLECTION]
+        query = query or {}
+        score = None
+        if search is not None:
+            await search.apply(query)
+            score = search.score()
 
-        skip = (page - 1) * page_size
-        total = await collection.count_documents({})
-        
-        cursor = collection.find().skip(skip).limit(page_size).sort("updatedAt", -1)
-        users = await cursor.to_list(length=page_size)
+        total, total_exact = await total_counter.count(
+            collection, query, "none" if cursor else (total_mode or TOTALS_DEFAULT_MODE)
+        )
+        users, next_cursor = await find_page(
+            collection, query, "updatedAt", page_size, cursor=cursor, page=page,
+            projection=HIDE_SEARCH_TOKENS, score=score
+        )
 
         # 处理结果（特别是将_id转换为字符串）
         for user in users:
@@ -153,54 +182,137 @@ async def get_all_user_info_paginated(page: int = 1, page_size: int = 10) -> Dic
         return {
             "items": users,
             "total": total,
+            "total_exact": total_exact,
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"分页获取用户信息时出错: {e}")
         return {
             "items": [],
             "total": 0,
+            "total_exact": False,
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": None,
+            "has_more": False
         }
 
+# 判断用户信息是否变化时比较的字段
+USER_FINGERPRINT_FIELDS = ("name", "avatar", "official_verify_type", "red_official_verify_type", "indicator")
+
+# 进程内累计的用户信息写入计数（unchanged 为被跳过的无变化写入）
+user_info_write_stats = {"created": 0, "updated": 0, "unchanged": 0}
+
+def compute_user_fingerprint(user_info: Dict[str, Any]) -> str:
+    """计算用户有意义字段的指纹"""
+    values = "\x1f".join("" if user_info.get(field) is None else str(user_info.get(field)) for field in USER_FINGERPRINT_FIELDS)
+    return hashlib.sha1(values.encode("utf-8")).hexdigest()
+
 async def save_user_info(user_info: Dict[str, Any]) -> Dict[str, Any]:
     """保存或更新小红书用户信息"""
-    # 在函数内部导入模块
-    from database import get_database, USER_INFO_COLLECTION
-    
-    user_id = user_info.get("id")
-    if not user_id:
+    if not user_info.get("id"):
         logger.warning("尝试保存用户信息时缺少id字段")
         return {"success": False, "message": "用户信息缺少id字段"}
-    
+
+    result = await save_user_infos([user_info])
+    if not result["success"]:
+        return {"success": False, "message": f"保存用户信息时出错: {result.get('error') or '写入失败'}"}
+    if result["created"]:
+        return {"success": True, "message": "用户信息已创建", "action": "created"}
+    if result["updated"]:
+        return {"success": True, "message": "用户信息已更新", "action": "updated"}
+    return {"success": True, "message": "用户信息无变化", "action": "no_change"}
+
+async def save_user_infos(user_infos: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    批量保存或更新小红书用户信息
+
+    一次 $in 查询读取已有用户的有意义字段，只有指纹（昵称、头像、认证类型、标识）
+    发生变化或新出现的用户才写入，所有写入合并为一次无序批量写入。
+    传入为 None 的字段不会覆盖已有值，createdAt 只在创建时写入。
+
+    Returns:
+        created/updated/unchanged 计数，用于衡量写放大
+    """
+    # 在函数内部导入模块
+    from database import get_database, USER_INFO_COLLECTION
+
+    users = []
+    for user_info in merge_entity_list(ENTITY_USERS, user_infos):
+        if not user_info.get("id"):
+            logger.warning("批量保存用户信息时跳过缺少id字段的用户")
+            continue
+        users.append(user_info)
+
+    if not users:
+        return {"success": True, "created": 0, "updated": 0, "unchanged": 0, "failed_ids": []}
+
+    user_ids = [user_info["id"] for user_info in users]
     try:
-        # 获取数据库集合
         db = await get_database()
         collection = db[USER_INFO_COLLECTION]
-        
-        # 更新时间戳
-        user_info["updatedAt"] = datetime.utcnow()
-        if "createdAt" not in user_info:
-            user_info["createdAt"] = user_info["updatedAt"]
-        
-        # 使用upsert确保创建或更新
-        result = await collection.update_one(
+        projection = {field: 1 for field in USER_FINGERPRINT_FIELDS}
+        projection.update({"id": 1, "_id": 0})
+        existing = {
+            doc["id"]: doc
+            async for doc in collection.find({"id": {"$in": user_ids}}, projection)
+        }
+    except Exception as e:
+        logger.exception(f"批量读取用户信息时出错: {e}")
+        return {"success": False, "created": 0, "updated": 0, "unchanged": 0, "failed_ids": user_ids, "error": str(e)}
+
+    bulk_operations = []
+    operation_user_ids = []
+    unchanged = 0
+    now = datetime.utcnow()
+    for user_info in users:
+        user_id = user_info["id"]
+        fields = {
+            key: value for key, value in user_info.items()
+            if value is not None and key not in ("_id", "createdAt", "updatedAt")
+        }
+        current = existing.get(user_id)
+        if current is not None:
+            merged = dict(current)
+            merged.update(fields)
+            if compute_user_fingerprint(merged) == compute_user_fingerprint(current):
+                unchanged += 1
+                continue
+
+        fields["updatedAt"] = now
+        bulk_operations.append(pymongo.UpdateOne(
             {"id": user_id},
-            {"$set": user_info},
+            {"$set": fields, "$setOnInsert": {"createdAt": now}, **search_tokens_update(USER_INFO_COLLECTION, fields)},
             upsert=True
-        )
-        
-        if result.modified_count > 0:
-            logger.info(f"更新用户信息: id={user_id}")
-            return {"success": True, "message": "用户信息已更新", "action": "updated"}
-        elif result.upserted_id:
-            logger.info(f"创建用户信息: id={user_id}")
-            return {"success": True, "message": "用户信息已创建", "action": "created"}
-        else:
-            logger.info(f"用户信息无变化: id={user_id}")
-            return {"success": True, "message": "用户信息无变化", "action": "no_change"}
+        ))
+        operation_user_ids.append(user_id)
+
+    user_info_write_stats["unchanged"] += unchanged
+    if not bulk_operations:
+        logger.debug("用户信息批量保存: %d 个用户无变化，跳过写入", unchanged)
+        return {"success": True, "created": 0, "updated": 0, "unchanged": unchanged, "failed_ids": []}
+
+    try:
+        result = await collection.bulk_write(bulk_operations, ordered=False)
+        created, updated, failed_ids = result.upserted_count, result.modified_count, []
+    except pymongo.errors.BulkWriteError as bwe:
+        logger.error(f"批量保存用户信息时部分写入失败: {bwe.details.get('writeErrors')}")
+        created = bwe.details.get("nUpserted", 0)
+        updated = bwe.details.get("nModified", 0)
+        failed_ids = [operation_user_ids[error["index"]] for error in bwe.details.get("writeErrors", [])]
     except Exception as e:
-        logger.exception(f"保存用户信息时出错: {e}")
-        return {"success": False, "message": f"保存用户信息时出错: {str(e)}"} 
\ No newline at end of file
+        logger.exception(f"批量保存用户信息时出错: {e}")
+        return {"success": False, "created": 0, "updated": 0, "unchanged": unchanged, "failed_ids": operation_user_ids, "error": str(e)}
+    finally:
+        total_counter.invalidate(USER_INFO_COLLECTION)
+        await query_cache.invalidate(*write_tags(USER_INFO_COLLECTION, user=operation_user_ids))
+
+    user_info_write_stats["created"] += created
+    user_info_write_stats["updated"] += updated
+    logger.info("用户信息批量保存完成。创建: %d, 更新: %d, 无变化: %d, 失败: %d", created, updated, unchanged, len(failed_ids))
+    return {"success": not failed_ids, "created": created, "updated": updated, "unchanged": unchanged, "failed_ids": failed_ids}
@@ -6,11 +6,21 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Dict, Any, List, Optional
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from database import get_database, COMMENTS_COLLECTION, STRUCTURED_COMMENTS_COLLECTION
 from api.deps import get_current_user
 from api.services.comment import get_user_historical_comments
+from api.services.pagination import find_page
+from api.services.query_cache import (
+    cached_query, collection_tag, stats_tag, query_cache, write_tags,
+    QUERY_CACHE_STATS_TTL_SECONDS, QUERY_CACHE_USER_HISTORY_TTL_SECONDS
+)
+from api.services.rollups import (
+    read_stats, record_documents, DIMENSION_NOTE, DIMENSION_AUTHOR, DIMENSION_IP_LOCATION
+)
+from api.services.search_index import KeywordSearch, HIDE_SEARCH_TOKENS
+from api.services.totals import total_counter, TOTALS_DEFAULT_MODE, TOTAL_MODE_PATTERN
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -19,9 +29,13 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("", summary="查询评论")
+@cached_query("comments.list", [collection_tag(COMMENTS_COLLECTION)])
 async def get_comments(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），提供时忽略 page"),
+    total_mode: str = Query(TOTALS_DEFAULT_MODE, alias="total", pattern=TOTAL_MODE_PATTERN,
+                            description="总数计算方式: exact（精确，短时缓存）、estimate（估算）、none（不计算）"),
     keyword: Optional[str] = Query(None, description="关键字搜索"),
     note_id: Optional[str] = Query(None, description="笔记ID"),
     start_date: Optional[str] = Query(None, description="开始日期 YYYY-MM-DD"),
@@ -32,19 +46,20 @@ async def get_comments(
     """
     查询评论数据
     
-    支持分页、关键字搜索、按笔记ID过滤、按日期范围过滤
+    支持分页、关键字搜索、按笔记ID过滤、按日期范围过滤。
+    有关键字时按匹配次数和抓取时间排序，否则按抓取时间倒序。
+    按 `next_cursor` 翻页时任意深度的页面耗时相同（此时不计算总数）。
+    响应中的 `total_exact` 表示总数是否精确。
     """
     try:
         collection = db[COMMENTS_COLLECTION]
         
         # 构建查询条件
         query = {}
+        search = KeywordSearch(COMMENTS_COLLECTION)
         
         if keyword:
-            query["$or"] = [
-                {"content": {"$regex": keyword, "$options": "i"}},
-                {"user_name": {"$regex": keyword, "$options": "i"}}
-            ]
+            query.update(search.match(("content", "user_name"), keyword))
         
         if note_id:
             query["note_id"] = note_id
@@ -63,30 +78,32 @@ async def get_comments(
                     detail="日期格式错误，请使用 YYYY-MM-DD 格式"
                 )
         
-        # 计算分页
-        skip = (page - 1) * page_size
+        # 二元组索引就绪时用其缩小候选范围
+        await search.apply(query)
         
-        # 查询数据
-        cursor = collection.find(query).sort("fetch_time", -1).skip(skip).limit(page_size)
-        comments_list = []
-        
-        # 使用异步方式获取文档列表
-        comments_list = await cursor.to_list(length=page_size)
+        # 查询数据（按 fetch_time 倒序，_id 保证顺序稳定）
+        comments_list, next_cursor = await find_page(
+            collection, query, "fetch_time", page_size, cursor=cursor, page=page,
+            projection=HIDE_SEARCH_TOKENS, score=search.score()
+        )
         
         # 转换ObjectId为字符串
         for doc in comments_list:
             doc['_id'] = str(doc['_id'])
         
-        # 获取总数
-        total = await collection.count_documents(query)
+        # 获取总数（游标翻页时不计算）
+        total, total_exact = await total_counter.count(collection, query, "none" if cursor else total_mode)
         
         return {
             "success": True,
             "items": comments_list,
             "total": total,
+            "total_exact": total_exact,
             "page": page,
             "page_size": page_size,
-            "total_pages": (total + page_size - 1) // page_size,
+            "total_pages": (total + page_size - 1) // page_size if total is not None else None,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
             "message": f"成功获取 {len(comments_list)} 条评论数据"
         }
         
@@ -100,6 +117,8 @@ async def get_comments(
         )
 
 @router.get("/stats", summary="评论统计")
+@cached_query("comments.stats", [stats_tag(COMMENTS_COLLECTION), stats_tag(STRUCTURED_COMMENTS_COLLECTION)],
+              ttl_seconds=QUERY_CACHE_STATS_TTL_SECONDS)
 async def get_comments_stats(
     current_user: str = Depends(get_current_user),
     db=Depends(get_database)
@@ -108,62 +127,29 @@ async def get_comments_stats(
     获取评论统计信息
     """
     try:
-        collection = db[COMMENTS_COLLECTION]
-        structured_collection = db[STRUCTURED_COMMENTS_COLLECTION]
-        
-        # 基础统计
-        total_comments = await collection.count_documents({})
-        structured_comments = await structured_collection.count_documents({})
-        
-        # 时间范围统计
         now = datetime.utcnow()
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        yesterday_start = today_start - timedelta(days=1)
-        week_start = now - timedelta(days=7)
-        month_start = now - timedelta(days=30)
-        
-        today_comments = await collection.count_documents({"fetch_time": {"$gte": today_start}})
-        yesterday_comments = await collection.count_documents({
-            "fetch_time": {"$gte": yesterday_start, "$lt": today_start}
-        })
-        week_comments = await collection.count_documents({"fetch_time": {"$gte": week_start}})
-        month_comments = await collection.count_documents({"fetch_time": {"$gte": month_start}})
-        
-        # 按笔记统计 (Top 10)
-        notes_pipeline = [
-            {"$group": {"_id": "$note_id", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        # 使用异步方式获取聚合结果
-        notes_cursor = collection.aggregate(notes_pipeline)
-        top_notes = await notes_cursor.to_list(length=10)
-        
-        # 按用户统计 (Top 10)
-        users_pipeline = [
-            {"$group": {"_id": "$user_name", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        # 使用异步方式获取聚合结果
-        users_cursor = collection.aggregate(users_pipeline)
-        top_users = await users_cursor.to_list(length=10)
+        # 时间段为按UTC日期划分的最近 1/7/30 天（含今天）
+        stats = await read_stats(db, COMMENTS_COLLECTION, top={
+            DIMENSION_NOTE: 10,
+            DIMENSION_AUTHOR: 10,
+            DIMENSION_IP_LOCATION: 10
+        }, now=now)
+        structured_stats = await read_stats(db, STRUCTURED_COMMENTS_COLLECTION, now=now)
         
         return {
             "success": True,
             "stats": {
                 "total": {
-                    "comments": total_comments,
-                    "structured_comments": structured_comments
-                },
-                "period": {
-                    "today": today_comments,
-                    "yesterday": yesterday_comments,
-                    "week": week_comments,
-                    "month": month_comments
+                    "comments": stats["total"],
+                    "structured_comments": structured_stats["total"]
                 },
-                "top_notes": [{"note_id": item["_id"], "count": item["count"]} for item in top_notes],
-                "top_users": [{"user_name": item["_id"], "count": item["count"]} for item in top_users]
+                "period": stats["period"],
+                "top_notes": [{"note_id": item["key"], "count": item["count"]} for item in stats["top"][DIMENSION_NOTE]],
+                "top_users": [{"user_name": item["key"], "count": item["count"]} for item in stats["top"][DIMENSION_AUTHOR]],
+                "top_ip_locations": [
+                    {"ip_location": item["key"], "count": item["count"]} for item in stats["top"][DIMENSION_IP_LOCATION]
+                ],
+                "source": stats["source"]
             },
             "timestamp": now.strftime("%Y-%m-%d %H:%M:%S")
         }
@@ -176,6 +162,7 @@ async def get_comments_stats(
         )
 
 @router.get("/{comment_id}", summary="获取单条评论")
+@cached_query("comments.get", lambda params: [f"comment:{params['comment_id']}"])
 async def get_comment(
     comment_id: str,
     current_user: str = Depends(get_current_user),
@@ -189,7 +176,7 @@ async def get_comment(
         
         collection = db[COMMENTS_COLLECTION]
         
-        comment = await collection.find_one({"_id": ObjectId(comment_id)})
+        comment = await collection.find_one({"_id": ObjectId(comment_id)}, HIDE_SEARCH_TOKENS)
         
         if not comment:
             raise HTTPException(
@@ -228,13 +215,16 @@ async def delete_comment(
         
         collection = db[COMMENTS_COLLECTION]
         
-        result = await collection.delete_one({"_id": ObjectId(comment_id)})
+        deleted = await collection.find_one_and_delete({"_id": ObjectId(comment_id)})
+        total_counter.invalidate(COMMENTS_COLLECTION)
         
-        if result.deleted_count == 0:
+        if deleted is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"未找到评论: {comment_id}"
             )
+        await record_documents(COMMENTS_COLLECTION, [deleted], delta=-1)
+        await query_cache.invalidate(*write_tags(COMMENTS_COLLECTION, comment=[comment_id]))
         
         return {
             "success": True,
@@ -251,31 +241,41 @@ async def delete_comment(
         )
 
 @router.get("/user/{user_id}", summary="获取用户历史评论")
+@cached_query("comments.user_history", lambda params: [f"user:{params['user_id']}"],
+              ttl_seconds=QUERY_CACHE_USER_HISTORY_TTL_SECONDS)
 async def get_user_comments(
     user_id: str,
+    page: int = Query(1, ge=1, description="页码（按笔记分页）"),
+    page_size: int = Query(20, ge=1, le=100, description="每页笔记数"),
     current_user: str = Depends(get_current_user)
 ):
     """
     获取指定用户的历史评论数据
     
-    返回用户参与的所有评论互动，包括：
+    返回用户参与的所有评论互动，按笔记分组、按笔记发布时间倒序分页，包括：
     - 用户发表的评论
     - 回复给用户的评论
     - 用户回复的原评论
     - 互动线程中的其他评论
+    
+    结果按用户缓存，写入该用户发表的评论或回复该用户的评论时失效。
     """
     try:
-        logger.info(f"开始获取用户 {user_id} 的历史评论")
+        logger.info(f"开始获取用户 {user_id} 的历史评论，第 {page} 页")
         
-        comments = await get_user_historical_comments(user_id)
+        comments, total = await get_user_historical_comments(user_id, page=page, page_size=page_size)
         
-        logger.info(f"成功获取用户 {user_id} 的历史评论，共 {len(comments)} 条笔记")
+        logger.info(f"成功获取用户 {user_id} 的历史评论，本页 {len(comments)} 条笔记，共 {total} 条笔记")
         
         return {
             "success": True,
             "data": comments,
-            "total": len(comments),
-            "message": f"成功获取用户历史评论，共 {len(comments)} 条笔记"
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (total + page_size - 1) // page_size,
+            "has_more": page * page_size < total,
+            "message": f"成功获取用户历史评论，共 {total} 条笔记"
         }
         
     except Exception as e:
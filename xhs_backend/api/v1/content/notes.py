@@ -6,13 +6,21 @@
 from fastapi import APIRouter, HTTPException, Depends, Query, Body
 from typing import Dict, Any, List, Optional
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from bson import ObjectId
 from pymongo import UpdateOne
 
-from database import get_database, NOTES_COLLECTION, NOTE_DETAILS_COLLECTION
+from database import get_database, NOTES_COLLECTION, NOTE_DETAILS_COLLECTION, STRUCTURED_COMMENTS_COLLECTION
 from api.deps import get_current_user, get_current_user_combined
 from api.models.content import XhsNoteDetail
+from api.services.comment import build_comment_tree
+from api.services.pagination import find_page
+from api.services.query_cache import (
+    cached_query, collection_tag, stats_tag, query_cache, write_tags, QUERY_CACHE_STATS_TTL_SECONDS
+)
+from api.services.rollups import read_stats, DIMENSION_AUTHOR
+from api.services.search_index import KeywordSearch, HIDE_SEARCH_TOKENS, search_tokens_update
+from api.services.totals import total_counter, TOTALS_DEFAULT_MODE, TOTAL_MODE_PATTERN
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -21,9 +29,13 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("", summary="查询笔记")
+@cached_query("notes.list", [collection_tag(NOTES_COLLECTION)])
 async def get_notes(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），提供时忽略 page"),
+    total_mode: str = Query(TOTALS_DEFAULT_MODE, alias="total", pattern=TOTAL_MODE_PATTERN,
+                            description="总数计算方式: exact（精确，短时缓存）、estimate（估算）、none（不计算）"),
     keyword: Optional[str] = Query(None, description="关键字搜索"),
     author: Optional[str] = Query(None, description="作者名称"),
     start_date: Optional[str] = Query(None, description="开始日期 YYYY-MM-DD"),
@@ -34,23 +46,23 @@ async def get_notes(
     """
     查询笔记数据
     
-    支持分页、关键字搜索、按作者过滤、按日期范围过滤
+    支持分页、关键字搜索、按作者过滤、按日期范围过滤。
+    有关键字时按匹配次数和抓取时间排序，否则按抓取时间倒序。
+    按 `next_cursor` 翻页时任意深度的页面耗时相同（此时不计算总数）。
+    响应中的 `total_exact` 表示总数是否精确。
     """
     try:
         collection = db[NOTES_COLLECTION]
         
         # 构建查询条件
         query = {}
+        search = KeywordSearch(NOTES_COLLECTION)
         
         if keyword:
-            query["$or"] = [
-                {"title": {"$regex": keyword, "$options": "i"}},
-                {"content": {"$regex": keyword, "$options": "i"}},
-                {"user.nickname": {"$regex": keyword, "$options": "i"}}
-            ]
+            query.update(search.match(("title", "content", "user.nickname"), keyword))
         
         if author:
-            query["user.nickname"] = {"$regex": author, "$options": "i"}
+            query.update(search.match(("user.nickname",), author))
             
         if start_date and end_date:
             try:
@@ -66,28 +78,33 @@ async def get_notes(
                     detail="日期格式错误，请使用 YYYY-MM-DD 格式"
                 )
         
-        # 计算分页
-        skip = (page - 1) * page_size
+        # 二元组索引就绪时用其缩小候选范围
+        await search.apply(query)
         
-        # 查询数据
-        cursor = collection.find(query).sort("fetch_time", -1).skip(skip).limit(page_size)
-        notes_docs = await cursor.to_list(length=page_size)
+        # 查询数据（按 fetch_time 倒序，_id 保证顺序稳定）
+        notes_docs, next_cursor = await find_page(
+            collection, query, "fetch_time", page_size, cursor=cursor, page=page,
+            projection=HIDE_SEARCH_TOKENS, score=search.score()
+        )
         notes_list = []
         
         for doc in notes_docs:
             doc['_id'] = str(doc['_id'])
             notes_list.append(doc)
         
-        # 获取总数
-        total = await collection.count_documents(query)
+        # 获取总数（游标翻页时不计算）
+        total, total_exact = await total_counter.count(collection, query, "none" if cursor else total_mode)
         
         return {
             "success": True,
             "data": notes_list,
             "total": total,
+            "total_exact": total_exact,
             "page": page,
             "page_size": page_size,
-            "total_pages": (total + page_size - 1) // page_size,
+            "total_pages": (total + page_size - 1) // page_size if total is not None else None,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
             "message": f"成功获取 {len(notes_list)} 条笔记数据"
         }
         
@@ -101,6 +118,7 @@ async def get_notes(
         )
 
 @router.get("/stats", summary="笔记统计")
+@cached_query("notes.stats", [stats_tag(NOTES_COLLECTION)], ttl_seconds=QUERY_CACHE_STATS_TTL_SECONDS)
 async def get_notes_stats(
     current_user: str = Depends(get_current_user),
     db=Depends(get_database)
@@ -110,31 +128,9 @@ async def get_notes_stats(
     """
     try:
         collection = db[NOTES_COLLECTION]
-        
-        # 基础统计
-        total_notes = await collection.count_documents({})
-        
-        # 时间范围统计
         now = datetime.utcnow()
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        yesterday_start = today_start - timedelta(days=1)
-        week_start = now - timedelta(days=7)
-        month_start = now - timedelta(days=30)
-        
-        today_notes = await collection.count_documents({"fetch_time": {"$gte": today_start}})
-        yesterday_notes = await collection.count_documents({
-            "fetch_time": {"$gte": yesterday_start, "$lt": today_start}
-        })
-        week_notes = await collection.count_documents({"fetch_time": {"$gte": week_start}})
-        month_notes = await collection.count_documents({"fetch_time": {"$gte": month_start}})
-        
-        # 按作者统计 (Top 10)
-        authors_pipeline = [
-            {"$group": {"_id": "$user.nickname", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        top_authors = await collection.aggregate(authors_pipeline).to_list(length=10)
+        # 时间段为按UTC日期划分的最近 1/7/30 天（含今天）
+        stats = await read_stats(db, NOTES_COLLECTION, top={DIMENSION_AUTHOR: 10}, now=now)
         
         # 获取平均点赞数和收藏数
         engagement_pipeline = [
@@ -160,21 +156,17 @@ async def get_notes_stats(
             "success": True,
             "stats": {
                 "total": {
-                    "notes": total_notes
+                    "notes": stats["total"]
                 },
-                "period": {
-                    "today": today_notes,
-                    "yesterday": yesterday_notes,
-                    "week": week_notes,
-                    "month": month_notes
-                },
-                "top_authors": [{"author": item["_id"], "count": item["count"]} for item in top_authors],
+                "period": stats["period"],
+                "top_authors": [{"author": item["key"], "count": item["count"]} for item in stats["top"][DIMENSION_AUTHOR]],
                 "engagement": {
                     "avg_liked": round(engagement_stats.get("avg_liked_count", 0), 2),
                     "avg_collected": round(engagement_stats.get("avg_collected_count", 0), 2),
                     "total_liked": engagement_stats.get("total_liked", 0),
                     "total_collected": engagement_stats.get("total_collected", 0)
-                }
+                },
+                "source": stats["source"]
             },
             "timestamp": now.strftime("%Y-%m-%d %H:%M:%S")
         }
@@ -187,6 +179,10 @@ async def get_notes_stats(
         )
 
 @router.get("/{note_id}", summary="获取单条笔记")
+@cached_query("notes.get", lambda params: [f"note:{params['note_id']}"] + (
+    # 按 _id 查询时写入路径只知道 noteId，以集合标签失效
+    [collection_tag(NOTES_COLLECTION)] if ObjectId.is_valid(params["note_id"]) else []
+))
 async def get_note(
     note_id: str,
     current_user: str = Depends(get_current_user),
@@ -200,10 +196,10 @@ async def get_note(
         
         # 尝试通过MongoDB ObjectId查询
         try:
-            note = await collection.find_one({"_id": ObjectId(note_id)})
+            note = await collection.find_one({"_id": ObjectId(note_id)}, HIDE_SEARCH_TOKENS)
         except:
             # 如果不是有效的ObjectId，尝试通过noteId查询
-            note = await collection.find_one({"noteId": note_id})
+            note = await collection.find_one({"noteId": note_id}, HIDE_SEARCH_TOKENS)
         
         if not note:
             raise HTTPException(
@@ -228,6 +224,57 @@ async def get_note(
             detail=f"获取笔记详情失败: {str(e)}"
         )
 
+# 评论树中每条评论返回的字段
+_COMMENT_TREE_PROJECTION = {
+    "_id": 0, "commentId": 1, "repliedId": 1, "rootCommentId": 1, "depth": 1,
+    "authorId": 1, "authorName": 1, "authorAvatar": 1, "content": 1,
+    "timestamp": 1, "likeCount": 1, "ipLocation": 1
+}
+
+@router.get("/{note_id}/comment-tree", summary="获取笔记评论树")
+@cached_query("notes.comment_tree", lambda params: [f"note:{params['note_id']}"])
+async def get_note_comment_tree(
+    note_id: str,
+    root_comment_id: Optional[str] = Query(None, description="只返回该顶级评论所在的线程"),
+    limit: int = Query(5000, ge=1, le=20000, description="最多返回的评论数"),
+    current_user: str = Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """
+    获取笔记（或其中一个线程）的全部结构化评论，按回复关系组装成树
+
+    一次索引查询（noteId 或 rootCommentId，按评论时间排序）取回评论，线性时间组装。
+    每个节点带有 depth（回复层级）和 replies（按时间排序的回复）。
+    """
+    try:
+        collection = db[STRUCTURED_COMMENTS_COLLECTION]
+        if root_comment_id:
+            query = {"rootCommentId": root_comment_id, "noteId": note_id}
+            sort = [("rootCommentId", 1), ("timestamp", 1)]
+        else:
+            query = {"noteId": note_id}
+            sort = [("noteId", 1), ("timestamp", 1)]
+        
+        comments = await collection.find(query, _COMMENT_TREE_PROJECTION).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+        truncated = len(comments) > limit
+        comments = comments[:limit]
+        
+        return {
+            "success": True,
+            "noteId": note_id,
+            "rootCommentId": root_comment_id,
+            "total": len(comments),
+            "truncated": truncated,
+            "tree": build_comment_tree(comments)
+        }
+        
+    except Exception as e:
+        logger.exception("获取笔记评论树时发生错误")
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取笔记评论树失败: {str(e)}"
+        )
+
 @router.post("/details/upload", summary="上传笔记详情数据")
 async def upload_note_details(
     note_details: List[XhsNoteDetail],
@@ -251,6 +298,7 @@ async def upload_note_details(
         collection = db[NOTE_DETAILS_COLLECTION]
         
         operations = []
+        note_ids = []
         for detail in note_details:
             # 转换为字典，并排除 comments 字段
             detail_dict = detail.dict(by_alias=True)
@@ -264,16 +312,21 @@ async def upload_note_details(
             # 如果找到匹配的 noteId，则替换整个文档；否则插入新文档
             op = UpdateOne(
                 {"noteId": detail_dict["noteId"]},
-                {"$set": detail_dict},
+                {"$set": detail_dict, **search_tokens_update(NOTE_DETAILS_COLLECTION, detail_dict)},
                 upsert=True
             )
             operations.append(op)
+            note_ids.append(detail_dict["noteId"])
             
         if not operations:
             return {"success": True, "message": "没有需要处理的数据"}
             
         # 执行批量写入操作
-        result = await collection.bulk_write(operations)
+        try:
+            result = await collection.bulk_write(operations)
+        finally:
+            total_counter.invalidate(NOTE_DETAILS_COLLECTION)
+            await query_cache.invalidate(*write_tags(NOTE_DETAILS_COLLECTION, note=note_ids))
         
         logger.info(
             f"用户 '{user}' 上传了 {len(note_details)} 条笔记详情，"
@@ -295,9 +348,13 @@ async def upload_note_details(
         )
 
 @router.get("/details/list", summary="查询笔记详情列表")
+@cached_query("note_details.list", [collection_tag(NOTE_DETAILS_COLLECTION)])
 async def get_note_details(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），提供时忽略 page"),
+    total_mode: str = Query(TOTALS_DEFAULT_MODE, alias="total", pattern=TOTAL_MODE_PATTERN,
+                            description="总数计算方式: exact（精确，短时缓存）、estimate（估算）、none（不计算）"),
     keyword: Optional[str] = Query(None, description="关键字搜索"),
     author: Optional[str] = Query(None, description="作者名称"),
     note_type: Optional[str] = Query(None, description="笔记类型：video 或 normal"),
@@ -308,22 +365,23 @@ async def get_note_details(
 ):
     """
     查询笔记详情数据列表
+
+    有关键字时按匹配次数和抓取时间排序，否则按抓取时间倒序。
+    按 `next_cursor` 翻页时任意深度的页面耗时相同（此时不计算总数）。
+    响应中的 `total_exact` 表示总数是否精确。
     """
     try:
         collection = db[NOTE_DETAILS_COLLECTION]
         
         # 构建查询条件
         query = {}
+        search = KeywordSearch(NOTE_DETAILS_COLLECTION)
         
         if keyword:
-            query["$or"] = [
-                {"title": {"$regex": keyword, "$options": "i"}},
-                {"desc": {"$regex": keyword, "$options": "i"}},
-                {"user.nickname": {"$regex": keyword, "$options": "i"}}
-            ]
+            query.update(search.match(("title", "desc", "user.nickname"), keyword))
         
         if author:
-            query["user.nickname"] = {"$regex": author, "$options": "i"}
+            query.update(search.match(("user.nickname",), author))
         
         if note_type:
             query["type"] = note_type
@@ -342,9 +400,6 @@ async def get_note_details(
                     detail="日期格式错误，请使用 YYYY-MM-DD 格式"
                 )
         
-        # 计算分页
-        skip = (page - 1) * page_size
-        
         # 查询数据 - 只返回基本信息，不包含完整评论
         projection = {
             "noteId": 1,
@@ -366,8 +421,13 @@ async def get_note_details(
             "video.thumbnailFileid": 1
         }
         
-        cursor = collection.find(query, projection).sort("fetchTimestamp", -1).skip(skip).limit(page_size)
-        notes_docs = await cursor.to_list(length=page_size)
+        # 二元组索引就绪时用其缩小候选范围
+        await search.apply(query)
+        
+        notes_docs, next_cursor = await find_page(
+            collection, query, "fetchTimestamp", page_size, cursor=cursor, page=page,
+            projection=projection, score=search.score()
+        )
         
         # 处理结果
         notes_list = []
@@ -383,16 +443,19 @@ async def get_note_details(
                     doc['publishTime'] = None
             notes_list.append(doc)
         
-        # 获取总数
-        total = await collection.count_documents(query)
+        # 获取总数（游标翻页时不计算）
+        total, total_exact = await total_counter.count(collection, query, "none" if cursor else total_mode)
         
         return {
             "success": True,
             "data": notes_list,
             "total": total,
+            "total_exact": total_exact,
             "page": page,
             "page_size": page_size,
-            "total_pages": (total + page_size - 1) // page_size,
+            "total_pages": (total + page_size - 1) // page_size if total is not None else None,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
             "message": f"成功获取 {len(notes_list)} 条笔记详情数据"
         }
         
@@ -406,6 +469,7 @@ async def get_note_details(
         )
 
 @router.get("/details/{note_id}", summary="获取单条笔记详情")
+@cached_query("note_details.get", lambda params: [f"note:{params['note_id']}"])
 async def get_note_detail(
     note_id: str,
     current_user: str = Depends(get_current_user),
@@ -418,7 +482,7 @@ async def get_note_detail(
         collection = db[NOTE_DETAILS_COLLECTION]
         
         # 通过noteId查询
-        note = await collection.find_one({"noteId": note_id})
+        note = await collection.find_one({"noteId": note_id}, HIDE_SEARCH_TOKENS)
         
         if not note:
             raise HTTPException(
@@ -6,10 +6,15 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Dict, Any, List, Optional
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from database import get_database, NOTIFICATIONS_COLLECTION
 from api.deps import get_current_user
+from api.services.pagination import find_page
+from api.services.query_cache import cached_query, collection_tag, stats_tag, QUERY_CACHE_STATS_TTL_SECONDS
+from api.services.rollups import read_stats, DIMENSION_TYPE, DIMENSION_AUTHOR
+from api.services.search_index import KeywordSearch, HIDE_SEARCH_TOKENS
+from api.services.totals import total_counter, TOTALS_DEFAULT_MODE, TOTAL_MODE_PATTERN
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -18,9 +23,13 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("", summary="查询通知")
+@cached_query("notifications.list", [collection_tag(NOTIFICATIONS_COLLECTION)])
 async def get_notifications(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），提供时忽略 page"),
+    total_mode: str = Query(TOTALS_DEFAULT_MODE, alias="total", pattern=TOTAL_MODE_PATTERN,
+                            description="总数计算方式: exact（精确，短时缓存）、estimate（估算）、none（不计算）"),
     keyword: Optional[str] = Query(None, description="关键字搜索"),
     notification_type: Optional[str] = Query(None, description="通知类型"),
     start_date: Optional[str] = Query(None, description="开始日期 YYYY-MM-DD"),
@@ -31,20 +40,20 @@ async def get_notifications(
     """
     查询通知数据
     
-    支持分页、关键字搜索、按类型过滤、按日期范围过滤
+    支持分页、关键字搜索、按类型过滤、按日期范围过滤。
+    有关键字时按匹配次数和通知时间排序，否则按通知时间倒序。
+    按 `next_cursor` 翻页时任意深度的页面耗时相同（此时不计算总数）。
+    响应中的 `total_exact` 表示总数是否精确。
     """
     try:
         collection = db[NOTIFICATIONS_COLLECTION]
         
         # 构建查询条件
         query = {}
+        search = KeywordSearch(NOTIFICATIONS_COLLECTION)
         
         if keyword:
-            query["$or"] = [
-                {"content": {"$regex": keyword, "$options": "i"}},
-                {"title": {"$regex": keyword, "$options": "i"}},
-                {"username": {"$regex": keyword, "$options": "i"}}
-            ]
+            query.update(search.match(("content", "title", "username"), keyword))
         
         if notification_type:
             query["type"] = notification_type
@@ -63,28 +72,33 @@ async def get_notifications(
                     detail="日期格式错误，请使用 YYYY-MM-DD 格式"
                 )
         
-        # 计算分页
-        skip = (page - 1) * page_size
+        # 二元组索引就绪时用其缩小候选范围
+        await search.apply(query)
         
-        # 查询数据
-        cursor = collection.find(query).sort("timestamp", -1).skip(skip).limit(page_size)
-        notifications_docs = await cursor.to_list(length=page_size)
+        # 查询数据（按 timestamp 倒序，_id 保证顺序稳定）
+        notifications_docs, next_cursor = await find_page(
+            collection, query, "timestamp", page_size, cursor=cursor, page=page,
+            projection=HIDE_SEARCH_TOKENS, score=search.score()
+        )
         notifications_list = []
         
         for doc in notifications_docs:
             doc['_id'] = str(doc['_id'])
             notifications_list.append(doc)
         
-        # 获取总数
-        total = await collection.count_documents(query)
+        # 获取总数（游标翻页时不计算）
+        total, total_exact = await total_counter.count(collection, query, "none" if cursor else total_mode)
         
         return {
             "success": True,
             "data": notifications_list,
             "total": total,
+            "total_exact": total_exact,
             "page": page,
             "page_size": page_size,
-            "total_pages": (total + page_size - 1) // page_size,
+            "total_pages": (total + page_size - 1) // page_size if total is not None else None,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
             "message": f"成功获取 {len(notifications_list)} 条通知数据"
         }
         
@@ -98,6 +112,7 @@ async def get_notifications(
         )
 
 @router.get("/stats", summary="通知统计")
+@cached_query("notifications.stats", [stats_tag(NOTIFICATIONS_COLLECTION)], ttl_seconds=QUERY_CACHE_STATS_TTL_SECONDS)
 async def get_notifications_stats(
     current_user: str = Depends(get_current_user),
     db=Depends(get_database)
@@ -106,55 +121,23 @@ async def get_notifications_stats(
     获取通知统计信息
     """
     try:
-        collection = db[NOTIFICATIONS_COLLECTION]
-        
-        # 基础统计
-        total_notifications = await collection.count_documents({})
-        
-        # 时间范围统计
         now = datetime.utcnow()
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        yesterday_start = today_start - timedelta(days=1)
-        week_start = now - timedelta(days=7)
-        month_start = now - timedelta(days=30)
-        
-        today_notifications = await collection.count_documents({"timestamp": {"$gte": today_start}})
-        yesterday_notifications = await collection.count_documents({
-            "timestamp": {"$gte": yesterday_start, "$lt": today_start}
-        })
-        week_notifications = await collection.count_documents({"timestamp": {"$gte": week_start}})
-        month_notifications = await collection.count_documents({"timestamp": {"$gte": month_start}})
-        
-        # 按类型统计
-        types_pipeline = [
-            {"$group": {"_id": "$type", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        types_result = await collection.aggregate(types_pipeline).to_list(length=None)
-        types_stats = {item["_id"]: item["count"] for item in types_result}
-        
-        # 按用户统计 (Top 10)
-        users_pipeline = [
-            {"$group": {"_id": "$username", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        top_users = await collection.aggregate(users_pipeline).to_list(length=10)
+        # 时间段为按UTC日期划分的最近 1/7/30 天（含今天）
+        stats = await read_stats(db, NOTIFICATIONS_COLLECTION, top={
+            DIMENSION_TYPE: None,
+            DIMENSION_AUTHOR: 10
+        }, now=now)
         
         return {
             "success": True,
             "stats": {
                 "total": {
-                    "notifications": total_notifications
-                },
-                "period": {
-                    "today": today_notifications,
-                    "yesterday": yesterday_notifications,
-                    "week": week_notifications,
-                    "month": month_notifications
+                    "notifications": stats["total"]
                 },
-                "by_type": types_stats,
-                "top_users": [{"username": item["_id"], "count": item["count"]} for item in top_users]
+                "period": stats["period"],
+                "by_type": {item["key"]: item["count"] for item in stats["top"][DIMENSION_TYPE]},
+                "top_users": [{"username": item["key"], "count": item["count"]} for item in stats["top"][DIMENSION_AUTHOR]],
+                "source": stats["source"]
             },
             "timestamp": now.strftime("%Y-%m-%d %H:%M:%S")
         }
@@ -167,6 +150,7 @@ async def get_notifications_stats(
         )
 
 @router.get("/types", summary="获取通知类型")
+@cached_query("notifications.types", [collection_tag(NOTIFICATIONS_COLLECTION)])
 async def get_notification_types(
     current_user: str = Depends(get_current_user),
     db=Depends(get_database)
@@ -206,6 +190,7 @@ async def get_notification_types(
         )
 
 @router.get("/{notification_id}", summary="获取单条通知")
+@cached_query("notifications.get", [collection_tag(NOTIFICATIONS_COLLECTION)])
 async def get_notification(
     notification_id: str,
     current_user: str = Depends(get_current_user),
@@ -219,7 +204,7 @@ async def get_notification(
         
         collection = db[NOTIFICATIONS_COLLECTION]
         
-        notification = await collection.find_one({"_id": ObjectId(notification_id)})
+        notification = await collection.find_one({"_id": ObjectId(notification_id)}, HIDE_SEARCH_TOKENS)
         
         if not notification:
             raise HTTPException(
@@ -1,7 +1,7 @@
 """
 系统管理域
 
-包含抓取规则、网络数据处理等功能
+包含抓取规则、网络数据处理、系统监控等功能
 """
 from fastapi import APIRouter
 from typing import Dict, Any
@@ -12,6 +12,7 @@ router = APIRouter(prefix="/system")
 # 导入各个系统管理模块
 from .capture_rules import router as capture_rules_router
 from .network_data import router as network_data_router
+from .monitoring import router as monitoring_router
 
 # 添加简单的健康检查接口
 @router.get("/health", response_model=Dict[str, Any], summary="健康检查")
@@ -29,5 +30,6 @@ async def health_check():
 # 注册各个子模块路由
 router.include_router(capture_rules_router)
 router.include_router(network_data_router)
+router.include_router(monitoring_router)
 
 __all__ = ["router"] 
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+系统监控
+
+系统管理域 - 以 Prometheus 文本格式导出上传处理指标、数据库索引使用报告、查询缓存命中率
+"""
+from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.responses import Response
+import logging
+
+from api.services.metrics import render_metrics
+from api.services.indexes import index_report
+from api.services.query_cache import query_cache
+from api.services.totals import total_counter
+from api.deps import get_current_user_combined
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 创建路由器
+router = APIRouter(prefix="/monitoring")
+
+@router.get("/metrics", summary="Prometheus 指标", response_class=Response)
+async def get_metrics():
+    """
+    导出上传数量、提取/保存条数、失败数、各阶段与各集合写入耗时及每次上传的数据库命令数。
+
+    设置 PROMETHEUS_MULTIPROC_DIR 时汇总所有 worker 进程的指标。
+    """
+    try:
+        content, content_type = render_metrics()
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    return Response(content=content, media_type=content_type)
+
+@router.get("/indexes", summary="数据库索引报告")
+async def get_index_report(
+    user: str = Depends(get_current_user_combined)
+):
+    """
+    各集合缺失的声明索引、未声明的索引，以及 `$indexStats` 统计的索引访问次数（未被使用的索引单独列出）。
+    """
+    try:
+        report = await index_report()
+    except Exception as e:
+        logger.exception(f"生成索引报告失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"生成索引报告失败: {str(e)}"
+        )
+    return {"success": True, "data": report}
+
+@router.get("/query-cache", summary="查询缓存统计")
+async def get_query_cache_stats(
+    user: str = Depends(get_current_user_combined)
+):
+    """
+    本 worker 的查询结果缓存（命中、合并、未命中、命中率、失效次数）和列表总数缓存的统计。
+
+    所有 worker 汇总的命中率见 /metrics 中的 `xhs_query_cache_requests_total`。
+    """
+    return {
+        "success": True,
+        "query_cache": query_cache.stats(),
+        "totals": total_counter.stats()
+    }
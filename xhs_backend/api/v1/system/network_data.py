@@ -3,39 +3,125 @@
 
 接收、处理、存储网络监控数据
 """
-from fastapi import APIRouter, HTTPException, Depends, status, Body
-from typing import Dict, Any, List
+from fastapi import APIRouter, HTTPException, Depends, status, Body, Query, Request, Header
+from typing import Dict, Any, List, Optional
 import logging
 
-from api.models.network import RawNetworkData, DataProcessingResult
-from api.services.network_data_processor import NetworkDataProcessor
+from api.models.network import RawNetworkData, DataProcessingResult, IngestTicket
+from api.services.network_data_processor import network_processor
+from api.services.ingest_queue import enqueue_raw_data, get_ticket
+from api.services.bulk_writer import bulk_writer
+from api.services.ingest_dedup import recent_fingerprints
+from api.services.user import user_info_write_stats
+from api.services.note_cache import note_metadata_cache
+from api.services.rate_limit import (
+    ingest_rate_limiter, ingest_in_flight, retry_after_header, INGEST_OVERLOAD_RETRY_AFTER
+)
+from api.services.request_encoding import GzipRoute
+from api.services.idempotency import ingest_idempotency, idempotency_key, IDEMPOTENCY_HEADER
+from api.services.ndjson_ingest import (
+    ingest_ndjson, NdjsonStreamingResponse, NDJSON_STREAM_CONCURRENCY, NDJSON_MAX_CONCURRENCY
+)
+from api.services.upload_codec import (
+    decode_embedded_upload, decode_multipart_upload, MULTIPART_META_PART, MULTIPART_RESPONSE_PART
+)
 from api.deps import get_current_user_combined
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 创建路由器
-router = APIRouter(prefix="/network-data")
+# 创建路由器（上传接口接受 gzip 压缩的请求体）
+router = APIRouter(prefix="/network-data", route_class=GzipRoute)
+
+async def enforce_ingest_rate(user: str, cost: int = 1):
+    """按上传用户的令牌桶限流，超出限额时返回 429 及 Retry-After"""
+    allowed, wait_seconds = await ingest_rate_limiter.acquire(user, cost)
+    if not allowed:
+        logger.warning(f"用户 {user} 上传过于频繁，已限流 (需等待 {wait_seconds:.1f}s)")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="上传过于频繁，请稍后重试",
+            headers={"Retry-After": retry_after_header(wait_seconds)}
+        )
+
+async def ingest_rate_limit(user: str = Depends(get_current_user_combined)) -> str:
+    """上传接口依赖：认证并消耗一个令牌"""
+    await enforce_ingest_rate(user)
+    return user
+
+async def ingest_batch_rate_limit(
+    data_list: List[RawNetworkData],
+    user: str = Depends(get_current_user_combined)
+) -> str:
+    """
+    批量上传接口依赖：认证并按条数一次性消耗令牌
+
+    条数超过令牌桶容量的批次永远无法一次通过，直接返回 413，客户端应拆分后上传
+    """
+    if ingest_rate_limiter.enabled and len(data_list) > ingest_rate_limiter.burst:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单批最多 {ingest_rate_limiter.burst} 条数据，请拆分后上传"
+        )
+    await enforce_ingest_rate(user, max(1, len(data_list)))
+    return user
+
+def acquire_in_flight():
+    """
+    占用一个处理名额
+
+    当前 worker 正在处理的上传已达上限时返回 503 及 Retry-After，在数据库饱和前丢弃负载
+    """
+    if not ingest_in_flight.try_acquire():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="服务器繁忙，请稍后重试",
+            headers={"Retry-After": retry_after_header(INGEST_OVERLOAD_RETRY_AFTER)}
+        )
+
+async def ingest_admission(user: str = Depends(ingest_rate_limit)):
+    """同步处理上传接口依赖：认证、限流，并占用一个处理名额"""
+    acquire_in_flight()
+    try:
+        yield user
+    finally:
+        ingest_in_flight.release()
+
+async def ingest_batch_admission(user: str = Depends(ingest_batch_rate_limit)):
+    """批量上传接口依赖：认证、按条数限流，并占用一个处理名额"""
+    acquire_in_flight()
+    try:
+        yield user
+    finally:
+        ingest_in_flight.release()
 
 @router.post("/upload", summary="上传原始网络数据", response_model=DataProcessingResult)
 async def upload_raw_network_data(
     data: RawNetworkData,
-    user: str = Depends(get_current_user_combined)
+    durable: bool = Query(False, description="启用写后缓冲时，是否等待数据实际写入数据库后再返回"),
+    idempotency_header: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, description="幂等键，缺省时使用 request_id"),
+    user: str = Depends(ingest_admission)
 ):
     """
     接收并处理插件捕获的原始网络请求数据。
 
     这个端点会:
     1. 接收符合 `RawNetworkData` 模型的数据。
-    2. 使用 `NetworkDataProcessor` 对数据进行分类和解析。
+    2. 使用共享的 `NetworkDataProcessor` 对数据进行分类和解析。
     3. 将解析后的结构化数据保存到相应的数据库集合中。
     4. 返回处理结果。
+
+    上传过于频繁时返回 429，服务器繁忙时返回 503，两者都带 `Retry-After`，客户端应退避后重试。
+
+    以 `Idempotency-Key` 请求头（缺省时为 `request_id` + URL + 抓取时间 + 响应体）去重：已成功处理过的上传直接返回
+    保存的结果（`idempotent_replay` 为 true），同时到达的重复上传只处理一次。
     """
     try:
         logger.info(f"接收到来自用户 {user} 的网络数据上传请求, 规则: {data.rule_name}, URL: {data.url}")
         
-        processor = NetworkDataProcessor()
-        result = await processor.process_raw_data(data)
+        result = await network_processor.process_raw_data(
+            data, durable=durable, idempotency_key=idempotency_key(user, data, idempotency_header)
+        )
         
         if not result.success:
             logger.error(f"处理网络数据失败: {result.error_message}")
@@ -58,30 +144,187 @@ async def upload_raw_network_data(
             detail=f"服务器内部错误: {str(e)}"
         )
 
+@router.post("/upload/raw", summary="上传原始网络数据（响应只解码一次）", response_model=DataProcessingResult)
+async def upload_raw_network_data_single_decode(
+    request: Request,
+    durable: bool = Query(False, description="启用写后缓冲时，是否等待数据实际写入数据库后再返回"),
+    idempotency_header: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, description="幂等键，缺省时使用 request_id"),
+    user: str = Depends(ingest_admission)
+):
+    """
+    与 `/upload` 功能相同（包括幂等处理），但捕获的响应不再以字符串形式嵌套在JSON中，整个请求只解码一次。
+
+    支持两种格式:
+    1. `application/json`: 信封字段与 `RawNetworkData` 相同，响应以JSON对象放在 `response_json` 字段中。
+    2. `multipart/form-data`: `meta` 部分为不含响应体的信封JSON，`response` 部分为原始响应字节。
+    """
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            meta = form.get(MULTIPART_META_PART)
+            response_part = form.get(MULTIPART_RESPONSE_PART)
+            if meta is None or response_part is None:
+                raise ValueError(f"multipart 上传需要 {MULTIPART_META_PART} 和 {MULTIPART_RESPONSE_PART} 两个部分")
+            if hasattr(meta, "read"):
+                meta = await meta.read()
+            response_bytes = await response_part.read() if hasattr(response_part, "read") else response_part.encode("utf-8")
+            data, response_json, body = decode_multipart_upload(meta, response_bytes)
+            canonical_body = False
+        else:
+            data, response_json, body = decode_embedded_upload(await request.body())
+            canonical_body = True
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"数据校验失败: {e}"
+        )
+
+    try:
+        logger.info(f"接收到来自用户 {user} 的网络数据上传请求, 规则: {data.rule_name}, URL: {data.url}")
+        result = await network_processor.process_raw_data(
+            data, durable=durable, response_json=response_json, body=body, canonical_body=canonical_body,
+            idempotency_key=idempotency_key(user, data, idempotency_header, body=body)
+        )
+
+        if not result.success:
+            logger.error(f"处理网络数据失败: {result.error_message}")
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"数据处理失败: {result.error_message}"
+            )
+
+        logger.info(f"网络数据处理成功: {result.items_saved} 条数据已保存")
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"上传网络数据时发生严重错误: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"服务器内部错误: {str(e)}"
+        )
+
+@router.post(
+    "/upload/async",
+    summary="异步上传原始网络数据",
+    response_model=IngestTicket,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def upload_raw_network_data_async(
+    data: RawNetworkData,
+    idempotency_header: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, description="幂等键，缺省时使用 request_id"),
+    user: str = Depends(ingest_rate_limit)
+):
+    """
+    校验插件捕获的原始网络请求数据并追加到持久化摄取队列。
+
+    与 `/upload` 不同，这个端点不会等待解析和入库：
+    1. 校验数据能被识别为已知的数据类型且包含响应体。
+    2. 写入 Redis Streams 摄取队列，由消费组中的工作进程异步处理。
+    3. 立即返回 202 及票据，可通过 `/tickets/{ticket_id}` 查询处理状态。
+
+    幂等键随消息入队，工作进程处理时跳过已成功处理过的上传。
+    """
+    if not data.response_body:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="数据校验失败: 缺少响应体"
+        )
+    if not network_processor._determine_data_type(data.rule_name, data.url):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="数据校验失败: 无法确定数据类型"
+        )
+    if not network_processor.accepts_upload(data.rule_name, data.url):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="数据校验失败: 该数据类型不保存数据"
+        )
+
+    try:
+        ticket = await enqueue_raw_data(data, user, idempotency_key=idempotency_key(user, data, idempotency_header))
+    except ConnectionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+
+    logger.info(f"用户 {user} 的网络数据已入队, 票据: {ticket.ticket_id}, 规则: {data.rule_name}")
+    return ticket
+
+@router.get("/tickets/{ticket_id}", summary="查询异步上传票据状态", response_model=IngestTicket)
+async def get_ingest_ticket(
+    ticket_id: str,
+    user: str = Depends(get_current_user_combined)
+):
+    """
+    查询异步上传票据的处理状态及处理结果。
+    """
+    try:
+        ticket = await get_ticket(ticket_id)
+    except ConnectionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+
+    if not ticket:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"未找到票据或票据已过期: {ticket_id}"
+        )
+    return ticket
+
+@router.get("/stats", summary="获取网络数据处理统计")
+async def get_network_data_stats(
+    user: str = Depends(get_current_user_combined)
+):
+    """
+    获取写后缓冲（队列深度、写入耗时）、上传去重与笔记元数据缓存（命中率）、
+    用户信息写入（创建/更新/无变化）、上传限流与并发处理数、幂等重放的运行统计。
+    """
+    return {
+        "success": True,
+        "write_buffer": bulk_writer.stats(),
+        "dedup": recent_fingerprints.stats(),
+        "user_info_writes": dict(user_info_write_stats),
+        "note_cache": note_metadata_cache.stats(),
+        "rate_limit": ingest_rate_limiter.stats(),
+        "in_flight": ingest_in_flight.stats(),
+        "idempotency": ingest_idempotency.stats()
+    }
+
 @router.post("/upload/batch", summary="批量上传原始网络数据")
 async def upload_batch_raw_network_data(
     data_list: List[RawNetworkData],
-    user: str = Depends(get_current_user_combined)
+    durable: bool = Query(False, description="启用写后缓冲时，是否等待数据实际写入数据库后再返回"),
+    user: str = Depends(ingest_batch_admission)
 ):
     """
     接收并批量处理插件捕获的原始网络请求数据。
+
+    各条数据并发解析，解析出的用户、笔记、评论在整批内按ID合并后，
+    每个集合只执行一次批量写入；每条数据的处理结果仍单独返回。
+    每条数据按 `request_id` + URL + 抓取时间 + 响应体幂等，重试的批次中已成功处理的数据直接返回保存的结果。
+
+    每条数据消耗一个上传令牌，令牌不足时返回 429；条数超过令牌桶容量时返回 413，需拆分后上传。
     """
-    results = []
-    processor = NetworkDataProcessor()
-    
     logger.info(f"接收到来自用户 {user} 的批量网络数据上传请求, 共 {len(data_list)} 条")
 
-    for data in data_list:
-        try:
-            result = await processor.process_raw_data(data)
-            results.append(result.dict())
-        except Exception as e:
-            logger.error(f"批量处理其中一条数据时失败: {e}, URL: {data.url}")
-            results.append(DataProcessingResult(
-                raw_data_id=data.request_id,
-                success=False,
-                error_message=str(e)
-            ).dict())
+    try:
+        keys = [idempotency_key(user, data) for data in data_list]
+        results = [
+            result.model_dump()
+            for result in await network_processor.process_batch(data_list, durable=durable, idempotency_keys=keys)
+        ]
+    except Exception as e:
+        logger.exception(f"批量处理网络数据时发生严重错误: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"服务器内部错误: {str(e)}"
+        )
             
     total_saved = sum(r.get('items_saved', 0) for r in results if r['success'])
     total_failed = len(data_list) - sum(1 for r in results if r['success'])
@@ -93,4 +336,38 @@ async def upload_batch_raw_network_data(
         "message": f"批量处理完成: {len(data_list) - total_failed} 成功, {total_failed} 失败。",
         "total_items_saved": total_saved,
         "results": results
-    } 
\ No newline at end of file
+    }
+
+@router.post("/upload/stream", summary="流式上传原始网络数据（NDJSON）")
+async def upload_stream_raw_network_data(
+    request: Request,
+    durable: bool = Query(False, description="启用写后缓冲时，是否等待数据实际写入数据库后再返回"),
+    concurrency: int = Query(NDJSON_STREAM_CONCURRENCY, ge=1, le=NDJSON_MAX_CONCURRENCY, description="同时处理的记录数"),
+    user: str = Depends(ingest_rate_limit)
+):
+    """
+    以 `application/x-ndjson` 流式上传大量原始网络数据（批量回填使用），可用 gzip 压缩。
+
+    请求体每行一条上传信封，格式与 `/upload` 相同，或与 `/upload/raw` 一样把响应放在 `response_json` 字段中。
+    服务器边读边处理（同时处理的记录数受 `concurrency` 限制），每条记录完成后立即返回一行结果：
+    - `{"type": "result", "line": 行号, ...}`: 与 `/upload` 返回的处理结果相同
+    - `{"type": "error", "line": 行号, "error_message": ...}`: 该行无法解析或超出长度上限
+    - 最后一行 `{"type": "summary", "total": ..., "succeeded": ..., "failed": ..., "items_saved": ...}`
+
+    每条记录消耗一个上传令牌，令牌不足时服务器放慢读取而不是返回 429。
+    每条记录按 `request_id` + URL + 抓取时间 + 响应体幂等，重新发送的回填中已成功处理的记录直接返回保存的结果。
+    整个上传流占用一个处理名额，服务器繁忙时返回 503 及 `Retry-After`。
+    """
+    acquire_in_flight()
+
+    logger.info(f"接收到来自用户 {user} 的流式网络数据上传请求, 并发数: {concurrency}")
+    try:
+        # 依赖中已消耗一个令牌，第一条记录不再消耗
+        content = ingest_ndjson(
+            request.stream(), network_processor, user,
+            durable=durable, concurrency=concurrency, prepaid_tokens=1
+        )
+        return NdjsonStreamingResponse(content, on_complete=ingest_in_flight.release)
+    except Exception:
+        ingest_in_flight.release()
+        raise
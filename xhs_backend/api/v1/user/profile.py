@@ -6,11 +6,13 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Dict, Any, List, Optional
 import logging
-from datetime import datetime, timedelta
 
-from database import get_database, USERS_COLLECTION, USER_INFO_COLLECTION
+from database import USERS_COLLECTION, USER_INFO_COLLECTION
 from api.deps import get_current_user, PaginationParams, get_pagination
 from api.services import get_user_info, batch_get_user_info, get_all_user_info_paginated
+from api.services.query_cache import cached_query, collection_tag
+from api.services.search_index import KeywordSearch
+from api.services.totals import TOTALS_DEFAULT_MODE, TOTAL_MODE_PATTERN
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -23,8 +25,12 @@ router = APIRouter()
 # 小红书用户信息相关API
 
 @router.get("/xhs/list", summary="获取小红书用户列表", tags=["小红书用户"])
+@cached_query("xhs_users.list", [collection_tag(USER_INFO_COLLECTION)])
 async def list_xhs_users(
     pagination: PaginationParams = Depends(get_pagination),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），提供时忽略 page"),
+    total_mode: str = Query(TOTALS_DEFAULT_MODE, alias="total", pattern=TOTAL_MODE_PATTERN,
+                            description="总数计算方式: exact（精确，短时缓存）、estimate（估算）、none（不计算）"),
     user_id: Optional[str] = Query(None, description="按用户ID搜索"),
     name: Optional[str] = Query(None, description="按用户名称搜索"),
     current_user: str = Depends(get_current_user)
@@ -34,6 +40,8 @@ async def list_xhs_users(
 
     Args:
         pagination: 分页参数
+        cursor: 分页游标，按游标翻页时任意深度的页面耗时相同（不计算总数）
+        total_mode: 总数计算方式，响应中的 total_exact 表示总数是否精确
         user_id: 用户ID搜索条件
         name: 用户名称搜索条件
         current_user: 当前认证用户名
@@ -44,53 +52,31 @@ async def list_xhs_users(
     logger.info(f"分页查询小红书用户信息: page={pagination.page}, page_size={pagination.page_size}")
     
     try:
-        # 调用现有的分页服务函数
+        # 构建查询条件
+        query = {}
+        search = KeywordSearch(USER_INFO_COLLECTION)
+        if user_id:
+            query.update(search.match(("id",), user_id))
+        if name:
+            query.update(search.match(("name",), name))
+
         user_data = await get_all_user_info_paginated(
             page=pagination.page, 
-            page_size=pagination.page_size
+            page_size=pagination.page_size,
+            cursor=cursor,
+            query=query,
+            total_mode=total_mode,
+            search=search
         )
         
-        # 如果有搜索条件，进一步过滤
-        if user_id or name:
-            db = await get_database()
-            collection = db[USER_INFO_COLLECTION]
-            
-            # 构建查询条件
-            query = {}
-            if user_id:
-                query["id"] = {"$regex": user_id, "$options": "i"}
-            if name:
-                query["name"] = {"$regex": name, "$options": "i"}
-            
-            # 重新查询
-            skip = (pagination.page - 1) * pagination.page_size
-            total = await collection.count_documents(query)
-            
-            cursor = collection.find(query).skip(skip).limit(pagination.page_size).sort("updatedAt", -1)
-            users = await cursor.to_list(length=pagination.page_size)
-
-            # 处理结果
-            for user in users:
-                if '_id' in user:
-                    user['_id'] = str(user['_id'])
-                if 'createdAt' in user and isinstance(user['createdAt'], datetime):
-                    user['createdAt'] = user['createdAt'].isoformat()
-                if 'updatedAt' in user and isinstance(user['updatedAt'], datetime):
-                    user['updatedAt'] = user['updatedAt'].isoformat()
-
-            user_data = {
-                "items": users,
-                "total": total,
-                "page": pagination.page,
-                "page_size": pagination.page_size
-            }
-        
         return {
             "success": True,
             "message": "获取小红书用户列表成功",
             "data": user_data
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"获取小红书用户列表时出错: {e}")
         raise HTTPException(
@@ -99,6 +85,7 @@ async def list_xhs_users(
         )
 
 @router.get("/xhs/{user_id}", summary="获取小红书用户详情", tags=["小红书用户"])
+@cached_query("xhs_users.get", lambda params: [f"user:{params['user_id']}"])
 async def get_xhs_user_info(
     user_id: str,
     current_user: str = Depends(get_current_user)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+评论回复合并性能对比
+
+对比旧版 merge_comment_data（对每条已有回复线性查找新回复，O(n²)）
+与新版按ID建立索引的合并及增量更新操作生成，在 500+ 条回复的热门评论上的耗时。
+只测 CPU 开销，不需要数据库。
+
+使用方法：
+python benchmarks/bench_comment_merge.py --replies 500 1000 2000 --repeat 20
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径，确保可以导入项目模块
+sys.path.append(str(Path(__file__).parent.parent))
+
+from api.services.comment import merge_comment_data, build_comment_merge_operations
+
+def legacy_merge_comment_data(existing_comment, new_comment_data):
+    """旧版实现（保留用于对比）"""
+    merged_comment = existing_comment.copy()
+    for key, value in new_comment_data.items():
+        if key not in ["_id", "replies"]:
+            merged_comment[key] = value
+
+    existing_replies = merged_comment.get("replies", [])
+    new_replies = new_comment_data.get("replies", [])
+    if not new_replies:
+        return merged_comment
+
+    merged_replies_list = []
+    existing_replies_map = {reply["id"]: reply for reply in existing_replies if reply.get("id")}
+    processed_new_reply_ids = set()
+    for existing_reply in existing_replies:
+        reply_id = existing_reply.get("id")
+        if reply_id and reply_id in existing_replies_map:
+            corresponding_new_reply = next((nr for nr in new_replies if nr.get("id") == reply_id), None)
+            if corresponding_new_reply:
+                merged_replies_list.append(legacy_merge_comment_data(existing_reply, corresponding_new_reply))
+                processed_new_reply_ids.add(reply_id)
+            else:
+                merged_replies_list.append(existing_reply)
+        else:
+            merged_replies_list.append(existing_reply)
+    for new_reply in new_replies:
+        reply_id = new_reply.get("id")
+        if not reply_id or reply_id not in processed_new_reply_ids:
+            merged_replies_list.append(new_reply)
+    merged_comment["replies"] = merged_replies_list
+    return merged_comment
+
+def make_thread(reply_count: int):
+    """构造一条已有评论和一次新抓取：90% 回复不变，5% 点赞数变化，5% 新回复"""
+    existing = {
+        "_id": "doc",
+        "id": "c1",
+        "noteId": "n1",
+        "content": "热门评论",
+        "replies": [
+            {"id": f"r{i}", "content": f"回复 {i}", "likeCount": str(i), "authorId": f"u{i % 97}"}
+            for i in range(reply_count)
+        ],
+    }
+    new_replies = []
+    for i in range(reply_count):
+        reply = dict(existing["replies"][i])
+        if i % 20 == 0:
+            reply["likeCount"] = str(i + 1)
+        new_replies.append(reply)
+    new_replies.extend(
+        {"id": f"r{reply_count + i}", "content": f"新回复 {i}", "likeCount": "0"}
+        for i in range(reply_count // 20)
+    )
+    incoming = {"id": "c1", "noteId": "n1", "content": "热门评论", "replies": new_replies}
+    return existing, incoming
+
+def timeit(func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main(args):
+    print(f"{'回复数':>8}{'旧版合并(ms)':>16}{'新版合并(ms)':>16}{'增量操作(ms)':>16}{'更新操作数':>12}")
+    for reply_count in args.replies:
+        existing, incoming = make_thread(reply_count)
+        legacy_ms = timeit(lambda: legacy_merge_comment_data(existing, incoming), args.repeat)
+        merged_ms = timeit(lambda: merge_comment_data(existing, incoming), args.repeat)
+        ops_ms = timeit(lambda: build_comment_merge_operations(existing, incoming), args.repeat)
+        operations = build_comment_merge_operations(existing, incoming)
+        assert legacy_merge_comment_data(existing, incoming) == merge_comment_data(existing, incoming)
+        print(f"{reply_count:>8}{legacy_ms:>16.2f}{merged_ms:>16.2f}{ops_ms:>16.2f}{len(operations):>12}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="评论回复合并性能对比")
+    parser.add_argument("--replies", type=int, nargs="+", default=[500, 1000, 2000], help="每条评论的回复数")
+    parser.add_argument("--repeat", type=int, default=10, help="每组重复次数")
+    main(parser.parse_args())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+上传处理日志开销对比
+
+对一页评论上传执行识别、解码、解析、转换（不写数据库），比较不同日志配置下
+每次上传在请求线程上的CPU时间（以及包含后台日志线程在内的进程CPU时间）：
+1. 同步输出 + DEBUG：逐条评论输出日志，相当于改造前逐条 INFO 日志的开销
+2. 同步输出 + INFO
+3. 队列输出 + INFO：请求线程只把日志记录放入队列，格式化和写文件在后台线程
+
+使用方法：
+python benchmarks/bench_ingest_logging.py --comments 50 200 --repeat 100
+"""
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import QueueListener
+from pathlib import Path
+
+# 添加项目根目录到路径，确保可以导入项目模块
+sys.path.append(str(Path(__file__).parent.parent))
+
+from api.models.network import RawNetworkData
+from api.services.logging_setup import LogBudgetFilter, _DeferredFormatQueueHandler, log_budget
+from api.services.network_data_processor import network_processor
+from api.services.note_cache import note_metadata_cache
+
+NOTE_ID = "66aa00000000000000000000"
+COMMENT_PAGE_URL = f"https://edith.xiaohongshu.com/api/sns/web/v2/comment/page?note_id={NOTE_ID}&cursor="
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def make_upload(comment_count: int) -> RawNetworkData:
+    comments = []
+    for i in range(comment_count):
+        comments.append({
+            "id": f"c{i}",
+            "note_id": NOTE_ID,
+            "content": "这是一条评论内容[笑哭R]" * 3,
+            "create_time": 1717000000000 + i,
+            "ip_location": "上海",
+            "like_count": str(i),
+            "user_info": {"user_id": f"5f{i:022d}", "nickname": f"用户{i}", "image": "https://example.com/a.jpg"},
+            "sub_comments": [],
+        })
+    body = {"code": 0, "success": True, "data": {"comments": comments, "cursor": "", "has_more": True}}
+    return RawNetworkData(
+        rule_name="评论页面接口",
+        url=COMMENT_PAGE_URL,
+        method="GET",
+        status_code=200,
+        response_body=json.dumps(body, ensure_ascii=False),
+        timestamp="2024-06-01T12:00:00",
+        request_id="bench",
+    )
+
+def configure(mode: str, log_file: str):
+    """按模式重新配置根日志器，返回需要在结束时停止的监听器"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    if mode == "queue":
+        queue_handler = _DeferredFormatQueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(LogBudgetFilter())
+        root.addHandler(queue_handler)
+        root.setLevel(logging.INFO)
+        listener = QueueListener(queue_handler.queue, file_handler)
+        listener.start()
+        return listener
+
+    root.addHandler(file_handler)
+    root.setLevel(logging.DEBUG if mode == "sync-debug" else logging.INFO)
+    return None
+
+async def run(raw_data: RawNetworkData, repeat: int):
+    thread_started = time.thread_time()
+    process_started = time.process_time()
+    for _ in range(repeat):
+        with log_budget(label="上传处理"):
+            parsed = await network_processor.parse_raw_data(raw_data, archive=False, dedup=False)
+            assert not hasattr(parsed, "success"), parsed
+    return (
+        (time.thread_time() - thread_started) / repeat * 1000,
+        (time.process_time() - process_started) / repeat * 1000,
+    )
+
+async def main(args):
+    # 预先写入笔记缓存，解析时不需要查询数据库
+    note_metadata_cache._store(NOTE_ID, {"noteId": NOTE_ID, "title": "基准测试笔记"})
+
+    modes = [
+        ("sync-debug", "同步输出 + DEBUG（改造前）"),
+        ("sync-info", "同步输出 + INFO"),
+        ("queue", "队列输出 + INFO"),
+    ]
+    print(f"{'评论数':>6}  {'模式':<24}{'请求线程CPU(ms)':>16}{'进程CPU(ms)':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for comment_count in args.comments:
+            raw_data = make_upload(comment_count)
+            for mode, label in modes:
+                listener = configure(mode, str(Path(tmp) / f"{mode}.log"))
+                await run(raw_data, max(1, args.repeat // 10))  # 预热
+                thread_ms, process_ms = await run(raw_data, args.repeat)
+                if listener is not None:
+                    listener.stop()
+                print(f"{comment_count:>6}  {label:<24}{thread_ms:>16.3f}{process_ms:>14.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上传处理日志开销对比")
+    parser.add_argument("--comments", type=int, nargs="+", default=[50, 200], help="每页评论数")
+    parser.add_argument("--repeat", type=int, default=100, help="每组重复次数")
+    asyncio.run(main(parser.parse_args()))
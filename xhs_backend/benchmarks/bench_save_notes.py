@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+save_notes 性能对比
+
+对比旧版逐条 find_one + replace_one/insert_one 与新版单次 bulk_write 更新插入
+保存 1000 条笔记时的数据库往返次数与耗时。需要可访问的 MongoDB，
+基准测试在临时数据库中进行，结束后删除。
+
+使用方法：
+python benchmarks/bench_save_notes.py --notes 1000 --mongo mongodb://localhost:27017/
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import monitoring
+
+# 添加项目根目录到路径，确保可以导入项目模块
+sys.path.append(str(Path(__file__).parent.parent))
+
+class CommandCounter(monitoring.CommandListener):
+    """统计发往 MongoDB 的命令数（即往返次数）"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in ("ping", "hello", "isMaster", "endSessions"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def make_notes(count: int, round_no: int):
+    return [
+        {
+            "noteId": f"bench{i:06d}",
+            "title": f"基准笔记 {i}" if round_no == 0 or i % 2 else None,
+            "noteContent": f"内容 {i} 第 {round_no} 轮",
+            "authorId": f"author{i % 50}",
+            "noteLike": i + round_no,
+            "noteCommitCount": i % 30,
+            "fetchTimestamp": datetime.utcnow(),
+        }
+        for i in range(count)
+    ]
+
+async def legacy_save_notes(collection, notes):
+    """旧版实现：每条笔记一次查询加一次写入"""
+    for note_data in notes:
+        existing = await collection.find_one({"noteId": note_data["noteId"]})
+        if existing:
+            await collection.replace_one({"_id": existing["_id"]}, note_data)
+        else:
+            await collection.insert_one(note_data)
+
+async def run(args):
+    import motor.motor_asyncio
+    import database
+    from database import NOTES_COLLECTION
+    from api.services.note import save_notes, ensure_note_indexes
+
+    counter = CommandCounter()
+    client = motor.motor_asyncio.AsyncIOMotorClient(args.mongo, event_listeners=[counter])
+    bench_db = client[args.db]
+    # 服务层通过全局 db 访问数据库，指向临时库
+    database.client = client
+    database.db = bench_db
+
+    results = []
+    try:
+        for label in ("legacy", "bulk"):
+            await bench_db[NOTES_COLLECTION].drop()
+            if label == "bulk":
+                await ensure_note_indexes()
+            else:
+                await bench_db[NOTES_COLLECTION].create_index("noteId")
+
+            # 第 0 轮全部插入，第 1 轮全部更新
+            for round_no in range(2):
+                notes = make_notes(args.notes, round_no)
+                counter.count = 0
+                started = time.perf_counter()
+                if label == "legacy":
+                    await legacy_save_notes(bench_db[NOTES_COLLECTION], notes)
+                else:
+                    await save_notes(notes)
+                elapsed = time.perf_counter() - started
+                results.append((label, "insert" if round_no == 0 else "update", counter.count, elapsed))
+    finally:
+        await client.drop_database(args.db)
+        client.close()
+
+    print(f"{'实现':<8}{'阶段':<8}{'往返次数':>10}{'耗时(秒)':>12}")
+    for label, phase, round_trips, elapsed in results:
+        print(f"{label:<8}{phase:<8}{round_trips:>10}{elapsed:>12.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="save_notes 性能对比")
+    parser.add_argument("--notes", type=int, default=1000, help="笔记数量")
+    parser.add_argument("--mongo", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017/"), help="MongoDB 连接字符串")
+    parser.add_argument("--db", default="xhs_bench_save_notes", help="临时数据库名")
+    asyncio.run(run(parser.parse_args()))
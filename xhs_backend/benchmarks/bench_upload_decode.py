@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+上传解码开销对比
+
+对比大评论页上传的三种解码方式的每次上传CPU时间：
+1. 现有 /upload：pydantic 解码信封（响应体为字符串）后再 json.loads 响应体
+2. /upload/raw 内嵌JSON：整个请求一次解码，再编码一次用于归档/去重指纹
+3. /upload/raw multipart：信封与原始响应字节分开，各解码一次
+
+使用方法：
+python benchmarks/bench_upload_decode.py --comments 200 300 --repeat 50
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径，确保可以导入项目模块
+sys.path.append(str(Path(__file__).parent.parent))
+
+from api.models.network import RawNetworkData
+from api.services.upload_codec import decode_embedded_upload, decode_multipart_upload, orjson
+
+COMMENT_PAGE_URL = "https://edith.xiaohongshu.com/api/sns/web/v2/comment/page?note_id=66aa00000000000000000000&cursor="
+
+def make_comment_page(comment_count: int, sub_comments: int = 3):
+    def comment(i, j=None):
+        cid = f"c{i}" if j is None else f"c{i}-{j}"
+        return {
+            "id": cid,
+            "note_id": "66aa00000000000000000000",
+            "content": "这是一条评论内容，包含一些表情[笑哭R]和较长的文字。" * 3,
+            "create_time": 1717000000000 + i,
+            "ip_location": "上海",
+            "like_count": str(i * 3),
+            "liked": False,
+            "status": 0,
+            "user_info": {
+                "user_id": f"5f{i:022d}",
+                "nickname": f"用户{i}",
+                "image": f"https://sns-avatar-qc.xhscdn.com/avatar/{i:032x}.jpg?imageView2/2/w/120/format/jpg",
+            },
+            "show_tags": [],
+            "at_users": [],
+            "pictures": [],
+        }
+
+    comments = []
+    for i in range(comment_count):
+        item = comment(i)
+        item["sub_comments"] = [comment(i, j) for j in range(sub_comments)]
+        item["sub_comment_count"] = str(sub_comments)
+        item["sub_comment_has_more"] = False
+        comments.append(item)
+    return {"code": 0, "success": True, "msg": "成功", "data": {"comments": comments, "cursor": "", "has_more": True}}
+
+def envelope():
+    return {
+        "rule_name": "评论页面",
+        "url": COMMENT_PAGE_URL,
+        "method": "GET",
+        "status_code": 200,
+        "timestamp": "2024-06-01T12:00:00",
+        "request_id": "bench",
+    }
+
+def cpu_ms(func, repeat: int) -> float:
+    started = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - started) / repeat * 1000
+
+def main(args):
+    print(f"orjson: {'可用' if orjson is not None else '不可用（使用标准库 json）'}")
+    print(f"{'评论数':>8}{'响应大小(KB)':>14}{'现有双重解码(ms)':>20}{'内嵌JSON(ms)':>16}{'multipart(ms)':>16}")
+    for comment_count in args.comments:
+        page = make_comment_page(comment_count)
+        response_text = json.dumps(page, ensure_ascii=False)
+        response_bytes = response_text.encode("utf-8")
+
+        legacy_request = json.dumps({**envelope(), "response_body": response_text}, ensure_ascii=False).encode("utf-8")
+        embedded_request = json.dumps({**envelope(), "response_json": page}, ensure_ascii=False).encode("utf-8")
+        meta = json.dumps(envelope(), ensure_ascii=False)
+
+        def legacy():
+            raw_data = RawNetworkData.model_validate_json(legacy_request)
+            json.loads(raw_data.response_body)
+            # 归档/去重指纹需要的字节
+            raw_data.response_body.encode("utf-8")
+
+        legacy_ms = cpu_ms(legacy, args.repeat)
+        embedded_ms = cpu_ms(lambda: decode_embedded_upload(embedded_request), args.repeat)
+        multipart_ms = cpu_ms(lambda: decode_multipart_upload(meta, response_bytes), args.repeat)
+        print(f"{comment_count:>8}{len(response_bytes) / 1024:>14.1f}{legacy_ms:>20.2f}{embedded_ms:>16.2f}{multipart_ms:>16.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上传解码开销对比")
+    parser.add_argument("--comments", type=int, nargs="+", default=[100, 200, 400], help="每页评论数（每条带3条子评论）")
+    parser.add_argument("--repeat", type=int, default=30, help="每组重复次数")
+    main(parser.parse_args())
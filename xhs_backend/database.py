@@ -42,6 +42,7 @@ RAW_COMMENTS_COLLECTION = "raw_comments" # 存放原始合并后的评论数据
 STRUCTURED_COMMENTS_COLLECTION = "structured_comments" # 存放结构化评论数据
 USER_INFO_COLLECTION = "user_info" # 存放小红书用户信息数据
 NOTE_DETAILS_COLLECTION = "note_details" # 存放小红书笔记详情数据
+RAW_ARCHIVE_COLLECTION = "raw_payload_archive" # 存放压缩后的原始上传响应体，用于重新处理
 
 # 初始化全局变量
 client = None
@@ -53,7 +54,9 @@ async def connect_to_mongo():
     if client is None:
         try:
             logger.info(f"尝试连接到 MongoDB: {MONGO_URL}")
-            client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+            from api.services.metrics import mongo_command_counter
+            # 注册命令监听器，用于统计每次上传产生的数据库命令数
+            client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL, event_listeners=[mongo_command_counter])
             db = client[DB_NAME]
             # 测试连接
             await client.admin.command('ping')
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+摄取队列工作进程
+
+从 Redis Streams 摄取队列中消费插件上传的原始网络数据，并通过 NetworkDataProcessor 解析入库。
+可在多台机器上启动多个实例，它们共享同一个消费组，崩溃实例遗留的消息会被其他实例认领。
+
+使用方法：
+python ingest_worker.py --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+# 添加当前目录到路径，确保可以导入项目模块
+sys.path.append(str(Path(__file__).parent))
+
+from database import connect_to_mongo, close_mongo_connection
+from api.services.bulk_writer import bulk_writer
+from api.services.ingest_queue import IngestWorkerPool
+from api.services.redis_async import close_async_redis
+from api.services.logging_setup import setup_logging
+
+# 配置日志（LOG_ASYNC_ENABLED 时由后台线程输出，进程退出时输出剩余日志）
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+setup_logging()
+logger = logging.getLogger(__name__)
+
+async def main(worker_count: int):
+    await connect_to_mongo()
+    pool = IngestWorkerPool(worker_count=worker_count)
+    try:
+        await pool.run_forever()
+    finally:
+        await bulk_writer.close()
+        await close_async_redis()
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="摄取队列工作进程")
+    parser.add_argument("--workers", type=int, default=4, help="本进程内的消费协程数")
+    args = parser.parse_args()
+
+    logger.info(f"启动摄取队列工作进程，消费协程数: {args.workers}")
+    try:
+        asyncio.run(main(args.workers))
+    except KeyboardInterrupt:
+        logger.info("摄取队列工作进程已退出")
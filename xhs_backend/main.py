@@ -15,9 +15,16 @@ from database import connect_to_mongo, close_mongo_connection, get_database
 
 # 导入API路由
 from api import api_router
-
-# 配置日志
+from api.services.ingest_queue import ingest_worker_pool
+from api.services.bulk_writer import bulk_writer
+from api.services.indexes import ensure_indexes_on_startup
+from api.services.redis_async import close_async_redis
+from api.services.metrics import mark_process_dead
+from api.services.logging_setup import setup_logging, stop_logging
+
+# 配置日志（LOG_ASYNC_ENABLED 时由后台线程输出）
 logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 加载 .env 文件
@@ -36,13 +43,28 @@ async def lifespan(app: FastAPI):
     logger.info("应用启动，尝试连接数据库...")
     try:
         await connect_to_mongo()
+        # 创建缺失的索引并报告缺失/未使用的索引
+        await ensure_indexes_on_startup()
     except Exception as e:
         logger.error(f"数据库连接失败，应用可能无法正常工作: {e}")
         # 根据需要决定是否阻止应用启动
+    # 启动进程内的摄取队列消费者（INGEST_WORKER_COUNT > 0 时）
+    try:
+        await ingest_worker_pool.start()
+    except Exception as e:
+        logger.error(f"摄取队列消费者启动失败，异步上传将只入队不处理: {e}")
     yield
     # 应用关闭时
+    await ingest_worker_pool.stop()
+    # 写入写后缓冲中剩余的数据，必须在断开数据库之前
+    await bulk_writer.close()
+    await close_async_redis()
     logger.info("应用关闭，断开数据库连接...")
-    close_mongo_connection()
+    await close_mongo_connection()
+    # 多进程指标模式下清理本 worker 的实时数据
+    mark_process_dead()
+    # 输出日志队列中剩余的日志
+    stop_logging()
 
 # --- FastAPI 应用实例 ---
 app = FastAPI(
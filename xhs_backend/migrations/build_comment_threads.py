@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：回填结构化评论的线程字段（rootCommentId、depth、ancestorIds）
+
+新保存的结构化评论在写入时已维护线程字段，旧评论需要用本脚本回填。
+按笔记逐个计算（回复关系只在同一笔记内），父评论不存在的评论以父评论ID作为临时的顶级评论。
+脚本会先创建线程字段的索引；可以重复执行，每次都按当前的 repliedId 重新计算。
+
+使用方法：
+python build_comment_threads.py [--dry-run] [--batch-size 1000]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import os
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_to_mongo, close_mongo_connection, STRUCTURED_COMMENTS_COLLECTION
+from api.services.comment import backfill_comment_threads
+from api.services.indexes import ensure_indexes
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_last_logged = [0]
+
+def log_progress(processed: int):
+    """每处理约一万条输出一次进度"""
+    if processed - _last_logged[0] >= 10000:
+        _last_logged[0] = processed
+        logger.info(f"已处理 {processed} 条评论")
+
+async def main(args) -> int:
+    """主函数"""
+    try:
+        await connect_to_mongo()
+        if not args.dry_run:
+            summary = await ensure_indexes([STRUCTURED_COMMENTS_COLLECTION])
+            if summary["failed"]:
+                logger.error(f"创建结构化评论索引失败: {', '.join(summary['failed'])}")
+                return 1
+
+        processed = await backfill_comment_threads(
+            batch_size=args.batch_size, dry_run=args.dry_run, on_progress=log_progress
+        )
+        label = "将回填" if args.dry_run else "已回填"
+        logger.info(f"{label} {processed} 条结构化评论的线程字段")
+    except Exception as e:
+        logger.error(f"回填评论线程字段失败: {e}", exc_info=True)
+        return 1
+    finally:
+        await close_mongo_connection()
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回填结构化评论的线程字段（rootCommentId、depth、ancestorIds）")
+    parser.add_argument("--dry-run", action="store_true", help="只统计将要处理的评论数，不写入")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每次批量写入的评论数")
+    sys.exit(asyncio.run(main(parser.parse_args())))
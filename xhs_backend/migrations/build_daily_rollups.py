@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：重建统计接口使用的按日汇总（daily_rollups）
+
+上传保存新评论、笔记时会增量更新汇总，已有数据需要用本脚本重建；通知没有上传写入路径，
+通知的汇总只由本脚本生成，需要定期执行。某个集合重建完成后才会被标记为就绪，
+统计接口此后才读取汇总（未就绪时直接查询原集合）。脚本会先创建汇总集合的索引；可以重复执行。
+
+使用方法：
+python build_daily_rollups.py [--dry-run] [--status] [--batch-size 1000] [--collection 集合名 ...]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import os
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_to_mongo, close_mongo_connection
+from api.services.indexes import ensure_indexes
+from api.services.rollups import (
+    ROLLUP_COLLECTION, is_rollup_ready, rebuild_rollups, rollup_collections
+)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+async def main(args) -> int:
+    """主函数"""
+    collections = args.collection or rollup_collections()
+    unknown = [name for name in collections if name not in rollup_collections()]
+    if unknown:
+        logger.error(f"以下集合不维护按日汇总: {', '.join(unknown)}")
+        return 1
+
+    try:
+        await connect_to_mongo()
+        if args.status:
+            for collection_name in collections:
+                state = "就绪" if await is_rollup_ready(collection_name) else "未就绪"
+                print(f"{collection_name:<20} {state}")
+            return 0
+
+        if not args.dry_run:
+            summary = await ensure_indexes([ROLLUP_COLLECTION])
+            if summary["failed"]:
+                logger.error(f"创建汇总索引失败: {', '.join(summary['failed'])}")
+                return 1
+
+        for collection_name in collections:
+            groups = await rebuild_rollups(collection_name, batch_size=args.batch_size, dry_run=args.dry_run)
+            label = "将生成" if args.dry_run else "已重建并标记就绪，共"
+            logger.info(f"{collection_name}: {label} {groups} 条汇总")
+    except Exception as e:
+        logger.error(f"重建按日汇总失败: {e}", exc_info=True)
+        return 1
+    finally:
+        await close_mongo_connection()
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="重建统计接口使用的按日汇总（daily_rollups）")
+    parser.add_argument("--dry-run", action="store_true", help="只统计将要生成的汇总数，不写入")
+    parser.add_argument("--status", action="store_true", help="只输出各集合是否已就绪")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每次批量写入的汇总数")
+    parser.add_argument("--collection", action="append", help="只处理指定集合（可重复）")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：回填关键字搜索的二元组（searchTokens）
+
+新写入的评论、笔记、笔记详情和用户信息在保存时已维护 searchTokens，旧文档需要用本脚本回填。
+某个集合回填完成后才会被标记为就绪，列表接口此后才用二元组索引缩小关键字搜索的范围。
+脚本会先创建 searchTokens 多键索引；可以重复执行。
+
+使用方法：
+python build_search_index.py [--dry-run] [--status] [--batch-size 500] [--collection 集合名 ...]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import os
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_to_mongo, close_mongo_connection
+from api.services.indexes import ensure_indexes
+from api.services.search_index import (
+    backfill_search_tokens, is_search_index_ready, searchable_collections
+)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_last_logged = {}
+
+def log_progress(collection_name: str, processed: int):
+    """每处理约一万条输出一次进度"""
+    if processed - _last_logged.get(collection_name, 0) >= 10000:
+        _last_logged[collection_name] = processed
+        logger.info(f"{collection_name}: 已处理 {processed} 条")
+
+async def main(args) -> int:
+    """主函数"""
+    collections = args.collection or searchable_collections()
+    unknown = [name for name in collections if name not in searchable_collections()]
+    if unknown:
+        logger.error(f"以下集合不维护 searchTokens: {', '.join(unknown)}")
+        return 1
+
+    try:
+        await connect_to_mongo()
+        if args.status:
+            for collection_name in collections:
+                state = "就绪" if await is_search_index_ready(collection_name) else "未就绪"
+                print(f"{collection_name:<20} {state}")
+            return 0
+
+        if not args.dry_run:
+            summary = await ensure_indexes(collections)
+            if summary["failed"]:
+                logger.error(f"创建 searchTokens 索引失败: {', '.join(summary['failed'])}")
+                return 1
+
+        for collection_name in collections:
+            processed = await backfill_search_tokens(
+                collection_name, batch_size=args.batch_size, dry_run=args.dry_run, on_progress=log_progress
+            )
+            label = "将回填" if args.dry_run else "已回填并标记就绪"
+            logger.info(f"{collection_name}: {label} {processed} 条文档")
+    except Exception as e:
+        logger.error(f"回填搜索二元组失败: {e}", exc_info=True)
+        return 1
+    finally:
+        await close_mongo_connection()
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回填关键字搜索的二元组（searchTokens）")
+    parser.add_argument("--dry-run", action="store_true", help="只统计将要处理的文档数，不写入")
+    parser.add_argument("--status", action="store_true", help="只输出各集合是否已就绪")
+    parser.add_argument("--batch-size", type=int, default=500, help="每次批量写入的文档数")
+    parser.add_argument("--collection", action="append", help="只处理指定集合（可重复）")
+    sys.exit(asyncio.run(main(parser.parse_args())))
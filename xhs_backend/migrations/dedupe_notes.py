@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：合并 notes 集合中重复的笔记并创建 noteId 唯一索引
+
+旧版 save_notes 先查询再插入，并发上传时可能为同一笔记插入多份文档。
+此脚本会：
+1. 找出 noteId 重复的笔记
+2. 保留 fetchTimestamp 最新的一份，用其他文档中的非空字段补全缺失字段
+3. 删除其余文档并创建 noteId 唯一索引
+
+使用方法：
+python dedupe_notes.py [--dry-run]
+"""
+
+import asyncio
+import logging
+import sys
+import os
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_database, NOTES_COLLECTION
+from api.services.note import ensure_note_indexes
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+async def dedupe_notes(dry_run: bool = False):
+    """合并重复笔记"""
+    database = await get_database()
+    collection = database[NOTES_COLLECTION]
+
+    pipeline = [
+        {"$group": {"_id": "$noteId", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    merged_count = 0
+    removed_count = 0
+
+    async for group in collection.aggregate(pipeline, allowDiskUse=True):
+        note_id = group["_id"]
+        docs = await collection.find({"_id": {"$in": group["ids"]}}).sort("fetchTimestamp", -1).to_list(length=None)
+        keeper = docs[0]
+        # 用较旧文档中的非空字段补全保留文档缺失的字段
+        for doc in docs[1:]:
+            for field, value in doc.items():
+                if field != "_id" and keeper.get(field) in (None, "") and value not in (None, ""):
+                    keeper[field] = value
+        duplicate_ids = [doc["_id"] for doc in docs[1:]]
+
+        logger.info(f"笔记 {note_id} 有 {len(docs)} 份文档，保留 {keeper['_id']}，删除 {len(duplicate_ids)} 份")
+        if not dry_run:
+            await collection.replace_one({"_id": keeper["_id"]}, keeper)
+            await collection.delete_many({"_id": {"$in": duplicate_ids}})
+        merged_count += 1
+        removed_count += len(duplicate_ids)
+
+    logger.info(f"合并完成: {merged_count} 个笔记存在重复，删除 {removed_count} 份重复文档")
+
+async def main(dry_run: bool):
+    """主函数"""
+    logger.info("开始合并重复笔记" + ("（仅预览）" if dry_run else ""))
+
+    try:
+        await dedupe_notes(dry_run)
+        if not dry_run:
+            await ensure_note_indexes()
+            logger.info("已创建 noteId 唯一索引")
+    except Exception as e:
+        logger.error(f"迁移任务失败: {e}", exc_info=True)
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main("--dry-run" in sys.argv))
+    sys.exit(exit_code)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：创建 api/services/indexes.py 中声明的索引并输出索引使用报告
+
+应用启动时也会执行同样的检查（MONGO_ENSURE_INDEXES=true），
+数据量大的集合建议在低峰期先用本脚本建好索引，避免启动时长时间建索引。
+
+使用方法：
+python ensure_indexes.py [--dry-run] [--report-only] [--collection 集合名 ...]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import os
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_to_mongo, close_mongo_connection
+from api.services.indexes import ensure_indexes, index_report
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def print_report(report):
+    """输出各集合的索引使用情况"""
+    for collection_name, entry in report.items():
+        print(f"\n== {collection_name} ==")
+        if entry["missing"]:
+            print(f"  缺失: {', '.join(entry['missing'])}")
+        if entry["undeclared"]:
+            print(f"  未声明: {', '.join(entry['undeclared'])}")
+        for name, stats in sorted(entry["usage"].items()):
+            marker = "  (未使用)" if name in entry["unused"] else ""
+            print(f"  {name:<40} ops={stats['ops']:<10} since={stats['since']}{marker}")
+
+async def main(args) -> int:
+    """主函数"""
+    collections = args.collection or None
+    try:
+        await connect_to_mongo()
+        if not args.report_only:
+            summary = await ensure_indexes(collections, dry_run=args.dry_run)
+            if summary["created"]:
+                label = "将创建" if args.dry_run else "已创建"
+                logger.info(f"{label}: {', '.join(summary['created'])}")
+            if summary["conflicts"]:
+                logger.warning(f"键相同但选项不同（需手动处理）: {', '.join(summary['conflicts'])}")
+            if summary["failed"]:
+                logger.error(f"创建失败: {', '.join(summary['failed'])}")
+        print_report(await index_report(collections))
+    except Exception as e:
+        logger.error(f"索引任务失败: {e}", exc_info=True)
+        return 1
+    finally:
+        await close_mongo_connection()
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="创建声明的索引并输出索引使用报告")
+    parser.add_argument("--dry-run", action="store_true", help="只列出将要创建的索引")
+    parser.add_argument("--report-only", action="store_true", help="只输出索引报告")
+    parser.add_argument("--collection", action="append", help="只处理指定集合（可重复）")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+归档重新处理脚本
+
+从原始响应体归档中流式读取历史上传，并行交给当前版本的 NetworkDataProcessor 解析入库。
+解析器修复后可用它恢复数据，而不需要重新浏览小红书。
+
+使用方法：
+python reprocess_archive.py --start 2024-12-01 --end 2024-12-31 --data-type comment_page
+python reprocess_archive.py --target-db xhs_scratch --concurrency 16
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加当前目录到路径，确保可以导入项目模块
+sys.path.append(str(Path(__file__).parent))
+
+import database
+from database import connect_to_mongo, close_mongo_connection
+from api.services.bulk_writer import bulk_writer
+from api.services.network_data_processor import NetworkDataProcessor
+from api.services.raw_archive import build_archive_query, iter_archived_payloads, archived_doc_to_raw_data
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d")
+
+async def reprocess(args) -> dict:
+    await connect_to_mongo()
+    source_db = database.db
+
+    # 写入临时数据库：服务层通过 get_database() 获取全局 db，替换后所有保存操作都会落到目标库
+    if args.target_db:
+        database.db = database.client[args.target_db]
+        logger.info(f"重新处理结果将写入临时数据库: {args.target_db}")
+
+    end = parse_date(args.end) + timedelta(days=1) if args.end else None
+    query = build_archive_query(
+        start=parse_date(args.start) if args.start else None,
+        end=end,
+        data_type=args.data_type
+    )
+    logger.info(f"归档查询条件: {query}")
+
+    processor = NetworkDataProcessor()
+    stats = {"total": 0, "succeeded": 0, "failed": 0, "items_saved": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    pending = set()
+
+    async def run_one(doc):
+        try:
+            raw_data = archived_doc_to_raw_data(doc)
+            result = await processor.process_raw_data(raw_data, archive=False, dedup=False, durable=True)
+            if result.success:
+                stats["succeeded"] += 1
+                stats["items_saved"] += result.items_saved
+            else:
+                stats["failed"] += 1
+                logger.warning(f"重新处理失败: {doc['_id']} ({doc.get('data_type')}): {result.error_message}")
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"重新处理归档 {doc['_id']} 时出错: {e}")
+        finally:
+            semaphore.release()
+
+    started = time.monotonic()
+    try:
+        async for doc in iter_archived_payloads(source_db, query):
+            # 信号量限制同时处理的数量，读取游标随处理进度推进，内存占用保持稳定
+            await semaphore.acquire()
+            task = asyncio.create_task(run_one(doc))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            stats["total"] += 1
+            if args.limit and stats["total"] >= args.limit:
+                break
+            if stats["total"] % 1000 == 0:
+                logger.info(f"已提交 {stats['total']} 条归档，成功 {stats['succeeded']}，失败 {stats['failed']}")
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        await bulk_writer.close()
+        await close_mongo_connection()
+
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从原始响应体归档重新处理数据")
+    parser.add_argument("--start", help="开始日期 YYYY-MM-DD（按首次接收时间）")
+    parser.add_argument("--end", help="结束日期 YYYY-MM-DD（包含当天）")
+    parser.add_argument("--data-type", help="只处理指定数据类型，如 comment_page")
+    parser.add_argument("--target-db", help="写入指定的临时数据库，而不是当前数据库")
+    parser.add_argument("--concurrency", type=int, default=8, help="并行处理数量")
+    parser.add_argument("--limit", type=int, default=0, help="最多处理的归档数量，0 表示不限制")
+    args = parser.parse_args()
+
+    result = asyncio.run(reprocess(args))
+    logger.info(f"重新处理完成: {result}")
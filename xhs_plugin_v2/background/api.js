@@ -71,6 +71,27 @@ function decodeArrayBuffer(buffer) {
     }
 }
 
+// 捕获的数据先在内存中攒批（时间窗口或条数/大小达到上限时发送），gzip 压缩后发送到批量上传接口。
+const UPLOAD_BATCH_WINDOW_MS = 3000;
+const UPLOAD_BATCH_MAX_ITEMS = 20;
+const UPLOAD_BATCH_MAX_BYTES = 2 * 1024 * 1024; // 按响应体长度估算的未压缩大小
+
+let uploadBatch = [];
+let uploadBatchBytes = 0;
+let uploadBatchTimer = null;
+
+// 上传被限流（429）或服务器繁忙（503）时不丢弃数据，而是按 Retry-After 退避后重新排队上传。
+// 重试队列保存在 chrome.storage.local 中，service worker 被回收后重新启动也会继续上传。
+const UPLOAD_RETRY_STORAGE_KEY = 'xhs_upload_retry_queue';
+const UPLOAD_RETRY_MAX_QUEUE = 50; // 队列中的批次数上限，超出时丢弃最早的批次
+const UPLOAD_RETRY_MAX_ATTEMPTS = 8;
+const UPLOAD_RETRY_BASE_DELAY_MS = 2000; // 没有 Retry-After 时的指数退避起始间隔
+const UPLOAD_RETRY_MAX_DELAY_MS = 5 * 60 * 1000;
+
+let uploadRetryQueue = [];
+let uploadRetryTimer = null;
+let uploadBackoffUntil = 0; // 退避结束前的新批次直接进入重试队列
+
 /**
  * 上传网络数据到后端
  * @param {object} details - 请求详情，应包含响应数据
@@ -118,58 +139,256 @@ export async function uploadNetworkData(details, matchedRule) {
             request_id: details.requestId
         };
         
-        console.log('[Background] 上传 Payload:', payload);
+        addToUploadBatch(payload);
 
-        const response = await fetch(`${globalState.apiConfig.host}/api/v1/system/network-data/upload`, {
+    } catch (error) {
+        console.error('[Background] 上传网络数据时发生严重错误:', error);
+    }
+}
+
+/**
+ * 加入当前批次，条数或大小达到上限时立即发送
+ * @param {object} payload - RawNetworkData 格式的数据
+ */
+function addToUploadBatch(payload) {
+    uploadBatch.push(payload);
+    uploadBatchBytes += (payload.response_body?.length || 0) + (payload.request_body?.length || 0);
+
+    if (uploadBatch.length >= UPLOAD_BATCH_MAX_ITEMS || uploadBatchBytes >= UPLOAD_BATCH_MAX_BYTES) {
+        flushUploadBatch();
+    } else if (!uploadBatchTimer) {
+        uploadBatchTimer = setTimeout(flushUploadBatch, UPLOAD_BATCH_WINDOW_MS);
+    }
+}
+
+/**
+ * 发送当前批次
+ */
+function flushUploadBatch() {
+    if (uploadBatchTimer) {
+        clearTimeout(uploadBatchTimer);
+        uploadBatchTimer = null;
+    }
+    if (uploadBatch.length === 0) return;
+
+    const payloads = uploadBatch;
+    uploadBatch = [];
+    uploadBatchBytes = 0;
+    sendUploadBatch(payloads, 0).catch(error => {
+        console.error('[Background] 批量上传网络数据时发生严重错误:', error);
+    });
+}
+
+/**
+ * gzip 压缩请求体（浏览器不支持 CompressionStream 时返回 null）
+ * @param {string} text - JSON 字符串
+ * @returns {Promise<Blob|null>}
+ */
+async function gzipText(text) {
+    if (typeof CompressionStream === 'undefined') return null;
+    try {
+        const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+        return await new Response(stream).blob();
+    } catch (e) {
+        console.warn('[Background] gzip 压缩失败，发送未压缩数据:', e);
+        return null;
+    }
+}
+
+/**
+ * 发送一批上传数据，限流或网络错误时放入重试队列
+ * @param {object[]} payloads - RawNetworkData 格式的数据列表
+ * @param {number} attempts - 已重试次数
+ */
+async function sendUploadBatch(payloads, attempts) {
+    if (Date.now() < uploadBackoffUntil) {
+        enqueueUploadRetry(payloads, attempts, uploadBackoffUntil - Date.now());
+        return;
+    }
+
+    const json = JSON.stringify(payloads);
+    const compressed = await gzipText(json);
+    const headers = {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${globalState.apiConfig.token}`
+    };
+    if (compressed) {
+        headers['Content-Encoding'] = 'gzip';
+    }
+
+    let response;
+    try {
+        response = await fetch(`${globalState.apiConfig.host}/api/v1/system/network-data/upload/batch`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'Authorization': `Bearer ${globalState.apiConfig.token}`
-            },
-            body: JSON.stringify(payload)
+            headers,
+            body: compressed || json
         });
+    } catch (networkError) {
+        // 网络错误（后端不可达等）同样退避重试，不丢弃数据
+        console.warn('[Background] 上传网络数据时网络错误，稍后重试:', networkError.message);
+        enqueueUploadRetry(payloads, attempts + 1, computeBackoffDelay(attempts + 1));
+        return;
+    }
 
-        if (response.status === 401) {
-            console.warn('[Background] 上传数据时收到401，尝试刷新令牌并重试...');
+    if (response.status === 401) {
+        console.warn('[Background] 上传数据时收到401，尝试刷新令牌并重试...');
+        
+        try {
+        await refreshApiToken();
             
-            try {
-            await refreshApiToken();
-                
-                // 检查token是否刷新成功
-                if (!globalState.apiConfig.token) {
-                    console.log('[Background] 上传数据时token刷新失败，清除过期凭据');
-                    clearExpiredCredentials();
-                    notifyPopupTokenExpired('上传数据时token刷新失败');
-                    return;
-                }
-                
-            // 重试时需要重新获取 token，因此直接再次调用即可
-            await uploadNetworkData(details, matchedRule);
-            return; // 避免执行下面的逻辑
-                
-            } catch (refreshError) {
-                console.error('[Background] 上传数据时token刷新失败:', refreshError);
+            // 检查token是否刷新成功
+            if (!globalState.apiConfig.token) {
+                console.log('[Background] 上传数据时token刷新失败，清除过期凭据');
                 clearExpiredCredentials();
-                notifyPopupTokenExpired(`上传数据失败: ${refreshError.message}`);
+                notifyPopupTokenExpired('上传数据时token刷新失败');
                 return;
             }
+            
+        // 重试时需要重新获取 token，因此直接再次发送即可
+        await sendUploadBatch(payloads, attempts);
+        return; // 避免执行下面的逻辑
+            
+        } catch (refreshError) {
+            console.error('[Background] 上传数据时token刷新失败:', refreshError);
+            clearExpiredCredentials();
+            notifyPopupTokenExpired(`上传数据失败: ${refreshError.message}`);
+            return;
         }
+    }
 
-        if (!response.ok) {
-            const errorData = await response.json().catch(() => ({ detail: response.statusText }));
-            throw new Error(`上传失败: ${response.status} - ${errorData.detail || '未知错误'}`);
-        }
+    if (response.status === 429 || response.status === 503) {
+        // 后端限流或繁忙：按 Retry-After 退避，期间的新批次也进入队列
+        const delay = parseRetryAfter(response.headers.get('Retry-After')) ?? computeBackoffDelay(attempts + 1);
+        uploadBackoffUntil = Date.now() + delay;
+        console.warn(`[Background] 上传被限流 (${response.status})，${Math.round(delay / 1000)} 秒后重试 ${payloads.length} 条数据`);
+        enqueueUploadRetry(payloads, attempts + 1, delay);
+        return;
+    }
 
-        const result = await response.json();
-        if (result.success) {
-            console.log(`[Background] 网络数据上传成功，URL: ${details.url}, 保存条目: ${result.items_saved}`);
-        } else {
-            console.error(`[Background] 网络数据上传后，后端处理失败: ${result.error_message}`);
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ detail: response.statusText }));
+        throw new Error(`上传失败: ${response.status} - ${errorData.detail || '未知错误'}`);
+    }
+
+    const result = await response.json();
+    console.log(`[Background] 批量上传完成: ${payloads.length} 条数据 (${compressed ? `gzip ${json.length} → ${compressed.size} 字节` : `${json.length} 字节`}), 保存条目: ${result.total_items_saved}`);
+    (result.results || []).forEach((item, index) => {
+        if (!item.success) {
+            console.error(`[Background] 网络数据上传后，后端处理失败: ${item.error_message}, URL: ${payloads[index]?.url}`);
         }
+    });
+}
 
-    } catch (error) {
-        console.error('[Background] 上传网络数据时发生严重错误:', error);
+/**
+ * 解析 Retry-After 响应头（秒数或HTTP日期）
+ * @param {string|null} value - 响应头的值
+ * @returns {number|null} - 需等待的毫秒数
+ */
+function parseRetryAfter(value) {
+    if (!value) return null;
+    const seconds = Number(value);
+    if (Number.isFinite(seconds)) {
+        return Math.max(0, seconds * 1000);
     }
+    const date = Date.parse(value);
+    return Number.isNaN(date) ? null : Math.max(0, date - Date.now());
+}
+
+/**
+ * 指数退避间隔（带随机抖动，避免多个插件同时重试）
+ * @param {number} attempts - 第几次重试
+ * @returns {number} - 毫秒数
+ */
+function computeBackoffDelay(attempts) {
+    const delay = Math.min(UPLOAD_RETRY_BASE_DELAY_MS * 2 ** Math.max(attempts - 1, 0), UPLOAD_RETRY_MAX_DELAY_MS);
+    return delay / 2 + Math.random() * delay / 2;
+}
+
+/**
+ * 放入重试队列
+ * @param {object[]} payloads - 一批上传数据
+ * @param {number} attempts - 已重试次数
+ * @param {number} delay - 最早重试前需等待的毫秒数
+ */
+function enqueueUploadRetry(payloads, attempts, delay) {
+    if (attempts > UPLOAD_RETRY_MAX_ATTEMPTS) {
+        console.error(`[Background] 上传重试 ${UPLOAD_RETRY_MAX_ATTEMPTS} 次后仍失败，放弃 ${payloads.length} 条数据`);
+        return;
+    }
+
+    uploadRetryQueue.push({ payloads, attempts, notBefore: Date.now() + delay });
+    if (uploadRetryQueue.length > UPLOAD_RETRY_MAX_QUEUE) {
+        const dropped = uploadRetryQueue.shift();
+        console.warn(`[Background] 上传重试队列已满，丢弃最早的 ${dropped.payloads.length} 条数据`);
+    }
+    saveUploadRetryQueue();
+    scheduleUploadRetry();
+}
+
+function saveUploadRetryQueue() {
+    chrome.storage.local.set({ [UPLOAD_RETRY_STORAGE_KEY]: uploadRetryQueue });
+}
+
+/**
+ * 在队列中最早可重试的时间设置定时器
+ */
+function scheduleUploadRetry() {
+    if (uploadRetryTimer) {
+        clearTimeout(uploadRetryTimer);
+        uploadRetryTimer = null;
+    }
+    if (uploadRetryQueue.length === 0) return;
+
+    const nextAt = Math.max(uploadBackoffUntil, Math.min(...uploadRetryQueue.map(entry => entry.notBefore)));
+    uploadRetryTimer = setTimeout(processUploadRetryQueue, Math.max(0, nextAt - Date.now()));
+}
+
+/**
+ * 依次重新上传已到期的数据；再次被限流时剩余数据继续等待
+ */
+async function processUploadRetryQueue() {
+    uploadRetryTimer = null;
+
+    while (Date.now() >= uploadBackoffUntil) {
+        const index = uploadRetryQueue.findIndex(entry => entry.notBefore <= Date.now());
+        if (index === -1) break;
+
+        const [entry] = uploadRetryQueue.splice(index, 1);
+        saveUploadRetryQueue();
+        if (!globalState.apiConfig?.host || !globalState.apiConfig.token) {
+            console.warn('[Background] 缺少API主机或认证令牌，暂停重试上传');
+            uploadRetryQueue.unshift(entry);
+            saveUploadRetryQueue();
+            return;
+        }
+        try {
+            await sendUploadBatch(entry.payloads, entry.attempts);
+        } catch (error) {
+            console.error('[Background] 重试上传网络数据失败:', error);
+        }
+    }
+    scheduleUploadRetry();
+}
+
+/**
+ * 恢复上次未完成的重试队列（插件启动时调用）
+ * @returns {Promise<void>}
+ */
+export function restoreUploadRetryQueue() {
+    return new Promise((resolve) => {
+        chrome.storage.local.get([UPLOAD_RETRY_STORAGE_KEY], function(result) {
+            // 兼容单条上传时期保存的 { payload } 格式
+            const saved = (result[UPLOAD_RETRY_STORAGE_KEY] || []).map(entry =>
+                entry.payloads ? entry : { payloads: [entry.payload], attempts: entry.attempts, notBefore: entry.notBefore }
+            );
+            if (saved.length > 0) {
+                uploadRetryQueue = saved.concat(uploadRetryQueue).slice(-UPLOAD_RETRY_MAX_QUEUE);
+                console.log(`[Background] 恢复了 ${saved.length} 条待重试的上传`);
+                scheduleUploadRetry();
+            }
+            resolve();
+        });
+    });
 }
 
 /**
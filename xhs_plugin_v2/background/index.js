@@ -1,6 +1,6 @@
 import { globalState } from '../shared/state.js';
 import { loadConfig, loadApiConfig, loadRequestStats, logRequest, updateRequestLog } from './storage.js';
-import { loadCaptureRules, refreshApiToken, uploadNetworkData } from './api.js';
+import { loadCaptureRules, refreshApiToken, uploadNetworkData, restoreUploadRetryQueue } from './api.js';
 import { setupWebRequestListeners, findMatchingRule } from './webRequest.js';
 
 /**
@@ -13,6 +13,8 @@ async function initializePlugin() {
     loadRequestStats();
     await loadCaptureRules();
     setupWebRequestListeners();
+    // 继续上传上次被限流后尚未完成的数据
+    await restoreUploadRetryQueue();
     console.log('[Background] 插件初始化完成');
 }
 
@@ -5,6 +5,9 @@
 // 全局变量，用于存储用户备注数据
 let userNotes = {};
 
+// 历史评论每页的笔记数
+const HISTORY_PAGE_SIZE = 20;
+
 // 代理fetch请求，避免CORS问题
 async function proxyFetch(url, options = {}) {
     const requestId = Math.random().toString(36).substr(2, 9);
@@ -65,10 +68,10 @@ async function proxyFetch(url, options = {}) {
     });
 }
 
-// 从后端API获取用户历史评论
-async function fetchUserHistoricalComments(userId) {
+// 从后端API获取用户历史评论（按笔记分页），返回 { items, hasMore }
+async function fetchUserHistoricalComments(userId, page = 1) {
     try {
-        console.log(`[API Service] 开始获取用户 ${userId} 的历史评论`);
+        console.log(`[API Service] 开始获取用户 ${userId} 的历史评论，第 ${page} 页`);
         
         // 从storage获取API地址和令牌
         const { apiBaseUrl, apiToken } = await getApiConfig();
@@ -81,7 +84,7 @@ async function fetchUserHistoricalComments(userId) {
             throw new Error('未配置API令牌，请先登录');
         }
         
-        const url = `/api/v1/content/comments/user/${userId}`;
+        const url = `/api/v1/content/comments/user/${userId}?page=${page}&page_size=${HISTORY_PAGE_SIZE}`;
         
         console.log(`[API Service] 通过代理请求URL: ${url}`);
         
@@ -113,10 +116,10 @@ async function fetchUserHistoricalComments(userId) {
         
         // 提取实际的评论数据数组
         if (data.success && Array.isArray(data.data)) {
-            return data.data;
+            return { items: data.data, hasMore: Boolean(data.has_more) };
         } else {
             console.warn(`[API Service] API返回的数据格式不正确:`, data);
-            return [];
+            return { items: [], hasMore: false };
         }
     } catch (error) {
         console.error(`[API Service] 获取用户 ${userId} 的历史评论时出错:`, error);
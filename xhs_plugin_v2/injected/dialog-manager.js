@@ -365,7 +365,7 @@ function loadDialogContent(index, content) {
         
         // 从后端API获取历史评论数据
         window.xhsApiService.fetchUserHistoricalComments(userId)
-            .then(historicalComments => {
+            .then(({ items: historicalComments, hasMore }) => {
                 if (!historicalComments || historicalComments.length === 0) {
                     content.innerHTML = '<p style="color: white;">该用户没有历史评论</p>';
                     return;
@@ -376,6 +376,9 @@ function loadDialogContent(index, content) {
                 
                 // 渲染历史评论树状图
                 renderHistoricalComments(content, historicalComments);
+                if (hasMore) {
+                    appendLoadMoreButton(content, userId, 2);
+                }
             })
             .catch(error => {
                 console.error('[Dialog Manager] 获取历史评论时出错:', error);
@@ -447,6 +450,42 @@ function loadDialogContent(index, content) {
     console.log(`[Dialog Manager] 显示第 ${index+1} 个通知的弹出框内容完成`);
 }
 
+// 在历史评论末尾添加"加载更多"按钮，点击后获取并追加下一页
+function appendLoadMoreButton(container, userId, page) {
+    const loadMoreBtn = document.createElement('div');
+    loadMoreBtn.className = 'xhs-plugin-load-more';
+    loadMoreBtn.textContent = '加载更多';
+    loadMoreBtn.style.cssText = `
+        cursor: pointer;
+        color: #ccc;
+        text-align: center;
+        padding: 10px 0;
+        border: 1px solid #333;
+        border-radius: 8px;
+        margin-bottom: 15px;
+    `;
+    loadMoreBtn.addEventListener('click', () => {
+        loadMoreBtn.textContent = '加载中...';
+        loadMoreBtn.style.pointerEvents = 'none';
+        window.xhsApiService.fetchUserHistoricalComments(userId, page)
+            .then(({ items, hasMore }) => {
+                container.removeChild(loadMoreBtn);
+                if (items.length > 0) {
+                    renderHistoricalComments(container, items);
+                }
+                if (hasMore) {
+                    appendLoadMoreButton(container, userId, page + 1);
+                }
+            })
+            .catch(error => {
+                console.error('[Dialog Manager] 加载更多历史评论时出错:', error);
+                loadMoreBtn.textContent = `加载失败，点击重试: ${error.message}`;
+                loadMoreBtn.style.pointerEvents = 'auto';
+            });
+    });
+    container.appendChild(loadMoreBtn);
+}
+
 // 从URL中提取用户ID
 function extractUserIdFromUrl(url) {
     try {